@@ -1,133 +1,100 @@
-import polars as pl
-import polars.selectors as cs
-import gc
 import time
 import logging
 import os
+import argparse
 from datetime import datetime
 
-from utils.config_files import load_json_config
-from utils.import_data import import_acropolis_system_data
-from utils.filter_system_data import extract_wind_data, extraxt_auxilliary_data, extract_edge_calibration_data, extract_measurement_data, extract_calibration_data
-from utils.dilution_correction import wet_to_dry_mole_fraction
+from utils.context import get_context
 from utils.os_functions import ensure_data_dir
-from utils.calibration_processing import calculate_slope_intercept, apply_slope_intercept, calculate_offset_low_high, apply_offset_low_high
-from utils.dataframe_operations import join_slice
-from utils.write_parquet import write_split_years
-
-from utils.paths import POSTPROCESSED_DATA_DIRECTORY, THINGSBOARD_DATA_DIRECTORY, LOG_DIRECTORY
-
-assert (os.path.exists(THINGSBOARD_DATA_DIRECTORY))
-ensure_data_dir(POSTPROCESSED_DATA_DIRECTORY)
-ensure_data_dir(LOG_DIRECTORY)
-
-config = load_json_config("config.json")
-
-# Create a log file with the current date (YYYY-MM-DD)
-log_filename = os.path.join(LOG_DIRECTORY,
-                            f"{datetime.now().strftime('%Y-%m-%d')}.log")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format=
-    "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s",
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler(
-        )  # This allows logs to be printed to the console as well
-    ])
-
-logging.info("=========================================")
-logging.info("Starting processing of ACROPOLIS raw data")
-
-# Record start time
-start_time = time.time()
-start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-logging.info(f"Script started at: {start_datetime}")
-
-for id in config["postprocessing"]["system_ids"]:
-    logging.info(f"Processing system with id: {id}")
-    # Import system data
-    df_raw = import_acropolis_system_data(
-        years=config["postprocessing"]["input_years"],
-        target_directory=THINGSBOARD_DATA_DIRECTORY,
-        id=id,
+from utils.import_data import system_data_size
+from utils.postprocessing import postprocess_system, postprocess_system_lazy
+from utils.worker_pool import run_tasks
+
+from utils import paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Process downloaded ThingsBoard data.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help=
+        "Only process raw data added since the last run (per system watermark)"
     )
-
-    # Extract data
-    df_lazy = extract_measurement_data(df_raw)
-    df_wind = extract_wind_data(df_raw)
-    df_aux = extraxt_auxilliary_data(df_raw)
-    df_edge_cal = extract_edge_calibration_data(df_raw)
-    df_calibration = extract_calibration_data(df_raw)
-
-    # Save cal data
-    write_split_years(df=df_calibration,
-                      id=id,
-                      target_directory=POSTPROCESSED_DATA_DIRECTORY,
-                      prefix="Cal_1min")
-
-    # Calculate slope and intercept
-    df_slope_intercept = calculate_slope_intercept(df_calibration)
-    
-    # Evaluate if one-point correction should be applied
-    if config["postprocessing"]["add_1P_correction"]:
-        df_offset_low_high = calculate_offset_low_high(df_calibration)
-    else:
-        df_offset_low_high = pl.DataFrame()
-    run_one_point = config["postprocessing"]["add_1P_correction"]
-
-
-    del df_calibration
-    gc.collect()  # Explicitly run garbage collection
-
-    # Aggregate to 1 minute intervals
-    df = df_lazy.group_by_dynamic("datetime", every='1m', group_by=["system_id", "system_name"]) \
-            .agg(cs.numeric().mean()) \
-            .collect()
-
-    # Process measurement data
-    df = df.pipe(wet_to_dry_mole_fraction) \
-        .pipe(apply_slope_intercept, df_slope_intercept) \
-        .pipe(apply_offset_low_high, df_offset_low_high, run_one_point) \
-        .pipe(join_slice, df_wind, "2m") \
-        .pipe(join_slice, df_aux, "2m") \
-        .pipe(join_slice, df_edge_cal, "1d") \
-        .drop("^.*_right$") \
-        .sort("datetime")
-
-    # Save data
-    logging.info(f"Writing 1m data to parquet. Length: {len(df)}")
-    write_split_years(df=df,
-                      id=id,
-                      target_directory=POSTPROCESSED_DATA_DIRECTORY,
-                      prefix="1min")
-
-    # Aggregate to 1 hour intervals
-    df_1h = df.sort("datetime") \
-            .group_by_dynamic("datetime", every='1h', group_by=["system_id", "system_name"]) \
-            .agg([
-                  cs.numeric().mean(),
-                  pl.col("gmp343_corrected").std().alias("gmp343_corrected_std"),
-                  pl.col("gmp343_corrected").var().alias("gmp343_corrected_var")
-              ])
-
-    # Save data
-    logging.info(f"Writing 1h data to parquet. Length: {len(df_1h)}")
-    write_split_years(df=df_1h,
-                      id=id,
-                      target_directory=POSTPROCESSED_DATA_DIRECTORY,
-                      prefix="1h")
-
-    # Clear memory
-    del df, df_1h
-    gc.collect()  # Explicitly run garbage collection
-
-# Record end time
-end_time = time.time()
-duration = end_time - start_time
-end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-logging.info(f"Script ended at: {end_datetime}")
-logging.info(f"Total duration: {duration:.2f} seconds")
+    mode.add_argument(
+        "--lazy",
+        action="store_true",
+        help="Process the measurement data as a single lazy Polars query"
+    )
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="Number of systems processed in parallel")
+    args = parser.parse_args()
+
+    assert (os.path.exists(paths.THINGSBOARD_DATA_DIRECTORY))
+    ensure_data_dir(paths.POSTPROCESSED_DATA_DIRECTORY)
+    ensure_data_dir(paths.LOG_DIRECTORY)
+
+    config = get_context().config
+    hive_partitioning = config.get("storage", {}).get("hive_partitioning",
+                                                      False)
+
+    # Create a log file with the current date (YYYY-MM-DD)
+    log_filename = os.path.join(paths.LOG_DIRECTORY,
+                                f"{datetime.now().strftime('%Y-%m-%d')}.log")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=
+        "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s",
+        handlers=[
+            logging.FileHandler(log_filename),
+            logging.StreamHandler(
+            )  # This allows logs to be printed to the console as well
+        ])
+
+    logging.info("=========================================")
+    logging.info("Starting processing of ACROPOLIS raw data")
+
+    # Record start time
+    start_time = time.time()
+    start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logging.info(f"Script started at: {start_datetime}")
+
+    system_ids = config["postprocessing"]["system_ids"]
+    tasks = [{
+        "id": id,
+        "config": config,
+        "input_directory": paths.THINGSBOARD_DATA_DIRECTORY,
+        "output_directory": paths.POSTPROCESSED_DATA_DIRECTORY,
+        "hive_partitioning": hive_partitioning
+    } for id in system_ids]
+    if not args.lazy:
+        for task in tasks:
+            task["incremental"] = args.incremental
+    costs = [
+        system_data_size(years=config["postprocessing"]["input_years"],
+                         target_directory=paths.THINGSBOARD_DATA_DIRECTORY,
+                         id=id) for id in system_ids
+    ]
+
+    run_tasks(postprocess_system_lazy if args.lazy else postprocess_system,
+              tasks,
+              costs,
+              workers=args.workers)
+
+    # Record end time
+    end_time = time.time()
+    duration = end_time - start_time
+    end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logging.info(f"Script ended at: {end_datetime}")
+    logging.info(f"Total duration: {duration:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
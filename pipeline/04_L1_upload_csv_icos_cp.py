@@ -3,27 +3,37 @@ import glob
 import polars as pl
 import time
 import logging
+import argparse
 from datetime import datetime
 
-from utils.config_files import load_json_config
-from utils.icos_cp_http_upload import upload_file_to_icos_cp
+from utils.context import get_context
+from utils.icos_cp_http_upload import IcosCpUploadClient
+from utils.os_functions import package_files
+from utils.metrics import measure
+from utils.upload_ledger import load_ledger, save_ledger, pending_uploads, record_upload
 
-from utils.paths import CONFIG_DIRECTORY, LOG_DIRECTORY, ICOS_CITIES_LEVEL_1
+from utils import paths
 
-assert (os.path.exists(ICOS_CITIES_LEVEL_1))
+parser = argparse.ArgumentParser(
+    description="Upload the L1 csv files to the ICOS Cities portal.")
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Upload all files, also those unchanged since their last upload")
+args = parser.parse_args()
+
+assert (os.path.exists(paths.ICOS_CITIES_LEVEL_1))
 
 # load files
-config = load_json_config("config.json")
+config = get_context().config
 
-path = os.path.join(CONFIG_DIRECTORY, "sites.csv")
-sites_meta = pl.read_csv(path, separator=";").with_columns(
-    pl.exclude(pl.Utf8).cast(str))
+sites_meta = get_context().sites_meta
 
 # load csv files
-L1_filenames = glob.glob(os.path.join(ICOS_CITIES_LEVEL_1, '*.csv'))
+L1_filenames = glob.glob(os.path.join(paths.ICOS_CITIES_LEVEL_1, '*.csv'))
 
 # Create a log file with the current date (YYYY-MM-DD)
-log_filename = os.path.join(LOG_DIRECTORY,
+log_filename = os.path.join(paths.LOG_DIRECTORY,
                             f"{datetime.now().strftime('%Y-%m-%d')}.log")
 
 logging.basicConfig(
@@ -45,11 +55,21 @@ start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 logging.info(f"Script started at: {start_datetime}")
 
-for path in L1_filenames:  
+# Skip files unchanged since their last successful upload
+ledger = load_ledger(paths.ICOS_CITIES_LEVEL_1)
+with measure("pending_uploads", rows_in=len(L1_filenames)) as m:
+    pending = pending_uploads(L1_filenames, {} if args.force else ledger)
+    m["rows_out"] = len(pending)
+logging.info(
+    f"Uploading {len(pending)} of {len(L1_filenames)} files, the others are unchanged since their last upload"
+)
+
+uploads = []
+for path in pending:
     root_directory = os.path.dirname(path)
     fname = os.path.basename(path)
     site_id = os.path.basename(path)[:4]
-    
+
     logging.info(f"Processing site: {site_id}")
 
     if site_id == 'BLUT':
@@ -59,15 +79,60 @@ for path in L1_filenames:
             pl.col("site") == site_id).select("height_of_building").item())
 
     logging.info(f"Created {fname}, {site_id}, {sampling_height}")
-    
-    logging.info(f"Uploading {fname} to ICOS Cities Portal")
-    
-    upload_file_to_icos_cp(config,
-                        root_directory,
-                        fname,
-                        site_id,
-                        sampling_height,
-                        data_level=1)
+
+    uploads.append({
+        "root_directory": root_directory,
+        "file_name": fname,
+        "site_id": site_id,
+        "sampling_height": sampling_height,
+        "data_level": 1
+    })
+
+# Zip and hash all files in parallel processes (single pass per file)
+packaging_start = time.time()
+with measure("package_files", rows_in=len(pending)):
+    packages = package_files(
+        list(pending),
+        compresslevel=config["icos_cities_portal"].get("compression_level", 6))
+for upload, package in zip(uploads, packages):
+    upload["package"] = package
+logging.info(
+    f"Zipped {sum(package is not None for package in packages)} of {len(packages)} files in {time.time() - packaging_start:.2f} seconds"
+)
+
+# Upload all files with a single login, several files at a time
+max_workers = config["icos_cities_portal"].get("upload_concurrency", 4)
+logging.info(
+    f"Uploading {len(uploads)} files to ICOS Cities Portal ({max_workers} concurrent uploads)"
+)
+results = []
+if len(uploads) > 0:
+    upload_start = time.time()
+    with measure("upload_files", rows_in=len(uploads)) as m, \
+            IcosCpUploadClient(config, max_workers=max_workers) as client:
+        results = client.upload_files(uploads)
+        m["rows_out"] = sum(result.success for result in results)
+    upload_duration = time.time() - upload_start
+
+    uploaded_mb = sum(result.size for result in results if result.success) / 1e6
+    logging.info(
+        f"Uploaded {uploaded_mb:.1f} MB in {upload_duration:.2f} s ({uploaded_mb / upload_duration:.2f} MB/s)"
+    )
+
+for path, result in zip(pending, results):
+    if result.success:
+        record_upload(ledger, path, pending[path], result)
+        logging.info(
+            f"{result.file_name}: uploaded in {result.duration:.2f} s with {result.attempts} requests"
+        )
+    else:
+        logging.error(f"{result.file_name}: FAILED {result.failure}")
+
+save_ledger(paths.ICOS_CITIES_LEVEL_1, ledger)
+
+failed = [result.file_name for result in results if not result.success]
+if len(failed) > 0:
+    logging.error(f"Upload failed for {len(failed)} of {len(results)} files: {failed}")
 
 # Record end time
 end_time = time.time()
@@ -0,0 +1,307 @@
+import os
+import sys
+import glob
+import time
+import logging
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Callable
+
+from utils.context import get_context
+from utils.os_functions import ensure_data_dir
+from utils.import_data import system_data_files, system_data_size
+from utils.postprocessing import postprocess_system
+from utils.despiking import despike_systems, DESPIKED_PREFIX
+from utils.site_export import export_site_L1_1min_csv, site_data_size
+from utils.icos_cp_csv_conversion import icos_csv_file_name, L1_1MIN
+from utils.upload_ledger import load_ledger, pending_uploads
+from utils.worker_pool import run_tasks, balanced_batches
+from utils.metrics import measure
+from utils.fused import run_fused
+from utils.stage_fingerprints import (load_stage_fingerprints,
+                                      save_stage_fingerprints, is_up_to_date,
+                                      record_stage, postprocessing_inputs,
+                                      despiking_inputs, site_export_inputs)
+from config.sites_deloyment_times import deployment_times, current_date
+
+from utils import paths
+
+STAGES = ["01", "02", "03", "04"]
+
+# Outputs of a system written by the postprocessing
+POSTPROCESSED_PREFIXES = ["1min", "1h", "Cal_1min"]
+
+# stage, units (systems or sites), input fingerprint and output files of a unit,
+# run function for a list of units
+StageUnits = tuple[str, list, Callable[..., str], Callable[..., list[str]],
+                   Callable[[list], None]]
+
+
+def run_stage(stage: str, units: list, inputs: Callable[..., str],
+              outputs: Callable[..., list[str]], run: Callable[[list], None],
+              fingerprints: dict, force: bool, dry_run: bool) -> None:
+    """
+    Run a stage for its units (systems or sites) whose inputs or outputs
+    changed since their last run and record their new fingerprints.
+
+    The input fingerprints are taken before the stage runs, the fingerprints
+    are saved after each stage, i.e. a failing stage keeps the results of the
+    previous stages.
+    """
+    unit_inputs = {unit: inputs(unit) for unit in units}
+    stale = [
+        unit for unit in units
+        if force or not is_up_to_date(fingerprints, f"{stage}/{unit}",
+                                      unit_inputs[unit], outputs(unit),
+                                      paths.PIPELINE_DATA_DIRECTORY)
+    ]
+    logging.info(
+        f"Stage {stage}: {len(stale)} of {len(units)} out of date {stale}")
+    if len(stale) == 0 or dry_run:
+        return
+
+    with measure(stage, rows_in=len(stale)):
+        run(stale)
+
+    for unit in stale:
+        record_stage(fingerprints, f"{stage}/{unit}", unit_inputs[unit],
+                     outputs(unit), paths.PIPELINE_DATA_DIRECTORY)
+    save_stage_fingerprints(paths.PIPELINE_DATA_DIRECTORY, fingerprints)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=
+        "Run the pipeline stages 01-04, skipping systems and sites whose inputs did not change."
+    )
+    parser.add_argument("--until",
+                        choices=STAGES,
+                        default="04",
+                        help="Last stage to run (default: 04, the upload)")
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        choices=STAGES,
+        default=None,
+        help=
+        "Rerun the given stages (all stages without argument) regardless of their fingerprints"
+    )
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="Number of systems or sites processed in parallel")
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help=
+        "Rebuild stages 01-03 for all systems and sites in one pass, handing the data on in memory"
+    )
+    parser.add_argument("--dry-run",
+                        action="store_true",
+                        help="Only list the out of date systems and sites")
+    args = parser.parse_args()
+
+    if args.fused and STAGES.index(args.until) < STAGES.index("03"):
+        parser.error("--fused runs the stages 01-03, use --until 03 or 04")
+
+    forced = set(STAGES if args.force == [] else args.force or [])
+    stages = STAGES[:STAGES.index(args.until) + 1]
+
+    assert (os.path.exists(paths.THINGSBOARD_DATA_DIRECTORY))
+    ensure_data_dir(paths.POSTPROCESSED_DATA_DIRECTORY)
+    ensure_data_dir(paths.DESPIKED_DATA_DIRECTORY)
+    ensure_data_dir(paths.ICOS_CITIES_LEVEL_1)
+    ensure_data_dir(paths.LOG_DIRECTORY)
+
+    config = get_context().config
+    hive_partitioning = config.get("storage", {}).get("hive_partitioning",
+                                                      False)
+
+    sites_meta = get_context().sites_meta
+
+    # Create a log file with the current date (YYYY-MM-DD)
+    log_filename = os.path.join(paths.LOG_DIRECTORY,
+                                f"{datetime.now().strftime('%Y-%m-%d')}.log")
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=
+        "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s",
+        handlers=[
+            logging.FileHandler(log_filename),
+            logging.StreamHandler(
+            )  # This allows logs to be printed to the console as well
+        ])
+
+    logging.info("=========================================")
+    logging.info(f"Starting pipeline run of stages {', '.join(stages)}")
+
+    # Record start time
+    start_time = time.time()
+    start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logging.info(f"Script started at: {start_datetime}")
+
+    fingerprints = load_stage_fingerprints(paths.PIPELINE_DATA_DIRECTORY)
+
+    # 01: raw data -> postprocessed 1min/1h data, per system
+    def postprocessed_files(id: int) -> list[str]:
+        return [
+            path for prefix in POSTPROCESSED_PREFIXES
+            for path in system_data_files(
+                years=config["postprocessing"]["input_years"],
+                target_directory=paths.POSTPROCESSED_DATA_DIRECTORY,
+                id=id,
+                prefix=prefix,
+                hive_partitioning=hive_partitioning)
+        ]
+
+    def postprocess(ids: list[int]) -> None:
+        tasks = [{
+            "id": id,
+            "config": config,
+            "input_directory": paths.THINGSBOARD_DATA_DIRECTORY,
+            "output_directory": paths.POSTPROCESSED_DATA_DIRECTORY,
+            "hive_partitioning": hive_partitioning
+        } for id in ids]
+        costs = [
+            system_data_size(years=config["postprocessing"]["input_years"],
+                             target_directory=paths.THINGSBOARD_DATA_DIRECTORY,
+                             id=id) for id in ids
+        ]
+        run_tasks(postprocess_system, tasks, costs, workers=args.workers)
+
+    # 02: postprocessed 1min data -> despiked data, per system
+    def despiked_files(id: int) -> list[str]:
+        return system_data_files(years=config["despiking"]["input_years"],
+                                 target_directory=paths.DESPIKED_DATA_DIRECTORY,
+                                 id=id,
+                                 prefix=DESPIKED_PREFIX,
+                                 hive_partitioning=hive_partitioning)
+
+    def despike(ids: list[int]) -> None:
+        costs = [
+            system_data_size(years=config["despiking"]["input_years"],
+                             target_directory=paths.POSTPROCESSED_DATA_DIRECTORY,
+                             id=id,
+                             prefix="1min",
+                             hive_partitioning=hive_partitioning)
+            for id in ids
+        ]
+        batches, batch_costs = balanced_batches(ids, costs, args.workers)
+        tasks = [{
+            "ids": batch,
+            "config": config,
+            "input_directory": paths.POSTPROCESSED_DATA_DIRECTORY,
+            "output_directory": paths.DESPIKED_DATA_DIRECTORY,
+            "hive_partitioning": hive_partitioning
+        } for batch in batches]
+        run_tasks(despike_systems, tasks, batch_costs, workers=args.workers)
+
+    # 03: despiked data of the deployed sensors -> L1 csv file, per site
+    def site_csv_files(site: str) -> list[str]:
+        path = os.path.join(paths.ICOS_CITIES_LEVEL_1,
+                            icos_csv_file_name(site, L1_1MIN))
+        return [path] if os.path.isfile(path) else []
+
+    def export_sites(sites: list[str]) -> None:
+        tasks = [{
+            "site": site,
+            "sites_meta": sites_meta,
+            "deployment_times": deployment_times,
+            "input_directory": paths.DESPIKED_DATA_DIRECTORY,
+            "hive_partitioning": hive_partitioning,
+            "use_cache": config["icos_cities_portal"].get("csv_cache", False)
+        } for site in sites]
+        costs = [
+            site_data_size(site=site,
+                           deployment_times=deployment_times,
+                           years=config["icos_cities_portal"]["input_years"],
+                           input_directory=paths.DESPIKED_DATA_DIRECTORY,
+                           hive_partitioning=hive_partitioning)
+            for site in sites
+        ]
+        run_tasks(export_site_L1_1min_csv, tasks, costs, workers=args.workers)
+
+    stage_units: list[StageUnits] = [
+        ("01_postprocessing", config["postprocessing"]["system_ids"],
+         lambda id: postprocessing_inputs(config, id,
+                                          paths.THINGSBOARD_DATA_DIRECTORY),
+         postprocessed_files, postprocess),
+        ("02_despiking", config["despiking"]["system_ids"],
+         lambda id: despiking_inputs(config, id,
+                                     paths.POSTPROCESSED_DATA_DIRECTORY,
+                                     hive_partitioning), despiked_files,
+         despike),
+        ("03_csv_export", config["icos_cities_portal"]["site_names"],
+         lambda site: site_export_inputs(config,
+                                         site,
+                                         sites_meta,
+                                         deployment_times,
+                                         paths.DESPIKED_DATA_DIRECTORY,
+                                         prefix=DESPIKED_PREFIX,
+                                         hive_partitioning=hive_partitioning,
+                                         current_date=current_date),
+         site_csv_files, export_sites)
+    ]
+
+    if args.fused:
+        # complete rebuild of 01-03, the fingerprints are taken afterwards
+        # (the raw input does not change during the run)
+        logging.info("Stages 01-03: fused run of all systems and sites")
+        if not args.dry_run:
+            with measure("01-03_fused"):
+                run_fused(config=config,
+                          sites_meta=sites_meta,
+                          deployment_times=deployment_times,
+                          input_directory=paths.THINGSBOARD_DATA_DIRECTORY,
+                          postprocessed_directory=paths.POSTPROCESSED_DATA_DIRECTORY,
+                          despiked_directory=paths.DESPIKED_DATA_DIRECTORY,
+                          hive_partitioning=hive_partitioning)
+            for stage, units, inputs, outputs, _ in stage_units:
+                for unit in units:
+                    record_stage(fingerprints, f"{stage}/{unit}",
+                                 inputs(unit), outputs(unit),
+                                 paths.PIPELINE_DATA_DIRECTORY)
+            save_stage_fingerprints(paths.PIPELINE_DATA_DIRECTORY, fingerprints)
+    else:
+        for stage, units, inputs, outputs, run in stage_units:
+            if stage[:2] in stages:
+                run_stage(stage,
+                          units=units,
+                          inputs=inputs,
+                          outputs=outputs,
+                          run=run,
+                          fingerprints=fingerprints,
+                          force=stage[:2] in forced,
+                          dry_run=args.dry_run)
+
+    # 04: the upload ledger already tracks the uploaded content of each file
+    if "04" in stages:
+        L1_filenames = glob.glob(os.path.join(paths.ICOS_CITIES_LEVEL_1, '*.csv'))
+        pending = L1_filenames if "04" in forced else list(
+            pending_uploads(L1_filenames, load_ledger(paths.ICOS_CITIES_LEVEL_1)))
+        logging.info(
+            f"Stage 04_upload: {len(pending)} of {len(L1_filenames)} files changed since their last upload"
+        )
+        if len(pending) > 0 and not args.dry_run:
+            with measure("04_upload", rows_in=len(pending)):
+                subprocess.run([
+                    sys.executable,
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "04_L1_upload_csv_icos_cp.py")
+                ] + (["--force"] if "04" in forced else []),
+                               check=True)
+
+    # Record end time
+    end_time = time.time()
+    duration = end_time - start_time
+    end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logging.info(f"Script ended at: {end_datetime}")
+    logging.info(f"Total duration: {duration:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from utils.ambient_parameter_conversion import (
+    absolute_temperature, absolute_temperature_expr, saturation_vapor_pressure,
+    saturation_vapor_pressure_expr, rh_to_mole_fraction,
+    rh_to_mole_fraction_expr, calculate_co2dry, calculate_co2dry_expr)
+
+RTOL = 1e-12
+
+
+@pytest.fixture
+def grid() -> pl.DataFrame:
+    """Temperature (C), relative humidity (%) and pressure (Pa) of the measured range."""
+    temperature, rh, pressure = np.meshgrid(np.linspace(-30, 45, 16),
+                                            np.linspace(0, 100, 11),
+                                            np.linspace(80000, 105000, 6))
+    return pl.DataFrame({
+        "temperature": temperature.ravel(),
+        "rh": rh.ravel(),
+        "pressure": pressure.ravel(),
+        "co2wet": np.linspace(380, 600, temperature.size)
+    })
+
+
+def test_absolute_temperature_expr(grid: pl.DataFrame) -> None:
+    result = grid.select(absolute_temperature_expr(
+        pl.col("temperature"))).to_series().to_numpy()
+    expected = [absolute_temperature(t) for t in grid["temperature"]]
+    np.testing.assert_allclose(result, expected, rtol=RTOL)
+
+
+def test_saturation_vapor_pressure_expr(grid: pl.DataFrame) -> None:
+    t = grid["temperature"] + 273.15
+    result = pl.select(saturation_vapor_pressure_expr(
+        pl.lit(t))).to_series().to_numpy()
+    expected = [saturation_vapor_pressure(value) for value in t]
+    np.testing.assert_allclose(result, expected, rtol=RTOL)
+
+
+def test_rh_to_mole_fraction_expr(grid: pl.DataFrame) -> None:
+    result = grid.select(
+        rh_to_mole_fraction_expr(
+            rh=pl.col("rh"),
+            t=absolute_temperature_expr(pl.col("temperature")),
+            p=pl.col("pressure"))).to_series().to_numpy()
+    expected = [
+        rh_to_mole_fraction(rh=row["rh"],
+                            t=absolute_temperature(row["temperature"]),
+                            p=row["pressure"])
+        for row in grid.iter_rows(named=True)
+    ]
+    np.testing.assert_allclose(result, expected, rtol=RTOL)
+
+
+def test_calculate_co2dry_expr(grid: pl.DataFrame) -> None:
+    result = grid.select(
+        calculate_co2dry_expr(co2wet=pl.col("co2wet"),
+                              temperature=pl.col("temperature"),
+                              rh=pl.col("rh"),
+                              pressure=pl.col("pressure"))).to_series().to_numpy()
+    expected = [
+        calculate_co2dry(co2wet=row["co2wet"],
+                         temperature=row["temperature"],
+                         rh=row["rh"],
+                         pressure=row["pressure"])
+        for row in grid.iter_rows(named=True)
+    ]
+    np.testing.assert_allclose(result, expected, rtol=RTOL)
+
+
+def test_calculate_co2dry_expr_propagates_nulls() -> None:
+    df = pl.DataFrame({
+        "co2wet": [420.0, None],
+        "temperature": [None, 20.0],
+        "rh": [50.0, 50.0],
+        "pressure": [95000.0, 95000.0]
+    })
+    result = df.select(
+        calculate_co2dry_expr(co2wet=pl.col("co2wet"),
+                              temperature=pl.col("temperature"),
+                              rh=pl.col("rh"),
+                              pressure=pl.col("pressure"))).to_series()
+    assert result.null_count() == 2
@@ -0,0 +1,131 @@
+import numpy as np
+import polars as pl
+import pytest
+from datetime import datetime, timedelta
+
+from utils import context
+from utils.calibration_processing import (process_bottle, bottle_median_expr,
+                                          two_point_calibration,
+                                          one_point_calibration,
+                                          calculate_calibration_parameters)
+
+# bottle id -> CO2 concentration in ppm
+BOTTLES = {1: 400.0, 2: 500.0}
+
+
+@pytest.fixture(autouse=True)
+def calibration_gases(tmp_path, monkeypatch) -> None:
+    """Pipeline context whose averaged_gases.csv contains BOTTLES."""
+    (tmp_path / "input").mkdir()
+    pl.DataFrame({
+        "cal_bottle_id": list(BOTTLES.keys()),
+        "cal_bottle_CO2": list(BOTTLES.values())
+    }).write_csv(tmp_path / "input" / "averaged_gases.csv")
+    monkeypatch.setattr(context, "_context",
+                        context.PipelineContext(data_directory=str(tmp_path)))
+
+
+def bottle_values(n: int, plateau: float, rng: np.random.Generator) -> list:
+    """Flushing from ambient air to the bottle concentration, then a noisy plateau."""
+    flush = np.linspace(420.0, plateau, n)
+    return list(np.where(np.arange(n) < n // 2, flush, plateau) +
+                rng.normal(0, 0.5, n))
+
+
+def calibration_day(day: datetime, system_id: int, gain: float,
+                    offset: float, rng: np.random.Generator) -> pl.DataFrame:
+    """1st bottle (100 values) followed by the 2nd bottle (60 values), measured as (true - offset) / gain."""
+    rows = []
+    start = day
+    for bottle_id, n in ((2, 100), (1, 60)):
+        plateau = (BOTTLES[bottle_id] - offset) / gain
+        for i, value in enumerate(bottle_values(n, plateau, rng)):
+            rows.append({
+                "datetime": start + timedelta(seconds=10 * i),
+                "system_id": system_id,
+                "cal_bottle_id": float(bottle_id),
+                "cal_gmp343_filtered": value
+            })
+        start += timedelta(seconds=10 * n)
+    return pl.DataFrame(rows)
+
+
+def test_process_bottle() -> None:
+    # scalar signature used by the calibration notebooks
+    data = list(range(100))
+    assert process_bottle(data=data, ignore_len=True) == np.median(data[30:95])
+    assert process_bottle(data) == np.median(data[50:95])
+    assert process_bottle(data[:60]) == np.median(data[18:57])
+    assert process_bottle(data[:40]) == 0.0
+
+
+@pytest.mark.parametrize("ignore_len", [False, True])
+def test_bottle_median_expr(ignore_len: bool) -> None:
+    rng = np.random.default_rng(1)
+    lengths = [10, 50, 51, 60, 69, 70, 71, 100, 129, 130, 140]
+    df = pl.DataFrame({
+        "group": [i for i, n in enumerate(lengths) for _ in range(n)],
+        "value": rng.normal(450, 20, sum(lengths))
+    })
+
+    result = df.group_by("group", maintain_order=True).agg(
+        bottle_median_expr(pl.col("value"), ignore_len=ignore_len))["value"]
+    expected = [
+        process_bottle(list(group["value"]), ignore_len)
+        for _, group in df.group_by("group", maintain_order=True)
+    ]
+    np.testing.assert_allclose(result.to_numpy(), expected, rtol=1e-12)
+
+
+def test_calculate_calibration_parameters() -> None:
+    rng = np.random.default_rng(2)
+    days = [datetime(2024, 5, 1, 9), datetime(2024, 5, 2, 9)]
+    df = pl.concat([
+        calibration_day(days[0], system_id=3, gain=1.02, offset=-5.0, rng=rng),
+        calibration_day(days[1], system_id=3, gain=0.98, offset=3.0, rng=rng),
+        # only one bottle: no calibration on this day
+        calibration_day(datetime(2024, 5, 3, 9), 3, 1.0, 0.0,
+                        rng).filter(pl.col("cal_bottle_id") == 2),
+        # unreasonable slope: one point offsets only
+        calibration_day(datetime(2024, 5, 4, 9), 3, 0.5, 0.0, rng),
+    ])
+
+    result = calculate_calibration_parameters(df)
+    assert result.columns == [
+        "datetime", "system_id", "slope", "intercept", "offset_low",
+        "offset_high", "bottle_median_low", "bottle_median_high"
+    ]
+    assert result["datetime"].dt.date().to_list() == [
+        days[0].date(), days[1].date(),
+        datetime(2024, 5, 4).date()
+    ]
+
+    rows = {row["datetime"].date(): row for row in result.iter_rows(named=True)}
+    for (date, ), day in df.group_by(pl.col("datetime").dt.date()):
+        if date not in rows:
+            continue
+        row = rows[date]
+        medians = {
+            id: process_bottle(list(group["cal_gmp343_filtered"]))
+            for (id, ), group in day.group_by("cal_bottle_id")
+        }
+        # scalar calibrations with the bottles in measurement order
+        measured = [medians[2.0], medians[1.0]]
+        true = [BOTTLES[2], BOTTLES[1]]
+        two_point = two_point_calibration(measured, true)
+        one_point = one_point_calibration(measured, true)
+
+        for column, value in one_point.items():
+            assert row[column] == pytest.approx(value, rel=1e-12)
+        if 0.9 < two_point["slope"] < 1.1:
+            assert row["slope"] == pytest.approx(two_point["slope"], rel=1e-12)
+            assert row["intercept"] == pytest.approx(two_point["intercept"],
+                                                     rel=1e-9)
+        else:
+            assert row["slope"] is None and row["intercept"] is None
+
+    # the gain and offset of the sensor are recovered
+    assert result["slope"].to_list()[:2] == pytest.approx([1.02, 0.98],
+                                                          abs=1e-2)
+    assert result["intercept"].to_list()[:2] == pytest.approx([-5.0, 3.0],
+                                                              abs=2.0)
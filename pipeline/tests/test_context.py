@@ -0,0 +1,28 @@
+import os
+
+from utils import context, paths
+
+
+def test_configure_changes_paths_and_reference_data(tmp_path,
+                                                    monkeypatch) -> None:
+    for variable in (context.CONFIG_PATH_VARIABLE,
+                     context.DATA_DIRECTORY_VARIABLE,
+                     context.SITES_PATH_VARIABLE):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setattr(context, "_context", None)
+
+    sites_path = tmp_path / "sites.csv"
+    sites_path.write_text("site;site_name;elevation\nTEST;Test site;500\n")
+    context.configure(data_directory=str(tmp_path / "data"),
+                      sites_path=str(sites_path))
+
+    assert paths.DESPIKED_DATA_DIRECTORY == str(tmp_path / "data" / "output" /
+                                                "pipeline" / "despiked")
+    assert context.get_context().sites_meta.to_dicts() == [{
+        "site": "TEST",
+        "site_name": "Test site",
+        "elevation": "500"
+    }]
+    # inherited by spawned worker processes
+    assert os.environ[context.SITES_PATH_VARIABLE] == str(sites_path)
+    assert context.PipelineContext().sites_path == str(sites_path)
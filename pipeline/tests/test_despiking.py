@@ -0,0 +1,169 @@
+import glob
+import logging
+import os
+import numpy as np
+import polars as pl
+import pytest
+from datetime import datetime, timedelta
+from polars.testing import assert_frame_equal
+from typing import Callable, Union
+
+from utils.despiking import despike_systems, despiking_columns, DESPIKED_PREFIX
+from utils.write_parquet import write_split_years
+
+START = datetime(2024, 12, 28)
+# the lookback of 3 days from the last row reaches back into 2024
+END = datetime(2025, 1, 2, 23, 59)
+# changes just before the turn of the year, within the lookback
+CHANGE = datetime(2024, 12, 31, 23, 30)
+
+
+def despiking_config(window: Union[int, str]) -> dict:
+    return {
+        "despiking": {
+            "input_years": [2024, 2025],
+            "window_size": window,
+            "n_sigma": 3.0,
+            "add_1P_correction": False,
+            "incremental_lookback_days": 3
+        },
+        "postprocessing": {}
+    }
+
+
+def postprocessed_data(system_id: int, rng: np.random.Generator) -> pl.DataFrame:
+    """1min data of one system with spikes, gaps and invalid (<= 0) values."""
+    datetimes = pl.datetime_range(START, END, "1m", eager=True)
+    n = len(datetimes)
+    co2 = 420 + rng.normal(0, 1.5, n)
+    spikes = rng.choice(n, n // 50, replace=False)
+    co2[spikes] += rng.uniform(10, 50, len(spikes))
+    co2[rng.choice(n, 10, replace=False)] = -1.0
+
+    config = despiking_config(60)
+    df = pl.DataFrame({
+        column: rng.normal(10, 1, n)
+        for column in despiking_columns(config)
+    }).with_columns(
+        datetime=datetimes,
+        system_id=pl.lit(system_id, dtype=pl.Int64),
+        system_name=pl.lit(f"acropolis-{system_id}"),
+        gmp343_corrected=pl.Series(co2))
+
+    # gaps
+    keep = rng.random(n) > 0.01
+    keep[n // 3:n // 3 + 45] = False
+    return df.filter(pl.Series(keep))
+
+
+def appended(df: pl.DataFrame) -> pl.DataFrame:
+    # another day of data after the last row
+    rows = df.filter(pl.col("datetime") > END - timedelta(days=1)) \
+        .with_columns(pl.col("datetime") + timedelta(days=1),
+                      pl.col("gmp343_corrected") + 1.0)
+    return pl.concat([df, rows])
+
+
+def changed(df: pl.DataFrame) -> pl.DataFrame:
+    # a new spike and a new value in the last minutes of 2024
+    return df.with_columns(
+        pl.when(pl.col("datetime") == CHANGE).then(500.0).when(
+            pl.col("datetime") == CHANGE + timedelta(minutes=20)).then(
+                pl.col("gmp343_corrected") + 0.5).otherwise(
+                    pl.col("gmp343_corrected")).alias("gmp343_corrected"))
+
+
+def removed(df: pl.DataFrame) -> pl.DataFrame:
+    # the first minutes of 2025 are deleted
+    return df.filter(~pl.col("datetime").is_between(
+        datetime(2025, 1, 1), datetime(2025, 1, 1, 0, 15)))
+
+
+def write_input(df: pl.DataFrame, directory: str, hive_partitioning: bool) -> None:
+    for (system_id, ), df_system in df.partition_by("system_id",
+                                                    as_dict=True).items():
+        write_split_years(df=df_system.sort("datetime"),
+                          target_directory=directory,
+                          id=system_id,  # type: ignore
+                          prefix="1min",
+                          hive_partitioning=hive_partitioning)
+
+
+def read_output(directory: str) -> dict[str, pl.DataFrame]:
+    return {
+        os.path.relpath(path, directory): pl.read_parquet(path)
+        for path in sorted(glob.glob(os.path.join(directory, "**", "*.parquet"),
+                                     recursive=True))
+    }
+
+
+@pytest.mark.parametrize("hive_partitioning", [False, True])
+@pytest.mark.parametrize("window", [60, "60m"])
+@pytest.mark.parametrize("change", [appended, changed, removed],
+                         ids=lambda change: change.__name__)
+def test_incremental_despiking_matches_full_run(
+        tmp_path, caplog, change: Callable[[pl.DataFrame], pl.DataFrame],
+        window: Union[int, str], hive_partitioning: bool) -> None:
+    rng = np.random.default_rng(0)
+    config = despiking_config(window)
+    df = pl.concat([postprocessed_data(4, rng), postprocessed_data(6, rng)])
+    # only system 4 changes
+    df_changed_4 = df.filter(pl.col("system_id") == 4).pipe(change)
+
+    def run(df: pl.DataFrame, name: str, incremental: bool) -> str:
+        input_directory = str(tmp_path / f"{name}_input")
+        output_directory = str(tmp_path / f"{name}_output")
+        write_input(df, input_directory, hive_partitioning)
+        despike_systems(ids=[4, 6],
+                        config=config,
+                        input_directory=input_directory,
+                        output_directory=output_directory,
+                        incremental=incremental,
+                        hive_partitioning=hive_partitioning)
+        return output_directory
+
+    run(df, "incremental", incremental=False)
+    with caplog.at_level(logging.INFO):
+        incremental = run(df_changed_4, "incremental", incremental=True)
+    full = run(pl.concat([df_changed_4, df.filter(pl.col("system_id") == 6)]),
+               "full",
+               incremental=False)
+
+    # system 6 is skipped, system 4 is computed incrementally (no fallback)
+    assert "System 6: input unchanged, skipping" in caplog.text
+    assert "System 4: incremental run" in caplog.text
+
+    incremental_output = read_output(incremental)
+    full_output = read_output(full)
+    assert incremental_output.keys() == full_output.keys()
+    assert any(DESPIKED_PREFIX in path for path in full_output)
+    for path, df_full in full_output.items():
+        assert_frame_equal(incremental_output[path], df_full, check_exact=True)
+
+
+def test_incremental_despiking_reruns_changed_settings(tmp_path, caplog) -> None:
+    rng = np.random.default_rng(1)
+    df = postprocessed_data(4, rng)
+    input_directory = str(tmp_path / "input")
+    write_input(df, input_directory, hive_partitioning=False)
+
+    def run(config: dict, name: str, incremental: bool) -> str:
+        output_directory = str(tmp_path / name)
+        despike_systems(ids=[4],
+                        config=config,
+                        input_directory=input_directory,
+                        output_directory=output_directory,
+                        incremental=incremental)
+        return output_directory
+
+    run(despiking_config(60), "incremental", incremental=False)
+    config = despiking_config(60)
+    config["despiking"]["n_sigma"] = 2.0
+    with caplog.at_level(logging.INFO):
+        incremental = run(config, "incremental", incremental=True)
+    full = run(config, "full", incremental=False)
+
+    assert "System 4: settings changed, falling back to full run" in caplog.text
+    incremental_output = read_output(incremental)
+    for path, df_full in read_output(full).items():
+        assert_frame_equal(incremental_output[path], df_full, check_exact=True)
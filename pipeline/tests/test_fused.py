@@ -0,0 +1,137 @@
+import glob
+import json
+import os
+import shutil
+import polars as pl
+import pyarrow.parquet as pq  # type: ignore
+import pytest
+from datetime import date
+from polars.testing import assert_frame_equal
+
+from generate_thingsboard_data import generate_thingsboard_data, AVERAGED_GASES
+from utils import context, metrics, paths
+from utils.config_files import CONFIG_DIRECTORY
+from utils.despiking import despike_systems
+from utils.fused import run_fused
+from utils.parquet_manifest import MANIFEST_SUFFIX
+from utils.postprocessing import postprocess_system
+from utils.site_export import export_site_L1_1min_csv
+
+IDS = [4, 6]
+# system 6 replaces system 4 at the turn of the year
+DEPLOYMENT_TIMES = {
+    "TUMR": {
+        "sensors": [{
+            "id": 4,
+            "start_time": "2024-12-29T00:00:00+0000",
+            "end_time": "2025-01-01T00:00:00+0000"
+        }, {
+            "id": 6,
+            "start_time": "2025-01-01T00:00:00+0000",
+            "end_time": "2025-01-03T00:00:00+0000"
+        }]
+    }
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_context(tmp_path, monkeypatch) -> None:
+    for variable in (context.CONFIG_PATH_VARIABLE,
+                     context.DATA_DIRECTORY_VARIABLE,
+                     context.SITES_PATH_VARIABLE):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setattr(context, "_context", None)
+    monkeypatch.setattr(metrics, "LOG_DIRECTORY", str(tmp_path / "logs"))
+
+
+def configure_run(tmp_path, name: str, thingsboard_directory: str,
+                  hive_partitioning: bool) -> dict:
+    with open(os.path.join(CONFIG_DIRECTORY, "config.template.json")) as f:
+        config = json.load(f)
+    config["measurement_data_paths"]["thingsboard"] = thingsboard_directory
+    config["storage"]["hive_partitioning"] = hive_partitioning
+    config["postprocessing"]["system_ids"] = IDS
+    config["despiking"]["system_ids"] = IDS
+    config["icos_cities_portal"]["site_names"] = ["TUMR"]
+    config["icos_cities_portal"]["csv_cache"] = False
+
+    data_directory = tmp_path / name
+    os.makedirs(data_directory / "input")
+    shutil.copy(AVERAGED_GASES, data_directory / "input")
+    config_path = data_directory / "config.json"
+    config_path.write_text(json.dumps(config))
+    context.configure(config_path=str(config_path),
+                      data_directory=str(data_directory))
+    os.makedirs(paths.ICOS_CITIES_LEVEL_1)
+    return config
+
+
+def read_outputs(directory: str) -> dict:
+    outputs: dict = {}
+    for path in glob.glob(os.path.join(directory, "**", "*"), recursive=True):
+        if os.path.isdir(path):
+            continue
+        key = os.path.relpath(path, directory)
+        if path.endswith(".parquet"):
+            outputs[key] = (pl.read_parquet(path, hive_partitioning=False),
+                            pq.ParquetFile(path).metadata.row_group(0).sorting_columns)
+        elif path.endswith(MANIFEST_SUFFIX):
+            with open(path) as f:
+                manifest = json.load(f)
+            # the only difference: the files are written at another time
+            del manifest["file_mtime_ns"]
+            outputs[key] = manifest
+        elif key.startswith(os.path.join("despiked", "watermarks")):
+            with open(path) as f:
+                watermark = json.load(f)
+            # fingerprint of the postprocessed files, including their mtime
+            del watermark["fingerprint"]
+            outputs[key] = watermark
+        else:
+            with open(path) as f:
+                outputs[key] = f.read()
+    return outputs
+
+
+@pytest.mark.parametrize("hive_partitioning", [False, True])
+def test_fused_run_matches_staged_run(tmp_path, hive_partitioning: bool) -> None:
+    thingsboard_directory = str(tmp_path / "thingsboard")
+    generate_thingsboard_data(thingsboard_directory,
+                              IDS,
+                              days=5,
+                              start=date(2024, 12, 29),
+                              interval=30.0)
+
+    config = configure_run(tmp_path, "staged", thingsboard_directory,
+                           hive_partitioning)
+    for id in IDS:
+        postprocess_system(id, config, thingsboard_directory,
+                           paths.POSTPROCESSED_DATA_DIRECTORY,
+                           hive_partitioning=hive_partitioning)
+    despike_systems(IDS, config, paths.POSTPROCESSED_DATA_DIRECTORY,
+                    paths.DESPIKED_DATA_DIRECTORY,
+                    hive_partitioning=hive_partitioning)
+    export_site_L1_1min_csv("TUMR", context.get_context().sites_meta,
+                            DEPLOYMENT_TIMES, paths.DESPIKED_DATA_DIRECTORY,
+                            hive_partitioning=hive_partitioning)
+    staged = read_outputs(paths.PIPELINE_DATA_DIRECTORY)
+
+    config = configure_run(tmp_path, "fused", thingsboard_directory,
+                           hive_partitioning)
+    run_fused(config=config,
+              sites_meta=context.get_context().sites_meta,
+              deployment_times=DEPLOYMENT_TIMES,
+              input_directory=thingsboard_directory,
+              postprocessed_directory=paths.POSTPROCESSED_DATA_DIRECTORY,
+              despiked_directory=paths.DESPIKED_DATA_DIRECTORY,
+              hive_partitioning=hive_partitioning)
+    fused = read_outputs(paths.PIPELINE_DATA_DIRECTORY)
+
+    assert fused.keys() == staged.keys()
+    assert any(key.endswith(".csv") for key in staged)
+    for key, output in staged.items():
+        if isinstance(output, tuple):
+            assert_frame_equal(fused[key][0], output[0], check_exact=True)
+            assert fused[key][1] == output[1]
+        else:
+            assert fused[key] == output, key
@@ -0,0 +1,108 @@
+import numpy as np
+import polars as pl
+import pytest
+from datetime import datetime, timedelta
+from hampel import hampel  # type: ignore
+
+from utils.hampel_filter import hampel_flags, parse_duration
+
+
+def measurements(system_id: int, n: int, rng: np.random.Generator,
+                 gaps: bool = False) -> pl.DataFrame:
+    """
+    1 minute CO2 values with a slow drift, noise, single and consecutive
+    spikes and mixed rounding (2 decimals, 4 decimals and unrounded).
+    With gaps, random stretches of 2-90 minutes and single rows are missing.
+    """
+    values = 420 + 10 * np.sin(np.arange(n) / 300) + rng.normal(0, 1.5, n)
+    spikes = rng.choice(n, n // 50, replace=False)
+    values[spikes] += rng.choice([-1, 1], len(spikes)) * rng.uniform(5, 60, len(spikes))
+    values[(spikes[:5, None] + np.arange(3)[None, :]) % n] += 30
+    rounding = rng.integers(0, 3, n)
+    values = np.where(rounding == 0, values.round(2),
+                      np.where(rounding == 1, values.round(4), values))
+
+    minutes = np.arange(n)
+    if gaps:
+        keep = rng.random(n) > 0.02
+        for start in rng.choice(n, 8, replace=False):
+            keep[start:start + rng.integers(2, 90)] = False
+        minutes, values = minutes[keep], values[keep]
+
+    return pl.DataFrame({
+        "system_id": system_id,
+        "datetime": [datetime(2024, 12, 31) + timedelta(minutes=int(m)) for m in minutes],
+        "gmp343_corrected": values
+    })
+
+
+def reference_flags(values: np.ndarray, filtered: np.ndarray) -> list[str]:
+    """Flag of the original stage 02: 'H' where the filtered value differs at 2 decimals."""
+    changed = pl.Series(values).round(2) != pl.Series(filtered).cast(pl.Float64).round(2)
+    return ['H' if c else 'U' for c in changed]
+
+
+def reference_time_hampel(times: list[datetime], values: np.ndarray,
+                          window: str, n_sigma: float) -> tuple[np.ndarray, list[int]]:
+    """
+    The algorithm of the hampel package (single precision) on the rows within
+    [t - window / 2, t + window / 2]. Rows closer than window / 2 to the first or
+    last timestamp are not filtered.
+    """
+    half = np.timedelta64(parse_duration(window) / 2, "us")
+    t = np.array(times, dtype="datetime64[us]")
+    data = values.astype(np.float32)
+    filtered = data.copy()
+    outliers = []
+    for i in range(len(data)):
+        if t[i] - t[0] < half or t[-1] - t[i] < half:
+            continue
+        window_data = data[(t >= t[i] - half) & (t <= t[i] + half)]
+        median = np.float32(np.median(window_data))
+        mad = np.float32(np.median(np.abs(window_data - median)))
+        threshold = np.float32(np.float32(n_sigma) * 1.4826 * mad)
+        if np.abs(data[i] - median) > threshold:
+            filtered[i] = median
+            outliers.append(i)
+    return filtered, outliers
+
+
+@pytest.mark.parametrize("window", [5, 6, 11, 30, 60, 120, 121, 240])
+@pytest.mark.parametrize("n_sigma", [2.0, 3.0])
+def test_sample_window_matches_hampel_package(window: int,
+                                              n_sigma: float) -> None:
+    rng = np.random.default_rng(window)
+    df = pl.concat([measurements(4, 3000, rng), measurements(6, 2000, rng)])
+
+    result = df.lazy().pipe(hampel_flags, "gmp343_corrected", window, n_sigma) \
+        .collect()
+
+    for (system_id, ), df_system in df.group_by("system_id"):
+        values = df_system["gmp343_corrected"].to_numpy()
+        expected = hampel(values, window_size=window, n_sigma=n_sigma)
+        df_result = result.filter(pl.col("system_id") == system_id)
+
+        assert df_result["Flag"].to_list() == reference_flags(
+            values, expected.filtered_data)
+        assert np.flatnonzero(df_result["hampel_outlier"].to_numpy()).tolist() == \
+            list(expected.outlier_indices)
+
+
+@pytest.mark.parametrize("n_sigma", [2.0, 3.0])
+def test_time_window_with_gaps(n_sigma: float) -> None:
+    rng = np.random.default_rng(7)
+    df = pl.concat([measurements(4, 2000, rng, gaps=True),
+                    measurements(6, 1500, rng, gaps=True)])
+
+    result = df.lazy().pipe(hampel_flags, "gmp343_corrected", "120m", n_sigma) \
+        .collect()
+
+    for (system_id, ), df_system in df.group_by("system_id"):
+        values = df_system["gmp343_corrected"].to_numpy()
+        filtered, outliers = reference_time_hampel(
+            df_system["datetime"].to_list(), values, "120m", n_sigma)
+        df_result = result.filter(pl.col("system_id") == system_id)
+
+        assert len(outliers) > 0
+        assert df_result["Flag"].to_list() == reference_flags(values, filtered)
+        assert np.flatnonzero(df_result["hampel_outlier"].to_numpy()).tolist() == outliers
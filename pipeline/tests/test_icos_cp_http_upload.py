@@ -0,0 +1,135 @@
+import os
+import random
+import hashlib
+import threading
+import pytest
+from http.server import ThreadingHTTPServer
+from typing import Iterator
+
+from icos_cp_mock_server import MockPortalHandler
+from utils.icos_cp_http_upload import IcosCpUploadClient
+from utils.os_functions import package_files
+
+
+@pytest.fixture
+def portal(monkeypatch) -> Iterator[str]:
+    """scripts/icos_cp_mock_server.py on a free port, returns its URL."""
+    monkeypatch.setattr(MockPortalHandler, "objects", {})
+    monkeypatch.setattr(MockPortalHandler, "stats",
+                        dict.fromkeys(MockPortalHandler.stats, 0))
+    random.seed(0)
+    server = ThreadingHTTPServer(("localhost", 0), MockPortalHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def portal_config(url: str, **settings: object) -> dict:
+    return {
+        "icos_cities_portal": {
+            "login_url": f"{url}/password/login",
+            "upload_url": f"{url}/upload",
+            "portal_user": "user",
+            "portal_password": "password",
+            "submitter_id": "submitter",
+            "station_base_url": "http://meta.icos-cp.eu/resources/stations/",
+            "creator_s": "creator",
+            "contributor_s": [],
+            "comment": "",
+            "host_org_s": "host",
+            "keywords": [],
+            "l1_object_specification": "l1",
+            "l2_object_specification": "l2",
+            "upload_backoff_seconds": 0.0,
+            **settings
+        }
+    }
+
+
+@pytest.fixture
+def csv_file(tmp_path) -> str:
+    # incompressible content, the zip file is about as large as the file
+    path = tmp_path / "site.csv"
+    path.write_bytes(os.urandom(300 * 1024))
+    return str(path)
+
+
+def upload(config: dict, csv_file: str):
+    with IcosCpUploadClient(config, max_workers=1) as client:
+        return client.upload_file(root_directory=os.path.dirname(csv_file),
+                                  file_name=os.path.basename(csv_file),
+                                  site_id="TUMR",
+                                  sampling_height=10.0,
+                                  data_level=1)
+
+
+def uploaded_data(result) -> bytes:
+    return bytes(MockPortalHandler.objects[result.hash_sum])
+
+
+def test_upload_retries_failed_requests(portal: str, csv_file: str,
+                                        monkeypatch) -> None:
+    monkeypatch.setattr(MockPortalHandler, "fail_rate", 0.5)
+    result = upload(portal_config(portal), csv_file)
+
+    assert result.success
+    assert MockPortalHandler.stats["injected_errors"] > 0
+    assert hashlib.sha256(uploaded_data(result)).hexdigest() == result.hash_sum
+
+
+def test_chunked_upload_resumes_after_dropped_connections(
+        portal: str, csv_file: str, monkeypatch) -> None:
+    monkeypatch.setattr(MockPortalHandler, "fail_rate", 0.1)
+    monkeypatch.setattr(MockPortalHandler, "drop_rate", 0.4)
+    result = upload(
+        portal_config(portal, upload_chunk_size_mb=0.05, upload_retries=10),
+        csv_file)
+
+    assert result.success
+    assert MockPortalHandler.stats["dropped_connections"] > 0
+    assert len(uploaded_data(result)) == result.size
+    assert hashlib.sha256(uploaded_data(result)).hexdigest() == result.hash_sum
+    # the chunks received before a dropped connection are not sent again
+    assert MockPortalHandler.stats["bytes_received"] < 2 * result.size
+
+
+def test_upload_fails_after_retries(portal: str, csv_file: str,
+                                    monkeypatch) -> None:
+    config = portal_config(portal, upload_retries=2)
+    with IcosCpUploadClient(config, max_workers=1) as client:
+        monkeypatch.setattr(MockPortalHandler, "fail_rate", 1.0)
+        result = client.upload_file(root_directory=os.path.dirname(csv_file),
+                                    file_name=os.path.basename(csv_file),
+                                    site_id="TUMR",
+                                    sampling_height=10.0,
+                                    data_level=1)
+
+    assert not result.success
+    assert result.failure is not None
+    assert result.failure.stage == "registration"
+    assert result.failure.status_code == 503
+    assert result.attempts == 3
+
+
+def test_missing_file_fails_only_its_upload(portal: str, csv_file: str,
+                                            tmp_path) -> None:
+    missing = str(tmp_path / "missing.csv")
+    packages = package_files([missing, csv_file], workers=1)
+    assert packages[0] is None and packages[1] is not None
+
+    with IcosCpUploadClient(portal_config(portal), max_workers=2) as client:
+        results = client.upload_files([{
+            "root_directory": os.path.dirname(path),
+            "file_name": os.path.basename(path),
+            "site_id": "TUMR",
+            "sampling_height": 10.0,
+            "data_level": 1,
+            "package": package
+        } for path, package in zip([missing, csv_file], packages)])
+
+    assert not results[0].success
+    assert results[0].failure is not None
+    assert results[0].failure.stage == "package"
+    assert results[1].success
@@ -0,0 +1,51 @@
+import json
+import pytest
+
+from utils import metrics
+from utils.metrics import measure, reset_peak_rss
+
+MB = 1024**2
+
+
+@pytest.fixture(autouse=True)
+def log_directory(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(metrics, "LOG_DIRECTORY", str(tmp_path))
+
+
+def records() -> dict:
+    with open(metrics.metrics_path(), "r") as f:
+        return {
+            record["step"]: record
+            for record in map(json.loads, f)
+        }
+
+
+@pytest.mark.skipif(not reset_peak_rss(),
+                    reason="the peak RSS can only be reset on Linux")
+def test_peak_rss_is_measured_per_step() -> None:
+    with measure("large"):
+        data = bytearray(200 * MB)
+        del data
+    with measure("outer"):
+        data = bytearray(100 * MB)
+        del data
+        with measure("inner"):
+            pass
+
+    steps = records()
+    assert steps["large"]["peak_rss_mb"] >= 200
+    # earlier steps don't count towards the peak of a step
+    assert steps["inner"]["peak_rss_mb"] < steps["large"]["peak_rss_mb"] - 150
+    # the peak of a nested step does not hide the peak of the outer step
+    assert steps["outer"]["peak_rss_mb"] >= 100
+    assert steps["outer"]["peak_rss_mb"] < steps["large"]["peak_rss_mb"] - 50
+
+
+def test_failed_steps_are_recorded() -> None:
+    with pytest.raises(ValueError):
+        with measure("failing", rows_in=10, system_id=4):
+            raise ValueError()
+
+    record = records()["failing"]
+    assert record["ok"] is False
+    assert record["rows_in"] == 10 and record["system_id"] == 4
@@ -0,0 +1,30 @@
+import os
+
+from utils.watermarks import fingerprint_files
+
+
+def write(path, data: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(0, 0))
+    return str(path)
+
+
+def test_fingerprint_distinguishes_hive_partitions(tmp_path) -> None:
+    # same name, size and modification time in another partition
+    before = write(tmp_path / "id=4" / "year=2024" / "data.parquet", b"data")
+    fingerprint = fingerprint_files([before], str(tmp_path))
+
+    os.remove(before)
+    after = write(tmp_path / "id=4" / "year=2025" / "data.parquet", b"data")
+    assert fingerprint_files([after], str(tmp_path)) != fingerprint
+
+
+def test_fingerprint_is_independent_of_the_root_location(tmp_path) -> None:
+    paths = [
+        write(tmp_path / root / "id=4" / f"year={year}" / "data.parquet",
+              b"data") for root in ("a", "b") for year in (2024, 2025)
+    ]
+    assert fingerprint_files(paths[:2], str(tmp_path / "a")) == \
+        fingerprint_files(paths[2:], str(tmp_path / "b"))
@@ -0,0 +1,117 @@
+import glob
+import os
+import polars as pl
+import pyarrow.parquet as pq  # type: ignore
+import pytest
+from datetime import datetime
+from polars.testing import assert_frame_equal
+
+from utils.parquet_manifest import load_manifest, overlapping_row_range
+from utils.write_parquet import write_hive_partitions, write_sorted_parquet
+
+
+def hourly(start: datetime, end: datetime) -> pl.DataFrame:
+    datetimes = pl.datetime_range(start, end, "1h", eager=True)
+    return pl.DataFrame({
+        "datetime": datetimes,
+        "system_id": 4,
+        "value": range(len(datetimes))
+    })
+
+
+def months(target_directory: str) -> list[str]:
+    return sorted(
+        os.path.relpath(os.path.dirname(path), target_directory)
+        for path in glob.glob(os.path.join(target_directory, "**", "data.parquet"),
+                              recursive=True))
+
+
+def test_full_write_removes_stale_months(tmp_path) -> None:
+    target = str(tmp_path)
+    write_hive_partitions(hourly(datetime(2024, 11, 1), datetime(2025, 2, 28)),
+                          target, 4)
+    # November and February are gone, e.g. after a change of the input years
+    write_hive_partitions(hourly(datetime(2024, 12, 1), datetime(2025, 1, 31)),
+                          target, 4)
+
+    assert months(target) == [
+        "acropolis/system_id=4/year=2024/month=12",
+        "acropolis/system_id=4/year=2025/month=1"
+    ]
+    # no staging directories are left behind
+    assert os.listdir(target) == ["acropolis"]
+
+
+def test_incremental_write_only_touches_merged_months(tmp_path) -> None:
+    target = str(tmp_path)
+    write_hive_partitions(hourly(datetime(2024, 11, 1), datetime(2025, 2, 28)),
+                          target, 4)
+    november = os.path.join(target, "acropolis", "system_id=4", "year=2024",
+                            "month=11", "data.parquet")
+    mtime = os.stat(november).st_mtime_ns
+
+    # merge from December on, the data now ends in January
+    df_merged = hourly(datetime(2024, 12, 1), datetime(2025, 1, 31))
+    write_hive_partitions(df_merged, target, 4, since=datetime(2024, 12, 15))
+
+    assert months(target) == [
+        "acropolis/system_id=4/year=2024/month=11",
+        "acropolis/system_id=4/year=2024/month=12",
+        "acropolis/system_id=4/year=2025/month=1"
+    ]
+    assert os.stat(november).st_mtime_ns == mtime
+    df = pl.read_parquet(os.path.join(target, "acropolis", "system_id=4",
+                                      "year=2025", "month=1", "data.parquet"))
+    assert df["datetime"].max() == datetime(2025, 1, 31)
+
+
+def test_sorted_parquet_records_the_sort_order(tmp_path) -> None:
+    file_path = str(tmp_path / "data.parquet")
+    df = hourly(datetime(2025, 1, 1), datetime(2025, 1, 10))
+    write_sorted_parquet(df.reverse(), file_path, {"row_group_size": 50})
+
+    assert_frame_equal(pl.read_parquet(file_path), df)
+    metadata = pq.ParquetFile(file_path).metadata
+    assert metadata.num_row_groups > 1
+    for i in range(metadata.num_row_groups):
+        assert metadata.row_group(i).sorting_columns == (pq.SortingColumn(
+            df.columns.index("datetime"), nulls_first=True), )
+
+
+def test_manifest_row_range_covers_the_selected_rows(tmp_path) -> None:
+    file_path = str(tmp_path / "data.parquet")
+    df = hourly(datetime(2025, 1, 1), datetime(2025, 1, 10))
+    write_sorted_parquet(df, file_path, {"row_group_size": 50})
+
+    start, end = datetime(2025, 1, 4, 12), datetime(2025, 1, 5, 6)
+    row_range = overlapping_row_range(load_manifest(file_path), start, end)
+    assert row_range is not None
+    offset, length = row_range
+    # whole row groups of 50 rows
+    assert offset % 50 == 0 and length < len(df)
+    df_range = pl.read_parquet(file_path).slice(offset, length)
+    assert_frame_equal(
+        df_range.filter(pl.col("datetime").is_between(start, end)),
+        df.filter(pl.col("datetime").is_between(start, end)))
+
+    assert overlapping_row_range(load_manifest(file_path),
+                                 datetime(2025, 2, 1), None) is None
+
+
+def test_failed_write_keeps_the_existing_file(tmp_path, monkeypatch) -> None:
+    file_path = str(tmp_path / "data.parquet")
+    df = hourly(datetime(2025, 1, 1), datetime(2025, 1, 2))
+    write_sorted_parquet(df, file_path)
+
+    def failing_write(self, file, **kwargs) -> None:
+        with open(file, "wb") as f:
+            f.write(b"PAR1")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(pl.DataFrame, "write_parquet", failing_write)
+    with pytest.raises(OSError):
+        write_sorted_parquet(df.head(3), file_path)
+
+    # the temporary file is removed
+    assert sorted(os.listdir(tmp_path)) == ["data.parquet", "data.parquet.manifest.json"]
+    assert_frame_equal(pl.read_parquet(file_path), df)
@@ -11,12 +11,18 @@ refactored by Patrick Aigner
 
 from typing import Final
 import numpy as np
+import polars as pl
 
 T0: Final = 273.15  # T0: float = The 0 C temperature in K
 TC: Final = 647.096  # TC: float = The critical point temperature of water
 PC: Final = 22.064e6  # PC: float = The critical point pressure of water
 P0: Final = 1013.25e2  # P0: float = Reference pressure at sea level
 
+# Coefficients and exponents of the saturation vapor pressure equation (Wagner & Pruss, 2002)
+WAGNER_PRUSS_COEFFICIENTS: Final = (-7.85951783, 1.84408259, -11.7866497,
+                                    22.6807411, -15.9618719, 1.80122502)
+WAGNER_PRUSS_EXPONENTS: Final = (1.0, 1.5, 3.0, 3.5, 4.0, 7.5)
+
 
 def absolute_temperature(t: float) -> float:
     """
@@ -40,12 +46,7 @@ def saturation_vapor_pressure(t: float) -> float:
     Returns:
     float = Saturation Vapor Pressure of water in Pa
     """
-    coef_1 = -7.85951783
-    coef_2 = 1.84408259
-    coef_3 = -11.7866497
-    coef_4 = 22.6807411
-    coef_5 = -15.9618719
-    coef_6 = 1.80122502
+    coef_1, coef_2, coef_3, coef_4, coef_5, coef_6 = WAGNER_PRUSS_COEFFICIENTS
     theta = 1 - t / TC
     pw = (
         np.exp(
@@ -108,3 +109,71 @@ def calculate_co2dry(co2wet: float, temperature: float, rh: float, pressure: flo
     """
     xh2o = rh_to_mole_fraction(rh=rh, t=absolute_temperature(temperature), p=pressure)
     return co2wet / (1 - xh2o)
+
+
+
+# Polars expression versions of the functions above.
+# They evaluate the same formulas inside the Polars engine (no Python call per row).
+
+
+def absolute_temperature_expr(t: pl.Expr) -> pl.Expr:
+    """
+    Expression version of absolute_temperature.
+
+    t: pl.Expr = Temperature in C
+
+    Returns:
+    pl.Expr = Temperature in K
+    """
+    return t + T0
+
+
+def saturation_vapor_pressure_expr(t: pl.Expr) -> pl.Expr:
+    """
+    Expression version of saturation_vapor_pressure.
+
+    t: pl.Expr = Temperature in K
+
+    Returns:
+    pl.Expr = Saturation Vapor Pressure of water in Pa
+    """
+    theta = 1 - t / TC
+    terms = [
+        coef * (theta if exponent == 1.0 else theta.pow(exponent))
+        for coef, exponent in zip(WAGNER_PRUSS_COEFFICIENTS,
+                                  WAGNER_PRUSS_EXPONENTS)
+    ]
+    return (TC / t * pl.sum_horizontal(terms)).exp() * PC
+
+
+def rh_to_mole_fraction_expr(rh: pl.Expr, t: pl.Expr, p: pl.Expr) -> pl.Expr:
+    """
+    Expression version of rh_to_mole_fraction.
+
+    rh: pl.Expr = The relative humidity in %
+    t: pl.Expr = The absolute temperature in K
+    p: pl.Expr = Pressure in Pa
+
+    Returns:
+    pl.Expr = Water vapor mole fraction
+    """
+    return saturation_vapor_pressure_expr(t) * rh / 100 / p
+
+
+def calculate_co2dry_expr(co2wet: pl.Expr, temperature: pl.Expr,
+                          rh: pl.Expr, pressure: pl.Expr) -> pl.Expr:
+    """
+    Expression version of calculate_co2dry.
+
+    co2wet pl.Expr: CO2 wet in ppm
+    temperature pl.Expr: Temperature in °C
+    rh pl.Expr: The relative humidity in %
+    pressure pl.Expr: Pressure in Pa
+
+    Returns:
+    pl.Expr: CO2 dry in ppm
+    """
+    xh2o = rh_to_mole_fraction_expr(rh=rh,
+                                    t=absolute_temperature_expr(temperature),
+                                    p=pressure)
+    return co2wet / (1 - xh2o)
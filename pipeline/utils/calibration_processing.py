@@ -2,13 +2,11 @@ import warnings
 import polars as pl
 import numpy
 
-from .paths import AVERAGED_GASES
+from .context import get_context
+from .dataframe_operations import FrameType
 
 warnings.simplefilter("ignore", category=FutureWarning)
 
-# load calibration bottle concentrations (preprocessed)
-df_gas = pl.read_csv(AVERAGED_GASES)
-
 
 # define functions
 def process_bottle(data: list, ignore_len: bool = False):
@@ -26,6 +24,29 @@ def process_bottle(data: list, ignore_len: bool = False):
     else:
         return 0.0
 
+
+def bottle_median_expr(values: pl.Expr, ignore_len: bool = False) -> pl.Expr:
+    """
+    process_bottle as a group_by aggregation: median of the calibration
+    values of one bottle.
+    The first 30% (2nd bottle, 50-70 values) or 50% (1st bottle, 70-130 values)
+    and the last 5% of the values are skipped. Returns 0.0 for other lengths.
+    """
+    n = pl.len()
+    upper = (n * 0.95).floor().cast(pl.Int64)
+
+    def median(lower: pl.Expr) -> pl.Expr:
+        return values.slice(lower, upper - lower).median()
+
+    if ignore_len:
+        return median((n * 0.3).floor().cast(pl.Int64))
+    return (
+        # 2nd bottle
+        pl.when((n > 50) & (n < 70)).then(median((n * 0.3).floor().cast(pl.Int64)))
+        # 1st bottle
+        .when((n > 70) & (n < 130)).then(median((n * 0.5).floor().cast(pl.Int64)))
+        .otherwise(0.0))
+
 # 2 point calibration correction
 
 def two_point_calibration(measured_values: list, true_values: list):
@@ -42,72 +63,48 @@ def two_point_calibration(measured_values: list, true_values: list):
 
     return {"slope": slope, "intercept": intercept}
 
-def calculate_slope_intercept(df: pl.DataFrame) -> pl.DataFrame:
+def two_point_calibration_expr(measured_values: list[pl.Expr],
+                               true_values: list[pl.Expr]) -> list[pl.Expr]:
+    # two_point_calibration on the columns of the daily bottle pairs
+    slope = (true_values[1] - true_values[0]) / (measured_values[1] -
+                                                 measured_values[0])
+    # y_true = m * y_meas + t
+    intercept = true_values[0] - slope * measured_values[0]
+
+    return [slope.alias("slope"), intercept.alias("intercept")]
+
+def calculate_bottle_medians(df: pl.DataFrame) -> pl.DataFrame:
     """
-    Calculate slope and intercept for each calibration bottle and each calibration day
-    (1) Groupy by date, system_id, cal_bottle_id to create a list of calibration values for each bottle_id
-    (2) Process list of calibration values with function process_bottle
-    (3) Group by date, system_id to bundle both calibration cylinder results from each day
-    (4) Calculate slope and intercept with function two_point_calibration
-    (5) Filter out invalid calibration results (i.e. unreasonable slopes from outliers)
-    
-    Info: 
-    - Does only work for a frequency of 1 calibration (2 bottles) per day. Else it groups all calibration attemps for the day together.
-    - Can handle any sequence of calibration bottles (high, low) or (low, high)
-    - Can handle any freuqency of calibration days >= 1
+    Medians of both calibration bottles for each calibration day
+    (1) Groupy by date, system_id, cal_bottle_id and calculate the median of the calibration values with bottle_median_expr
+    (2) Group by date, system_id to bundle both calibration cylinder results from each day, ordered by median
     
     :param df: DataFrame with calibration data
-    :return: DataFrame with slope and intercept for each calibration
+    :return: DataFrame with datetime, system_id, medians (measured_0 < measured_1) and bottle concentrations (true_0, true_1)
     """
+    # calibration bottle concentrations (preprocessed)
+    df_gas = get_context().df_gas
     return df.join(df_gas.cast({"cal_bottle_id": pl.Float64}), on=["cal_bottle_id"], how="left", coalesce=True) \
     .with_columns((pl.col("datetime").dt.date()).alias("date")) \
     .sort("date") \
     .group_by(["date", "system_id", "cal_bottle_id"]) \
     .agg([
-        pl.col("cal_gmp343_filtered"),
+        bottle_median_expr(pl.col("cal_gmp343_filtered")).alias("cal_gmp343_filtered"),
         pl.col("cal_bottle_CO2").last(),
         pl.col("datetime").last(),
     ]) \
-    .with_columns([
-        pl.col("cal_gmp343_filtered").map_elements(lambda x: process_bottle(x), return_dtype=pl.Float64)
-    ]) \
     .filter(pl.col("cal_gmp343_filtered") > 0) \
     .sort(pl.col("cal_gmp343_filtered")) \
     .group_by(["date", "system_id"]) \
     .agg([
-        pl.col("cal_gmp343_filtered"),
-        pl.col("cal_bottle_CO2"),
+        pl.len().alias("bottles"),
+        pl.col("cal_gmp343_filtered").first().alias("measured_0"),
+        pl.col("cal_gmp343_filtered").last().alias("measured_1"),
+        pl.col("cal_bottle_CO2").first().alias("true_0"),
+        pl.col("cal_bottle_CO2").last().alias("true_1"),
         pl.col("datetime").last()
     ]) \
-    .filter(pl.col("cal_gmp343_filtered").list.len() == 2) \
-    .with_columns(
-    pl.struct(["cal_gmp343_filtered", "cal_bottle_CO2"])
-    .map_elements(lambda x: two_point_calibration(x["cal_gmp343_filtered"], x["cal_bottle_CO2"]), return_dtype=pl.Struct)
-    .alias("slope_intercept"))  \
-    .with_columns([
-        pl.col("slope_intercept").struct.field("slope").alias("slope"),
-        pl.col("slope_intercept").struct.field("intercept").alias("intercept")
-    ]) \
-    .select("datetime", "system_id", "slope", "intercept") \
-    .filter(pl.col("slope") > 0.9) \
-    .filter(pl.col("slope") < 1.1) \
-    .sort("datetime")
-
-def apply_slope_intercept(df: pl.DataFrame,
-                          df_slope_intercept: pl.DataFrame) -> pl.DataFrame:
-    return df.sort("datetime") \
-        .join_asof(df_slope_intercept, on="datetime", strategy="nearest", tolerance="10m") \
-        .with_columns([
-            pl.col("slope").interpolate().alias("slope_interpolated"),
-            pl.col("intercept").interpolate().alias("intercept_interpolated")
-            ]) \
-        .with_columns([
-            pl.col("slope").forward_fill().backward_fill(),
-            pl.col("intercept").forward_fill().backward_fill(),
-            pl.col("slope_interpolated").forward_fill().backward_fill(),
-            pl.col("intercept_interpolated").forward_fill().backward_fill(),
-            ]) \
-        .with_columns(((pl.col("gmp343_dry")) * pl.col("slope_interpolated") + pl.col("intercept_interpolated")).alias("gmp343_corrected"))
+    .filter(pl.col("bottles") == 2)
 
 # 1 point calibration correction
 
@@ -130,55 +127,84 @@ def one_point_calibration(measured_values: list, true_values: list):
      
     return {"offset_low": offset_low, "offset_high": offset_high, "bottle_median_low": bottle_median_low, "bottle_median_high": bottle_median_high}
 
-def calculate_offset_low_high(df: pl.DataFrame) -> pl.DataFrame:
-    return df.join(df_gas.cast({"cal_bottle_id": pl.Float64}), on=["cal_bottle_id"], how="left", coalesce=True) \
-    .with_columns((pl.col("datetime").dt.date()).alias("date")) \
-    .sort("date") \
-    .group_by(["date", "system_id", "cal_bottle_id"]) \
-    .agg([
-        pl.col("cal_gmp343_filtered"),
-        pl.col("cal_bottle_CO2").last(),
-        pl.col("datetime").last(),
-    ]) \
-    .with_columns([
-        pl.col("cal_gmp343_filtered").map_elements(lambda x: process_bottle(x), return_dtype=pl.Float64)
-    ]) \
-    .filter(pl.col("cal_gmp343_filtered") > 0) \
-    .sort(pl.col("cal_gmp343_filtered")) \
-    .group_by(["date", "system_id"]) \
-    .agg([
-        pl.col("cal_gmp343_filtered"),
-        pl.col("cal_bottle_CO2"),
-        pl.col("datetime").last()
-    ]) \
-    .filter(pl.col("cal_gmp343_filtered").list.len() == 2) \
+def one_point_calibration_expr(measured_values: list[pl.Expr],
+                               true_values: list[pl.Expr]) -> list[pl.Expr]:
+    # one_point_calibration on the columns of the daily bottle pairs
+    first_is_high = measured_values[0] > measured_values[1]
+    
+    def pick(high: bool, values: list[pl.Expr]) -> pl.Expr:
+        return pl.when(first_is_high).then(values[0 if high else 1]).otherwise(values[1 if high else 0])
+     
+    return [
+        (pick(False, true_values) - pick(False, measured_values)).alias("offset_low"),
+        (pick(True, true_values) - pick(True, measured_values)).alias("offset_high"),
+        pick(False, measured_values).alias("bottle_median_low"),
+        pick(True, measured_values).alias("bottle_median_high")
+    ]
+
+# combined 2 point and 1 point calibration correction
+
+def calculate_calibration_parameters(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Calculate the 2 point (slope, intercept) and 1 point (offset_low, offset_high) calibration
+    parameters for each calibration day in one pass
+    (1) Calculate the medians of both calibration bottles with calculate_bottle_medians
+    (2) Calculate slope and intercept with function two_point_calibration_expr
+    (3) Calculate offsets and bottle medians with function one_point_calibration_expr
+    (4) Set slope and intercept of invalid calibration results (i.e. unreasonable slopes from outliers) to null
+    
+    Info: 
+    - Does only work for a frequency of 1 calibration (2 bottles) per day. Else it groups all calibration attemps for the day together.
+    - Can handle any sequence of calibration bottles (high, low) or (low, high)
+    - Can handle any freuqency of calibration days >= 1
+    
+    :param df: DataFrame with calibration data
+    :return: DataFrame with slope, intercept, offset_low, offset_high, bottle_median_low, bottle_median_high for each calibration
+    """
+    measured_values = [pl.col("measured_0"), pl.col("measured_1")]
+    true_values = [pl.col("true_0"), pl.col("true_1")]
+    valid_slope = (pl.col("slope") > 0.9) & (pl.col("slope") < 1.1)
+
+    return calculate_bottle_medians(df) \
+    .with_columns(two_point_calibration_expr(measured_values, true_values)) \
+    .with_columns(one_point_calibration_expr(measured_values, true_values)) \
     .with_columns(
-    pl.struct(["cal_gmp343_filtered", "cal_bottle_CO2"])
-    .map_elements(lambda x: one_point_calibration(x["cal_gmp343_filtered"], x["cal_bottle_CO2"]), return_dtype=pl.Struct)
-    .alias("result_low_high"))  \
-    .with_columns([
-        pl.col("result_low_high").struct.field("offset_low").alias("offset_low"),
-        pl.col("result_low_high").struct.field("offset_high").alias("offset_high"),
-        pl.col("result_low_high").struct.field("bottle_median_low").alias("bottle_median_low"),
-        pl.col("result_low_high").struct.field("bottle_median_high").alias("bottle_median_high")
-    ]) \
-    .select("datetime", "system_id", "offset_low", "offset_high", "bottle_median_low", "bottle_median_high") \
+        pl.when(valid_slope).then(pl.col("slope")).alias("slope"),
+        pl.when(valid_slope).then(pl.col("intercept")).alias("intercept")) \
+    .select("datetime", "system_id", "slope", "intercept", "offset_low", "offset_high", "bottle_median_low", "bottle_median_high") \
     .sort("datetime")
 
-def apply_offset_low_high(df: pl.DataFrame,
-                          df_offset_low_high: pl.DataFrame,
-                          run:bool) -> pl.DataFrame:
-    if not run:
-        return df
-    
-    return df.sort("datetime") \
-        .join_asof(df_offset_low_high, on="datetime", strategy="nearest", tolerance="10m") \
+def apply_calibration_parameters(df: FrameType,
+                                 df_calibration_parameters: pl.DataFrame,
+                                 run_one_point: bool) -> FrameType:
+    """
+    Join the calibration parameters to the nearest measurement (10 min tolerance) and
+    apply the 2 point (interpolated slope and intercept) and, if run_one_point, the 1 point correction.
+    """
+    one_point_columns = ["offset_low", "offset_high", "bottle_median_low", "bottle_median_high"]
+
+    if run_one_point:
+        fill_columns = ["slope", "intercept", "slope_interpolated", "intercept_interpolated"] + one_point_columns
+    else:
+        # only calibrations with a valid slope are joined
+        df_calibration_parameters = df_calibration_parameters.filter(pl.col("slope").is_not_null()).drop(one_point_columns)
+        fill_columns = ["slope", "intercept", "slope_interpolated", "intercept_interpolated"]
+
+    df = df.sort("datetime") \
+        .join_asof(df_calibration_parameters.lazy() if isinstance(df, pl.LazyFrame) else df_calibration_parameters,
+                   on="datetime", strategy="nearest", tolerance="10m") \
         .with_columns([
-            pl.col("offset_low").forward_fill().backward_fill(),
-            pl.col("offset_high").forward_fill().backward_fill(),
-            pl.col("bottle_median_low").forward_fill().backward_fill(),
-            pl.col("bottle_median_high").forward_fill().backward_fill(),
+            pl.col("slope").interpolate().alias("slope_interpolated"),
+            pl.col("intercept").interpolate().alias("intercept_interpolated")
             ]) \
+        .with_columns([pl.col(column).forward_fill().backward_fill() for column in fill_columns]) \
+        .with_columns(((pl.col("gmp343_dry")) * pl.col("slope_interpolated") + pl.col("intercept_interpolated")).alias("gmp343_corrected"))
+
+    if not run_one_point:
+        return df
+
+    # keep the 1 point columns behind the 2 point results
+    return df.select(pl.exclude(one_point_columns), *one_point_columns) \
         .with_columns(
             ((pl.col("gmp343_dry")) + pl.col("offset_low")).alias("gmp343_corrected_one_point_low"),
             ((pl.col("gmp343_dry")) + pl.col("offset_high")).alias("gmp343_corrected_one_point_high"),
@@ -0,0 +1,125 @@
+import os
+import json
+import polars as pl
+from functools import cached_property
+from typing import Optional
+
+from .config_files import PROJECT_DIR, CONFIG_DIRECTORY
+
+# Override the config file, the data directory and the site metadata of the
+# default context. Spawned worker processes inherit the environment and
+# therefore resolve the same paths as their parent (see configure).
+CONFIG_PATH_VARIABLE = "ACROPOLIS_CONFIG"
+DATA_DIRECTORY_VARIABLE = "ACROPOLIS_DATA_DIRECTORY"
+SITES_PATH_VARIABLE = "ACROPOLIS_SITES"
+
+
+class PipelineContext:
+    """
+    Configuration, paths and reference data of the pipeline. Nothing is read
+    before first use, afterwards the values are cached and shared by all modules:
+
+        from utils.context import get_context
+        df_gas = get_context().df_gas
+
+    The paths are also available as attributes of utils.paths (paths.X).
+    """
+
+    def __init__(self,
+                 config_path: Optional[str] = None,
+                 data_directory: Optional[str] = None,
+                 sites_path: Optional[str] = None) -> None:
+        self.config_path = config_path or os.environ.get(
+            CONFIG_PATH_VARIABLE) or os.path.join(CONFIG_DIRECTORY,
+                                                  "config.json")
+        self.data_directory = data_directory or os.environ.get(
+            DATA_DIRECTORY_VARIABLE) or os.path.join(PROJECT_DIR, "data")
+        self.sites_path = sites_path or os.environ.get(
+            SITES_PATH_VARIABLE) or os.path.join(CONFIG_DIRECTORY, "sites.csv")
+
+    @cached_property
+    def config(self) -> dict:
+        if not os.path.exists(self.config_path):
+            raise FileNotFoundError(f"Config file not found: {self.config_path}")
+
+        with open(self.config_path, 'r') as f:
+            return json.load(f)
+
+    @cached_property
+    def df_gas(self) -> pl.DataFrame:
+        """Calibration bottle info (preprocessed), see averaged_gases.csv."""
+        return pl.read_csv(self.averaged_gases)
+
+    @cached_property
+    def sites_meta(self) -> pl.DataFrame:
+        """Site metadata for the ICOS Cities portal (sites.csv), all columns as strings."""
+        return pl.read_csv(self.sites_path,
+                           separator=";").with_columns(
+                               pl.exclude(pl.Utf8).cast(str))
+
+    # Input Data Directories
+    @property
+    def picarro_data_directory(self) -> str:
+        return self.config["measurement_data_paths"]["picarro"]
+
+    @property
+    def thingsboard_data_directory(self) -> str:
+        return self.config["measurement_data_paths"]["thingsboard"]
+
+    # Project Data Directories
+    @property
+    def averaged_gases(self) -> str:
+        return os.path.join(self.data_directory, "input", "averaged_gases.csv")
+
+    @property
+    def processed_picarro_data_directory(self) -> str:
+        return os.path.join(self.data_directory, "input", "picarro")
+
+    @property
+    def pipeline_data_directory(self) -> str:
+        return os.path.join(self.data_directory, "output", "pipeline")
+
+    @property
+    def postprocessed_data_directory(self) -> str:
+        return os.path.join(self.pipeline_data_directory, "postprocessed")
+
+    @property
+    def despiked_data_directory(self) -> str:
+        return os.path.join(self.pipeline_data_directory, "despiked")
+
+    @property
+    def icos_cities_level_1(self) -> str:
+        return os.path.join(self.pipeline_data_directory, "icos_cities_portal",
+                            "level_1")
+
+    @property
+    def icos_cities_level_2(self) -> str:
+        return os.path.join(self.pipeline_data_directory, "icos_cities_portal",
+                            "level_2")
+
+
+_context: Optional[PipelineContext] = None
+
+
+def get_context() -> PipelineContext:
+    """The context of the process, created on first use."""
+    global _context
+    if _context is None:
+        _context = PipelineContext()
+    return _context
+
+
+def configure(config_path: Optional[str] = None,
+              data_directory: Optional[str] = None,
+              sites_path: Optional[str] = None) -> PipelineContext:
+    """
+    Replace the context of the process, e.g. to run the pipeline on other data
+    in a notebook or test. The paths are exported to the environment, so that
+    worker processes started afterwards use them as well.
+    """
+    global _context
+    _context = PipelineContext(config_path, data_directory, sites_path)
+    os.environ[CONFIG_PATH_VARIABLE] = _context.config_path
+    os.environ[DATA_DIRECTORY_VARIABLE] = _context.data_directory
+    os.environ[SITES_PATH_VARIABLE] = _context.sites_path
+    return _context
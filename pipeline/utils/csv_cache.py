@@ -0,0 +1,158 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import polars as pl
+from typing import Callable
+
+from .os_functions import ensure_data_dir
+from .icos_cp_csv_conversion import IcosCsvProduct, icos_csv_file_name, render_icos_csv_header, write_icos_csv_body, write_icos_csv
+
+# Rendered csv bodies are cached per month in <target directory>/.cache/<file name>/<YYYY-MM>.csv
+CACHE_DIRECTORY_NAME = ".cache"
+# Increase to invalidate all cached months (e.g. after changing the ICOS CP conversion)
+CACHE_VERSION = 1
+
+
+def _cache_key() -> str:
+    # row hashes are only stable within one Polars version
+    return f"{CACHE_VERSION}:{pl.__version__}"
+
+
+def month_hash(df: pl.DataFrame) -> str:
+    """Hash of the schema and all rows (in order) of a DataFrame."""
+    sha256 = hashlib.sha256()
+    sha256.update(str(df.schema).encode())
+    sha256.update(df.hash_rows(seed=0).to_numpy().tobytes())
+    return sha256.hexdigest()
+
+
+def load_cache_index(cache_directory: str) -> dict:
+    """
+    Load the index of the cached months.
+
+    Returns:
+        dict month -> {"hash", "rows", "start_date", "stop_date"}, empty if
+        there is no cache or it was written with another CACHE_VERSION / Polars version.
+    """
+    path = os.path.join(cache_directory, "index.json")
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as f:
+        index = json.load(f)
+    if index.get("key") != _cache_key():
+        return {}
+    return index["months"]
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # write to a temporary file first to never leave a broken file behind
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def write_icos_csv_cached(df: pl.DataFrame,
+                          sites_meta: pl.DataFrame,
+                          site: str,
+                          target_directory: str,
+                          product: IcosCsvProduct,
+                          convert: Callable[[pl.DataFrame], pl.DataFrame]) -> None:
+    """
+    Write an ICOS CP csv file from cached monthly body chunks.
+
+    df is split into months (by "datetime"), only months whose data changed
+    since the last run are converted with convert and rendered. The file is
+    assembled from a freshly rendered header (line count, covering period and
+    site metadata may change) and the cached bodies. The result is identical
+    to write_icos_csv(convert(df), ...).
+
+    If the months of df are not in chronological order, the file is written
+    without cache.
+    """
+    file_name = icos_csv_file_name(site, product)
+    file_path = os.path.join(target_directory, file_name)
+    cache_directory = os.path.join(target_directory, CACHE_DIRECTORY_NAME,
+                                   file_name)
+
+    df = df.with_columns(
+        pl.col("datetime").dt.strftime("%Y-%m").alias("__month"))
+    if not df["__month"].is_sorted():
+        logging.info(
+            f"Site {site}: data not in chronological order, writing without cache")
+        write_icos_csv(df=convert(df.drop("__month")),
+                       sites_meta=sites_meta,
+                       site=site,
+                       target_directory=target_directory,
+                       product=product)
+        return
+
+    ensure_data_dir(cache_directory)
+    cached = load_cache_index(cache_directory)
+    index = {}
+    rendered = 0
+
+    # Update the cached bodies of changed months
+    for (month, ), df_month in df.partition_by("__month",
+                                               maintain_order=True,
+                                               include_key=False,
+                                               as_dict=True).items():
+        data_hash = month_hash(df_month)
+        chunk_path = os.path.join(cache_directory, f"{month}.csv")
+        entry = cached.get(str(month))
+
+        if entry is None or entry["hash"] != data_hash or not os.path.isfile(
+                chunk_path):
+            df_icos = convert(df_month)
+            with open(chunk_path + ".tmp", "wb") as chunk:
+                write_icos_csv_body(df_icos, product, chunk)
+            os.replace(chunk_path + ".tmp", chunk_path)
+            entry = {
+                "hash": data_hash,
+                "rows": len(df_icos),
+                "start_date": df_icos["#Datetime"][0],
+                "stop_date": df_icos["#Datetime"][-1]
+            }
+            rendered += 1
+        index[str(month)] = entry
+
+    logging.info(
+        f"Site {site}: {rendered} of {len(index)} months rendered, others from cache"
+    )
+
+    # Remove months without data
+    for month in set(cached) - set(index):
+        chunk_path = os.path.join(cache_directory, f"{month}.csv")
+        if os.path.isfile(chunk_path):
+            os.remove(chunk_path)
+
+    _write_atomic(
+        os.path.join(cache_directory, "index.json"),
+        json.dumps({
+            "key": _cache_key(),
+            "months": index
+        }, indent=2).encode())
+
+    if len(index) == 0:
+        logging.warning(f"Site {site}: no data, {file_name} not written")
+        return
+
+    months = sorted(index)
+    header = render_icos_csv_header(
+        sites_meta=sites_meta,
+        site=site,
+        product=product,
+        rows=sum(index[month]["rows"] for month in months),
+        start_date=index[months[0]]["start_date"],
+        stop_date=index[months[-1]]["stop_date"])
+
+    # Assemble the file from the header and the cached bodies
+    with open(file_path + ".tmp", "wb") as file:
+        file.write(header)
+        for month in months:
+            with open(os.path.join(cache_directory, f"{month}.csv"),
+                      "rb") as chunk:
+                shutil.copyfileobj(chunk, file)
+    os.replace(file_path + ".tmp", file_path)
@@ -1,13 +1,17 @@
 import polars as pl
+import polars.selectors as cs
 from datetime import timedelta
-from .datetime_conversions import calculate_decimal_year
-from typing import Literal
+from .datetime_conversions import add_decimal_year
+from typing import Literal, TypeVar
 
+# Functions typed with FrameType work on eager DataFrames and on LazyFrames (lazy mode)
+FrameType = TypeVar("FrameType", pl.DataFrame, pl.LazyFrame)
 
-def join_slice(df: pl.DataFrame, df_slice: pl.DataFrame,
-               tolerance: str) -> pl.DataFrame:
+
+def join_slice(df: FrameType, df_slice: pl.DataFrame,
+               tolerance: str) -> FrameType:
     if len(df_slice) > 0:
-        return df.join_asof(df_slice,
+        return df.join_asof(df_slice.lazy() if isinstance(df, pl.LazyFrame) else df_slice,
                             on="datetime",
                             strategy="nearest",
                             tolerance=tolerance)
@@ -15,6 +19,21 @@ def join_slice(df: pl.DataFrame, df_slice: pl.DataFrame,
         return df
 
 
+def aggregate_1min(df: FrameType) -> FrameType:
+    return df.group_by_dynamic("datetime", every='1m', group_by=["system_id", "system_name"]) \
+            .agg(cs.numeric().mean())
+
+
+def aggregate_1h(df: FrameType) -> FrameType:
+    return df.sort("datetime") \
+            .group_by_dynamic("datetime", every='1h', group_by=["system_id", "system_name"]) \
+            .agg([
+                  cs.numeric().mean(),
+                  pl.col("gmp343_corrected").std().alias("gmp343_corrected_std"),
+                  pl.col("gmp343_corrected").var().alias("gmp343_corrected_var")
+              ])
+
+
 def concat_dataframe(
     df1: pl.DataFrame, df2: pl.DataFrame,
     how: Literal['vertical', 'vertical_relaxed', 'diagonal',
@@ -41,9 +60,7 @@ def convert_to_1min_icos_cp_format(df: pl.DataFrame) -> pl.DataFrame:
                 (pl.col("datetime").dt.minute()).alias("Minute"),
                 (pl.col("datetime").dt.second()).alias("Second"),
                 (pl.col('datetime').dt.to_string("%Y-%m-%d %H:%M:%S")).alias("#Datetime")) \
-            .with_columns(pl.struct(['datetime']) \
-            .map_elements(lambda x: calculate_decimal_year(x['datetime']), return_dtype=pl.Float64) \
-            .alias("DecimalDate")) \
+            .pipe(add_decimal_year, "datetime") \
             .select(["#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second", "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws", "wd", "Flag"]) \
             .with_columns(pl.exclude(pl.Utf8).cast(str)) \
             .fill_null('')
@@ -67,9 +84,7 @@ def convert_to_1h_icos_cp_format(df: pl.DataFrame) -> pl.DataFrame:
             (pl.col("creation_timestamp").dt.minute()).alias("Minute"),
             (pl.col("creation_timestamp").dt.second()).alias("Second"),
             (pl.col('creation_timestamp').dt.to_string("%Y-%m-%d %H:%M:%S")).alias("#Datetime")) \
-        .with_columns(pl.struct(['creation_timestamp']) \
-        .map_elements(lambda x: calculate_decimal_year(x['creation_timestamp']), return_dtype=pl.Float64) \
-        .alias("DecimalDate")) \
+        .pipe(add_decimal_year, "creation_timestamp") \
         .select(["#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second", "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws", "wd", "NbPoints", "Stdev", "Flag"]) \
         .with_columns(pl.exclude(pl.Utf8).cast(str)) \
         .fill_null('')
\ No newline at end of file
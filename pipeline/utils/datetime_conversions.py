@@ -1,3 +1,4 @@
+import polars as pl
 from datetime import datetime, timezone
 
 
@@ -12,3 +13,43 @@ def calculate_decimal_year(date) -> float:
 
     x = ((today / seconds_total_year) + year)
     return float("{:.6f}".format(x))
+
+
+
+def _divide_by_million(n: pl.Expr) -> pl.Expr:
+    # Correctly rounded n / 10^6 for non-negative integers n (as Python's int / int).
+    # Polars multiplies by the reciprocal when dividing by a scalar, which is
+    # not correctly rounded, so the exact decimal representation is parsed instead.
+    return ((n // 10**6).cast(pl.Utf8) + "." +
+            (n % 10**6).cast(pl.Utf8).str.zfill(6)).cast(pl.Float64)
+
+
+
+def add_decimal_year(df: pl.DataFrame,
+                     column: str,
+                     alias: str = "DecimalDate") -> pl.DataFrame:
+    """
+    Vectorized calculate_decimal_year of a UTC datetime column. The result is
+    identical to calculate_decimal_year for every timestamp, including the length
+    of the previous year as denominator and the "{:.6f}" rounding.
+
+    The rounding is replicated exactly: the fraction x - year of a double x in
+    [1024, 4096) is a multiple of 2^-42, so x * 10^6 equals the integer
+    (fraction * 2^42) * 15625 divided by 2^36, which is rounded half to even.
+    Intermediate results are stored in temporary columns, as nested expressions
+    reusing them would be evaluated repeatedly.
+    """
+    year = pl.col("__year")
+    previous_year = year - 1
+    seconds_total_year = pl.when((previous_year % 4 == 0) & (
+        (previous_year % 100 != 0) | (previous_year % 400 == 0))) \
+        .then(366 * 86400).otherwise(365 * 86400)
+    x = (pl.col("__today") / seconds_total_year) + year
+
+    return df.with_columns(
+            pl.col(column).dt.year().cast(pl.Int64).alias("__year"),
+            _divide_by_million((pl.col(column) - pl.col(column).dt.truncate("1y")).dt.total_microseconds()).alias("__today")) \
+        .with_columns((((x - year) * 2**42).cast(pl.Int64) * 15625).alias("__scaled")) \
+        .with_columns(_divide_by_million(year * 10**6 + (
+            (pl.col("__scaled") + (2**35 - 1) + ((pl.col("__scaled") // 2**36) % 2)) // 2**36)).alias(alias)) \
+        .drop("__year", "__today", "__scaled")
@@ -0,0 +1,295 @@
+import polars as pl
+import os
+import gc
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from .import_data import import_acropolis_system_data
+from .write_parquet import write_split_years, parquet_options
+from .metrics import measure
+from .hampel_filter import hampel_flags, hampel_sweep, parse_duration
+from .postprocessing import merge_with_existing
+from .watermarks import load_watermark, save_watermark
+from .stage_fingerprints import fingerprint_values, despiking_inputs, despiking_settings
+
+DESPIKED_PREFIX = "flagged_L1_1_min"
+
+
+def despiking_columns(config: dict) -> list[str]:
+    """Columns of the postprocessed 1min data passed on to the despiked output."""
+    selected_columns = [
+        "datetime", "system_id", "system_name", "gmp343_corrected", "gmp343_edge_corrected",
+        "gmp343_temperature", "sht45_humidity", "h2o_v%", "bme280_pressure",
+        "enclosure_bme280_pressure", "wxt532_speed_avg", "wxt532_direction_avg", "gmp343_dry", "slope", "intercept",
+        "gmp343_edge_dry", "cal_gmp343_slope", "cal_gmp343_intercept"
+    ]
+
+    if config["despiking"]["add_1P_correction"]:
+        selected_columns += ["gmp343_corrected_one_point_low", "gmp343_corrected_one_point_high", "offset_low", "offset_high", "bottle_median_high", "bottle_median_low"]
+
+    return selected_columns
+
+
+def select_despiking_input(df: pl.LazyFrame, config: dict) -> pl.LazyFrame:
+    """Select the columns of interest and valid rows of the postprocessed 1min data."""
+    return df.select(despiking_columns(config)) \
+        .filter(pl.col("gmp343_corrected") > 0)
+
+
+def flag_spikes(df: pl.LazyFrame, config: dict) -> pl.DataFrame:
+    """
+    Apply the Hampel filter (per system_id) to the despiking input.
+    Creates column "Flag" = 'H' indicating local contamination.
+    """
+    return df.pipe(hampel_flags,
+                   column="gmp343_corrected",
+                   window=config["despiking"]["window_size"],
+                   n_sigma=config["despiking"]["n_sigma"]) \
+        .with_columns(pl.col("gmp343_corrected").round(2)) \
+        .collect()
+
+
+def first_changed_datetime(df_input: pl.LazyFrame, df_flagged: pl.LazyFrame,
+                           start: datetime) -> Optional[datetime]:
+    """
+    First timestamp >= start at which the despiking input (selected and filtered
+    postprocessed data) differs from the existing despiked output, i.e. a row was
+    added, removed or changed. Returns None if both are identical from start on.
+    """
+    df_input = df_input.filter(pl.col("datetime") >= start) \
+        .with_columns(pl.col("gmp343_corrected").round(2))
+    columns = df_input.collect_schema().names()
+    df_flagged = df_flagged.filter(pl.col("datetime") >= start) \
+        .select(columns)
+
+    return pl.concat([
+        df_input.join(df_flagged, on=columns, how="anti", join_nulls=True),
+        df_flagged.join(df_input, on=columns, how="anti", join_nulls=True)
+    ]).select(pl.col("datetime").min()).collect().item()
+
+
+def incremental_span(
+        flagged_datetimes: pl.Series, first_change: datetime,
+        window: Union[int, str]) -> Optional[tuple[datetime, datetime]]:
+    """
+    Rows to recompute after the despiking input changed from first_change on.
+
+    Returns (context_start, affected_start): the flags of all rows from
+    affected_start on depend on changed rows, computing them on the input from
+    context_start on gives the same result as a full run. flagged_datetimes are
+    the (sorted) timestamps of the existing despiked output. Returns None if
+    nothing before first_change exists, i.e. the system needs a full run.
+    """
+    before = flagged_datetimes.filter(flagged_datetimes < first_change)
+    if len(before) == 0:
+        return None
+
+    if isinstance(window, int):
+        half_window = window // 2
+
+        def nth_last(n: int) -> datetime:
+            return first_change if n == 0 else before[max(len(before) - n, 0)]
+
+        # windows of the affected rows reach back 2 * half_window rows
+        return nth_last(2 * half_window), nth_last(half_window)
+
+    half_duration = parse_duration(window) / 2
+    # keep the last row before the windows of the affected rows, so they are
+    # not treated as the first half window of the system (never flagged)
+    earlier = before.filter(before < first_change - 2 * half_duration)
+    context_start = earlier[-1] if len(earlier) > 0 else before[0]
+    return context_start, first_change - half_duration
+
+
+def despike_systems(ids: list[int],
+                    config: dict,
+                    input_directory: str,
+                    output_directory: str,
+                    incremental: bool = False,
+                    hive_partitioning: bool = False) -> None:
+    """
+    Flag spikes in the postprocessed 1min data of several systems with a Hampel
+    filter (one query partitioned by system_id) and write the flagged L1 output
+    of each system.
+
+    config["despiking"]["window_size"] is either a number of samples (e.g. 120,
+    flags identical to the hampel package) or a duration (e.g. "120m").
+
+    After each run, a watermark (last timestamp and fingerprint of the
+    postprocessed files and settings, see stage_fingerprints) is stored per
+    system. In incremental mode, systems with unchanged input are skipped and
+    systems with changed settings are despiked completely. Otherwise the input from the watermark minus
+    config["despiking"]["incremental_lookback_days"] (default: the value of
+    "postprocessing") is compared with the existing output, only the flags
+    depending on changed rows are recomputed and merged into the existing output.
+    """
+    logging.info(f"Processing systems with ids: {ids}")
+    years = config["despiking"]["input_years"]
+    window = config["despiking"]["window_size"]
+    selected_columns = despiking_columns(config)
+
+    def import_input(id: int,
+                     start: Optional[datetime] = None) -> pl.LazyFrame:
+        # Select columns of interest from postprocessed df
+        df = import_acropolis_system_data(years=years,
+                                          target_directory=input_directory,
+                                          id=id,
+                                          prefix="1min",
+                                          hive_partitioning=hive_partitioning,
+                                          start=start) \
+            .pipe(select_despiking_input, config)
+        if start is not None:
+            df = df.filter(pl.col("datetime") >= start)
+        return df
+
+    df_inputs = []
+    fingerprints = {}
+    cutoffs = {}
+
+    settings = fingerprint_values(*despiking_settings(config))
+
+    for id in ids:
+        fingerprints[id] = despiking_inputs(config, id, input_directory,
+                                            hive_partitioning)
+
+        span = None
+        watermark = load_watermark(output_directory, id, prefix=DESPIKED_PREFIX) \
+            if incremental else None
+        if watermark is not None and watermark["fingerprint"] == fingerprints[id]:
+            logging.info(f"System {id}: input unchanged, skipping")
+            continue
+        if watermark is not None and watermark.get("settings") != settings:
+            logging.info(
+                f"System {id}: settings changed, falling back to full run")
+        elif watermark is not None:
+            lookback = timedelta(days=config["despiking"].get(
+                "incremental_lookback_days",
+                config["postprocessing"].get("incremental_lookback_days", 3)))
+            compare_start = watermark["datetime"] - lookback
+            df_flagged = import_acropolis_system_data(
+                years=years,
+                target_directory=output_directory,
+                id=id,
+                prefix=DESPIKED_PREFIX,
+                hive_partitioning=hive_partitioning)
+
+            if not set(selected_columns) <= set(
+                    df_flagged.collect_schema().names()):
+                logging.info(
+                    f"System {id}: despiked output has other columns, falling back to full run"
+                )
+            else:
+                first_change = first_changed_datetime(
+                    import_input(id, start=compare_start), df_flagged,
+                    compare_start)
+                if first_change is None:
+                    logging.info(f"System {id}: despiking input unchanged")
+                    save_watermark(output_directory,
+                                   id,
+                                   prefix=DESPIKED_PREFIX,
+                                   last_datetime=watermark["datetime"],
+                                   fingerprint=fingerprints[id],
+                                   settings=settings)
+                    continue
+
+                span = incremental_span(
+                    df_flagged.select("datetime").collect()["datetime"],
+                    first_change, window)
+                if span is None:
+                    logging.info(
+                        f"System {id}: changes within the first window, falling back to full run"
+                    )
+
+        if span is None:
+            df_inputs.append(import_input(id))
+        else:
+            context_start, cutoffs[id] = span
+            logging.info(
+                f"System {id}: incremental run, recomputing flags from {cutoffs[id]}"
+            )
+            df_inputs.append(import_input(id, start=context_start))
+
+    if len(df_inputs) == 0:
+        return
+
+    # Apply the Hampel filter
+    with measure("import_hampel_flags", system_ids=ids) as m:
+        df = flag_spikes(pl.concat(df_inputs, how="diagonal_relaxed"), config)
+        m["rows_out"] = len(df)
+
+    for (system_id, ), df_system in df.partition_by("system_id",
+                                             maintain_order=True,
+                                             as_dict=True).items():
+        # Print share of detected spikes
+        logging.info(
+            f"System ID: {system_id}, Detected spikes: {(df_system['hampel_outlier'].sum() / len(df_system)):.4f}"
+        )
+        df_system = df_system.drop("hampel_outlier")
+
+        if system_id in cutoffs:
+            df_system = merge_with_existing(
+                df_system,
+                years=years,
+                target_directory=output_directory,
+                id=system_id,  # type: ignore
+                prefix=DESPIKED_PREFIX,
+                cutoff=cutoffs[system_id],  # type: ignore
+                hive_partitioning=hive_partitioning)
+
+        # Save data
+        logging.info(
+            f"Writing 1min despiked data to parquet. Length: {len(df_system)}")
+        write_split_years(df=df_system,
+                          id=system_id,  # type: ignore
+                          target_directory=output_directory,
+                          prefix=DESPIKED_PREFIX,
+                          hive_partitioning=hive_partitioning,
+                          options=parquet_options(config),
+                          since=cutoffs.get(system_id))  # type: ignore
+
+        save_watermark(output_directory,
+                       system_id,  # type: ignore
+                       prefix=DESPIKED_PREFIX,
+                       last_datetime=df_system["datetime"].max(),  # type: ignore
+                       fingerprint=fingerprints[system_id],  # type: ignore
+                       settings=settings)
+
+    # Clear memory
+    del df
+    gc.collect()  # Explicitly run garbage collection
+
+
+def sweep_systems(ids: list[int],
+                  config: dict,
+                  input_directory: str,
+                  output_directory: str,
+                  hive_partitioning: bool = False) -> None:
+    """
+    Evaluate the Hampel filter for all combinations of
+    config["despiking"]["sweep"]["window_sizes"] and ["n_sigmas"] and write the
+    spike rates per system and setting to hampel_sweep.csv. The despiked output
+    is not changed.
+    """
+    logging.info(f"Sweeping Hampel parameters for systems with ids: {ids}")
+    sweep = config["despiking"]["sweep"]
+
+    # Import the input of all systems once, shared by all settings
+    df = pl.concat([
+        import_acropolis_system_data(years=config["despiking"]["input_years"],
+                                     target_directory=input_directory,
+                                     id=id,
+                                     prefix="1min",
+                                     hive_partitioning=hive_partitioning)
+        .select("datetime", "system_id", "gmp343_corrected")
+        .filter(pl.col("gmp343_corrected") > 0) for id in ids
+    ]).collect()
+
+    df_rates = hampel_sweep(df.lazy(),
+                            column="gmp343_corrected",
+                            windows=sweep["window_sizes"],
+                            n_sigmas=sweep["n_sigmas"])
+
+    path = os.path.join(output_directory, "hampel_sweep.csv")
+    logging.info(f"Writing spike rates of {len(df_rates)} settings to {path}")
+    df_rates.write_csv(path)
@@ -1,13 +1,13 @@
 import polars as pl
 
 from . import ambient_parameter_conversion as apc
+from .dataframe_operations import FrameType
 
 
-def wet_to_dry_mole_fraction(df_wet: pl.DataFrame) -> pl.DataFrame:
+def wet_to_dry_mole_fraction(df_wet: FrameType) -> FrameType:
     # perform dry conversion for measurement data
-    return df_wet.with_columns(pl.struct(['gmp343_temperature','sht45_humidity','bme280_pressure'])
-        .map_elements(lambda x: (apc.rh_to_mole_fraction(x['sht45_humidity'],apc.absolute_temperature(x['gmp343_temperature']),x['bme280_pressure']*100))*100, return_dtype=pl.Float64) \
-        .alias("h2o_v%")) \
-        .with_columns(pl.struct(['gmp343_filtered','gmp343_temperature','sht45_humidity','bme280_pressure']) \
-         .map_elements(lambda x: apc.calculate_co2dry(x['gmp343_filtered'],x['gmp343_temperature'],x['sht45_humidity'],x['bme280_pressure']*100), return_dtype=pl.Float64)
+    return df_wet.with_columns(
+        (apc.rh_to_mole_fraction_expr(pl.col('sht45_humidity'), apc.absolute_temperature_expr(pl.col('gmp343_temperature')), pl.col('bme280_pressure') * 100) * 100) \
+        .alias("h2o_v%"),
+        apc.calculate_co2dry_expr(pl.col('gmp343_filtered'), pl.col('gmp343_temperature'), pl.col('sht45_humidity'), pl.col('bme280_pressure') * 100) \
         .alias("gmp343_dry"))
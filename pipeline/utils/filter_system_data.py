@@ -1,45 +1,28 @@
 import polars as pl
-from .paths import AVERAGED_GASES
+from .context import get_context
+from .dataframe_operations import aggregate_1min
 
-# load calibration bottle info (preprocessed)
-df_gas = pl.read_csv(AVERAGED_GASES).with_columns(
-    pl.col("cal_bottle_id").cast(pl.Float32),
-    pl.col("cal_bottle_CO2").cast(pl.Float64))
 
-
-def extract_wind_data(df_raw: pl.LazyFrame) -> pl.DataFrame:
+def extract_wind_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     #extract wind data from df_raw
-    try:
-        return df_raw.select(pl.col("datetime", "system_id", "^(wxt532_.*)$")) \
-            .collect() \
-            .filter(pl.col('wxt532_direction_avg') > 0) \
-            .sort("datetime")
-    except Exception:
-        return pl.DataFrame()
+    return df_raw.select(pl.col("datetime", "system_id", "^(wxt532_.*)$")) \
+        .filter(pl.col('wxt532_direction_avg') > 0) \
+        .sort("datetime")
 
 
-def extraxt_auxilliary_data(df_raw: pl.LazyFrame) -> pl.DataFrame:
+def extract_auxilliary_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     #extract auxilliary data from df_raw
-    try:
-        return df_raw.select(pl.col("datetime", "system_id", "^(enclosure_.*)$", "^(raspi_.*)$", "^ups_.*$")) \
-        .collect() \
+    return df_raw.select(pl.col("datetime", "system_id", "^(enclosure_.*)$", "^(raspi_.*)$", "^ups_.*$")) \
         .filter(pl.col('enclosure_bme280_temperature') > 0) \
         .sort("datetime")
-    except Exception:
-        return pl.DataFrame()
 
 
-def extract_edge_calibration_data(df_raw: pl.LazyFrame) -> pl.DataFrame:
+def extract_edge_calibration_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     #extract edge calibration data from df_raw
-    try:
-        return df_raw.select(pl.col("datetime", "system_id", "cal_gmp343_slope", "cal_gmp343_intercept", "cal_sht_45_offset")) \
-        .collect() \
+    return df_raw.select(pl.col("datetime", "system_id", "cal_gmp343_slope", "cal_gmp343_intercept", "cal_sht_45_offset")) \
         .filter(pl.col('cal_gmp343_slope') > 0) \
         .sort("datetime")
 
-    except Exception:
-        return pl.DataFrame()
-
 
 def extract_measurement_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     #extract measurement data from df_raw
@@ -51,18 +34,87 @@ def extract_measurement_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     .filter(pl.col('bme280_pressure') > 850.0)
 
 
-def extract_calibration_data(df_raw: pl.LazyFrame) -> pl.DataFrame:
+def extract_calibration_data(df_raw: pl.LazyFrame) -> pl.LazyFrame:
     #extract calibration data from df_raw
     return df_raw.select("datetime","system_id", '^cal_.*$') \
-    .collect() \
     .filter(pl.col("cal_bottle_id") > 0.0) \
-    .filter(pl.col("cal_bottle_id") <= df_gas["cal_bottle_id"].max()) \
+    .filter(pl.col("cal_bottle_id") <= get_context().df_gas["cal_bottle_id"].max()) \
     .filter(pl.col("cal_gmp343_filtered") > 0.0) \
     .filter(pl.col("cal_gmp343_temperature") > 0.0) \
     .filter(pl.col("cal_sht45_humidity") >= 0.0) \
     .filter(pl.col("cal_bme280_pressure") > 0.0)
 
 
-def extract_years(df: pl.DataFrame) -> list[int]:
-    #extract years from df_raw
-    return df["datetime"].dt.year().unique().to_list()
+def _enrichment_queries(df_raw: pl.LazyFrame) -> dict[str, pl.LazyFrame]:
+    # calibration, wind, auxilliary and edge calibration queries on the raw data,
+    # the optional queries only if the system has their columns
+    columns = df_raw.collect_schema().names()
+
+    queries = {"calibration": extract_calibration_data(df_raw)}
+
+    if "wxt532_direction_avg" in columns:
+        queries["wind"] = extract_wind_data(df_raw)
+
+    if "enclosure_bme280_temperature" in columns:
+        queries["aux"] = extract_auxilliary_data(df_raw)
+
+    if all(col in columns for col in
+           ["cal_gmp343_slope", "cal_gmp343_intercept", "cal_sht_45_offset"]):
+        queries["edge_calibration"] = extract_edge_calibration_data(df_raw)
+
+    return queries
+
+
+def _collect_queries(queries: dict[str, pl.LazyFrame]) -> dict[str, pl.DataFrame]:
+    # Filters are evaluated on the shared scan instead of inside the parquet reader:
+    # the prefiltered parquet reader returns corrupted values for sparse columns
+    # (e.g. cal_gmp343_intercept) when the predicate is very selective.
+    return dict(
+        zip(queries.keys(),
+            pl.collect_all(list(queries.values()), predicate_pushdown=False)))
+
+
+def extract_system_data(
+    df_raw: pl.LazyFrame
+) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame,
+           pl.DataFrame]:
+    """
+    Build all outputs of the raw system data in a single pass.
+    The five queries share the raw scan, which is read and decoded only once
+    by collect_all (common subplan elimination). Filters are applied before
+    the data is materialised.
+
+    Returns:
+        (1 minute aggregated measurement data, wind data, auxilliary data,
+        edge calibration data, calibration data). Wind, auxilliary and edge
+        calibration data are empty DataFrames if the system has no such columns.
+    """
+    queries = {
+        "measurement": extract_measurement_data(df_raw).pipe(aggregate_1min),
+        **_enrichment_queries(df_raw)
+    }
+    results = _collect_queries(queries)
+
+    return (results["measurement"], results.get("wind", pl.DataFrame()),
+            results.get("aux", pl.DataFrame()),
+            results.get("edge_calibration", pl.DataFrame()),
+            results["calibration"])
+
+
+def extract_enrichment_data(
+    df_raw: pl.LazyFrame
+) -> tuple[pl.DataFrame, pl.DataFrame, pl.DataFrame, pl.DataFrame]:
+    """
+    Same as extract_system_data without the measurement data, which is left to
+    the caller (e.g. to be processed as one lazy query).
+
+    Returns:
+        (wind data, auxilliary data, edge calibration data, calibration data)
+    """
+    results = _collect_queries(_enrichment_queries(df_raw))
+
+    return (results.get("wind", pl.DataFrame()),
+            results.get("aux", pl.DataFrame()),
+            results.get("edge_calibration", pl.DataFrame()),
+            results["calibration"])
+
@@ -0,0 +1,255 @@
+import polars as pl
+import gc
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable
+
+from .import_data import import_acropolis_system_data
+from .filter_system_data import extract_system_data
+from .calibration_processing import calculate_calibration_parameters
+from .dataframe_operations import aggregate_1h
+from .postprocessing import calibrate_measurement_data
+from .despiking import select_despiking_input, flag_spikes, DESPIKED_PREFIX
+from .site_export import export_site_L1_1min_csv
+from .write_parquet import write_split_years, parquet_options
+from .watermarks import save_watermark
+from .stage_fingerprints import (fingerprint_values, postprocessing_inputs,
+                                 postprocessing_settings, despiking_inputs,
+                                 despiking_settings)
+from .metrics import measure
+
+
+class BackgroundWriter:
+    """
+    Run write functions in submission order on a background thread, while the
+    calling thread continues with the next system (Polars and pyarrow release
+    the GIL while encoding and writing).
+
+    At most max_pending writes are queued, each holds a reference to its data.
+    close() waits for all writes, errors of writes are raised by submit or close.
+    """
+
+    def __init__(self, max_pending: int = 4) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=1,
+                                           thread_name_prefix="writer")
+        self.max_pending = max_pending
+        self.futures: list[Future] = []
+
+    def submit(self, function: Callable[..., None], **kwargs: Any) -> None:
+        self.futures.append(self.executor.submit(function, **kwargs))
+
+        # raise errors early and wait if too many writes are queued
+        while len(self.futures) > 0 and (self.futures[0].done() or len(
+                self.futures) > self.max_pending):
+            self.futures.pop(0).result()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+
+def save_despiked_watermark(output_directory: str, input_directory: str,
+                            id: int, config: dict, hive_partitioning: bool,
+                            last_datetime: datetime) -> None:
+    # the fingerprint of the postprocessed files is only known once they are written
+    save_watermark(output_directory,
+                   id,
+                   prefix=DESPIKED_PREFIX,
+                   last_datetime=last_datetime,
+                   fingerprint=despiking_inputs(config, id, input_directory,
+                                                hive_partitioning),
+                   settings=fingerprint_values(*despiking_settings(config)))
+
+
+def postprocess_system_in_memory(id: int, config: dict, input_directory: str,
+                                 output_directory: str,
+                                 hive_partitioning: bool,
+                                 writer: BackgroundWriter) -> pl.DataFrame:
+    """
+    Full run of postprocess_system that hands the outputs to writer and
+    returns the 1min data.
+    """
+    logging.info(f"Processing system with id: {id}")
+    years = config["postprocessing"]["input_years"]
+    options = parquet_options(config)
+
+    fingerprint = postprocessing_inputs(config, id, input_directory)
+
+    df_raw = import_acropolis_system_data(years=years,
+                                          target_directory=input_directory,
+                                          id=id)
+
+    with measure("import_extract", system_id=id) as m:
+        df, df_wind, df_aux, df_edge_cal, df_calibration = extract_system_data(
+            df_raw)
+        m["rows_out"] = len(df)
+
+    with measure("calibration_parameters",
+                 rows_in=len(df_calibration),
+                 system_id=id) as m:
+        df_calibration_parameters = calculate_calibration_parameters(
+            df_calibration)
+        m["rows_out"] = len(df_calibration_parameters)
+
+    writer.submit(write_split_years,
+                  df=df_calibration,
+                  id=id,
+                  target_directory=output_directory,
+                  prefix="Cal_1min",
+                  hive_partitioning=hive_partitioning,
+                  options=options)
+
+    df = calibrate_measurement_data(df, df_wind, df_aux, df_edge_cal,
+                                    df_calibration_parameters, id,
+                                    config["postprocessing"]["add_1P_correction"])
+
+    logging.info(f"Writing 1m data to parquet. Length: {len(df)}")
+    writer.submit(write_split_years,
+                  df=df,
+                  id=id,
+                  target_directory=output_directory,
+                  prefix="1min",
+                  hive_partitioning=hive_partitioning,
+                  options=options)
+
+    with measure("aggregate_1h", rows_in=len(df), system_id=id) as m:
+        df_1h = aggregate_1h(df)
+        m["rows_out"] = len(df_1h)
+
+    logging.info(f"Writing 1h data to parquet. Length: {len(df_1h)}")
+    writer.submit(write_split_years,
+                  df=df_1h,
+                  id=id,
+                  target_directory=output_directory,
+                  prefix="1h",
+                  hive_partitioning=hive_partitioning,
+                  options=options)
+
+    writer.submit(save_watermark,
+                  target_directory=output_directory,
+                  id=id,
+                  prefix="1min",
+                  last_datetime=df["datetime"].max(),
+                  fingerprint=fingerprint,
+                  settings=fingerprint_values(*postprocessing_settings(config)))
+
+    return df
+
+
+def run_fused(config: dict,
+              sites_meta: pl.DataFrame,
+              deployment_times: dict,
+              input_directory: str,
+              postprocessed_directory: str,
+              despiked_directory: str,
+              hive_partitioning: bool = False) -> None:
+    """
+    Complete rebuild of stages 01-03 in a single pass: the 1min data of each
+    system is despiked in memory and the despiked data is kept until all sites
+    the system is deployed at are exported to CSV. The postprocessed and
+    despiked parquet files (and watermarks) are written on a background thread,
+    the outputs are identical to running the stages one after another.
+
+    Sensors of a site that are not despiked in this run (not in
+    config["despiking"]["system_ids"]) are read from their despiked files.
+    Systems are processed one at a time, the memory use grows with the number
+    of despiked systems whose sites are not complete yet.
+    """
+    postprocessing_ids = config["postprocessing"]["system_ids"]
+    despiking_ids = config["despiking"]["system_ids"]
+    despiking_years = config["despiking"]["input_years"]
+
+    # despiked systems each site is still waiting for
+    pending_sensors = {
+        site: {sensor["id"]
+               for sensor in deployment_times[site]["sensors"]}
+        & set(despiking_ids)
+        for site in config["icos_cities_portal"]["site_names"]
+    }
+    frames: dict[int, pl.DataFrame] = {}
+
+    def export_complete_sites() -> None:
+        for site in [
+                site for site, ids in pending_sensors.items()
+                if ids <= frames.keys()
+        ]:
+            export_site_L1_1min_csv(site=site,
+                                    sites_meta=sites_meta,
+                                    deployment_times=deployment_times,
+                                    input_directory=despiked_directory,
+                                    hive_partitioning=hive_partitioning,
+                                    use_cache=config["icos_cities_portal"].get(
+                                        "csv_cache", False),
+                                    frames=frames)
+            del pending_sensors[site]
+
+        # release the data of systems no remaining site is waiting for
+        needed = set().union(*pending_sensors.values())
+        for id in [id for id in frames if id not in needed]:
+            del frames[id]
+        gc.collect()  # Explicitly run garbage collection
+
+    writer = BackgroundWriter()
+    try:
+        for id in postprocessing_ids + [
+                id for id in despiking_ids if id not in postprocessing_ids
+        ]:
+            if id in postprocessing_ids:
+                df_input = postprocess_system_in_memory(
+                    id=id,
+                    config=config,
+                    input_directory=input_directory,
+                    output_directory=postprocessed_directory,
+                    hive_partitioning=hive_partitioning,
+                    writer=writer).lazy() \
+                    .filter(pl.col("datetime").dt.year().is_in(despiking_years)) \
+                    .with_columns(system_id=pl.lit(id))
+            else:
+                df_input = import_acropolis_system_data(
+                    years=despiking_years,
+                    target_directory=postprocessed_directory,
+                    id=id,
+                    prefix="1min",
+                    hive_partitioning=hive_partitioning)
+
+            if id not in despiking_ids:
+                continue
+
+            with measure("hampel_flags", system_id=id) as m:
+                df = flag_spikes(select_despiking_input(df_input, config),
+                                 config)
+                m["rows_out"] = len(df)
+
+            logging.info(
+                f"System ID: {id}, Detected spikes: {(df['hampel_outlier'].sum() / max(len(df), 1)):.4f}"
+            )
+            df = df.drop("hampel_outlier")
+
+            logging.info(
+                f"Writing 1min despiked data to parquet. Length: {len(df)}")
+            writer.submit(write_split_years,
+                          df=df,
+                          id=id,
+                          target_directory=despiked_directory,
+                          prefix=DESPIKED_PREFIX,
+                          hive_partitioning=hive_partitioning,
+                          options=parquet_options(config))
+            writer.submit(save_despiked_watermark,
+                          output_directory=despiked_directory,
+                          input_directory=postprocessed_directory,
+                          id=id,
+                          config=config,
+                          hive_partitioning=hive_partitioning,
+                          last_datetime=df["datetime"].max())
+
+            frames[id] = df
+            del df_input, df
+            export_complete_sites()
+
+        # remaining sites, e.g. if no system was despiked
+        export_complete_sites()
+    finally:
+        writer.close()
@@ -0,0 +1,164 @@
+import re
+import polars as pl
+from datetime import timedelta
+from typing import Union
+
+# Scale factor from the median absolute deviation to the standard deviation (normal distribution)
+MAD_SCALE = 1.4826
+
+DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_duration(duration: str) -> timedelta:
+    """Parse a Polars style duration string (e.g. "120m", "1h30m") with the units s, m, h and d."""
+    parts = re.findall(r"(\d+)([smhd])", duration)
+    if len(parts) == 0 or "".join(f"{n}{unit}"
+                                  for n, unit in parts) != duration:
+        raise ValueError(
+            f"Invalid window '{duration}', expected e.g. '120m' or '2h'")
+
+    return sum((timedelta(**{DURATION_UNITS[unit]: int(n)})
+                for n, unit in parts), timedelta())
+
+
+def rolling_median_mad(df: pl.LazyFrame,
+                       column: str,
+                       window: Union[int, str],
+                       group_by: str = "system_id",
+                       index_column: str = "datetime") -> pl.LazyFrame:
+    """
+    Add the median ("hampel_median") and the median absolute deviation
+    ("hampel_mad") of column in a centered rolling window per group (Float32).
+
+    window as int: window of 2 * (window // 2) + 1 samples, as in the hampel
+        package. Rows within window // 2 samples of the first/last row of a
+        group get nulls.
+    window as str: time window of [t - window / 2, t + window / 2] (e.g. "120m"),
+        data gaps don't widen the window. Rows within window / 2 of the first/last
+        timestamp of a group get nulls.
+
+    The result is sorted by group_by and index_column, which must be unique within a group.
+    """
+    x = pl.col(column).cast(pl.Float32)
+    df = df.sort(group_by, index_column)
+
+    if isinstance(window, int):
+        half_window = window // 2
+        rolling_index = "__sample"
+        df = df.with_columns(
+            pl.int_range(pl.len(), dtype=pl.Int64).over(group_by).alias(rolling_index))
+        period: Union[str, timedelta] = f"{2 * half_window + 1}i"
+        offset: Union[str, timedelta] = f"{-half_window - 1}i"
+        closed = "right"
+        position = pl.col(rolling_index)
+        complete = (position >= half_window) & (
+            position < pl.len().over(group_by) - half_window)
+    else:
+        half_duration = parse_duration(window) / 2
+        rolling_index = index_column
+        period = 2 * half_duration
+        offset = -half_duration
+        closed = "both"
+        position = pl.col(index_column)
+        complete = (position - position.min().over(group_by) >= half_duration) & (
+            position.max().over(group_by) - position >= half_duration)
+
+    df_stats = df.rolling(index_column=rolling_index,
+                          period=period,
+                          offset=offset,
+                          closed=closed,  # type: ignore
+                          group_by=group_by) \
+        .agg(x.median().alias("hampel_median"),
+             (x - x.median()).abs().median().alias("hampel_mad"))
+
+    # No statistics for incomplete windows at the edges (never flagged)
+    return df.join(df_stats, on=[group_by, rolling_index], how="left") \
+        .with_columns(
+            pl.when(complete).then(pl.col("hampel_median", "hampel_mad")).cast(pl.Float32)) \
+        .drop("__sample", strict=False)
+
+
+def hampel_outliers(column: str, n_sigma: float) -> pl.Expr:
+    """
+    Outliers of column given the "hampel_median" and "hampel_mad" columns:
+    |x - median| > n_sigma * MAD_SCALE * mad, evaluated in single precision
+    like the hampel package. Null where the window is incomplete.
+    """
+    threshold = (pl.lit(n_sigma, dtype=pl.Float32).cast(pl.Float64) *
+                 MAD_SCALE * pl.col("hampel_mad").cast(pl.Float64)).cast(
+                     pl.Float32)
+    return (pl.col(column).cast(pl.Float32) -
+            pl.col("hampel_median")).abs() > threshold
+
+
+def hampel_flag(column: str, outliers: pl.Expr) -> pl.Expr:
+    """
+    'H' where the Hampel filtered value (window median for outliers, single
+    precision like the hampel package) differs from column at 2 decimals, 'U' otherwise.
+    """
+    filtered = pl.when(outliers).then(pl.col("hampel_median")).otherwise(
+        pl.col(column).cast(pl.Float32)).cast(pl.Float64)
+    return pl.when(pl.col(column).round(2).ne(filtered.round(2))) \
+        .then(pl.lit('H')).otherwise(pl.lit('U'))
+
+
+def hampel_flags(df: pl.LazyFrame,
+                 column: str,
+                 window: Union[int, str],
+                 n_sigma: float,
+                 group_by: str = "system_id",
+                 index_column: str = "datetime") -> pl.LazyFrame:
+    """
+    Flag spikes in column with a rolling Hampel filter per group (see rolling_median_mad).
+
+    Adds "hampel_outlier" and the column "Flag" (see hampel_flag). With a sample
+    window, the flags are identical to the filtered data of the hampel package.
+    """
+    return df.pipe(rolling_median_mad, column, window, group_by, index_column) \
+        .with_columns(hampel_outliers(column, n_sigma).fill_null(False).alias("hampel_outlier")) \
+        .with_columns(hampel_flag(column, pl.col("hampel_outlier")).alias("Flag")) \
+        .drop("hampel_median", "hampel_mad")
+
+
+def hampel_sweep(df: pl.LazyFrame,
+                 column: str,
+                 windows: list[Union[int, str]],
+                 n_sigmas: list[float],
+                 group_by: str = "system_id",
+                 index_column: str = "datetime") -> pl.DataFrame:
+    """
+    Spike rates per group for every combination of window and n_sigma.
+
+    The rolling median and MAD are computed once per window, all n_sigma
+    thresholds are evaluated against them. Returns one row per group, window
+    and n_sigma with the number of rows, outliers and 'H' flags.
+    """
+    results = []
+    for window in windows:
+        indicators = []
+        for i, n_sigma in enumerate(n_sigmas):
+            outliers = hampel_outliers(column, n_sigma).fill_null(False)
+            indicators += [
+                outliers.alias(f"outliers_{i}"),
+                hampel_flag(column, outliers).eq('H').alias(f"flagged_{i}")
+            ]
+
+        df_counts = df.pipe(rolling_median_mad, column, window, group_by, index_column) \
+            .select(group_by, *indicators) \
+            .group_by(group_by) \
+            .agg(pl.len().alias("rows"), pl.all().sum()) \
+            .collect()
+
+        for i, n_sigma in enumerate(n_sigmas):
+            results.append(
+                df_counts.select(
+                    group_by,
+                    pl.lit(str(window)).alias("window_size"),
+                    pl.lit(n_sigma, dtype=pl.Float64).alias("n_sigma"),
+                    "rows",
+                    pl.col(f"outliers_{i}").alias("outliers"),
+                    pl.col(f"flagged_{i}").alias("flagged")))
+
+    return pl.concat(results) \
+        .with_columns((pl.col("outliers") / pl.col("rows")).alias("spike_rate")) \
+        .sort(group_by, maintain_order=True)
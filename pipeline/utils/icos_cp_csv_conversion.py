@@ -1,266 +1,211 @@
+import io
 import os
-import csv
+from typing import IO, NamedTuple, Optional
 import polars as pl
-from .paths import ICOS_CITIES_LEVEL_1, ICOS_CITIES_LEVEL_2
+from . import paths
+
+# Header of the ICOS CP csv files, rendered once per file.
+# The comment lines and the columns (last header line) are product specific (see below).
+ICOS_CSV_HEADER_TEMPLATE = """\
+# TITLE: co2 - continuous time series from low and mid cost sensors
+# FILE NAME: {file_name}
+# DATA FORMAT: see the last line of this header for column description
+# TOTAL LINES: {file_lines}
+# HEADER LINES: {header_lines}
+# PROJECT: ICOS CITIES
+# DATA VERSION: {data_version}
+# STATION CODE: {site_short_name}
+# STATION NAME: {site_long_name} ({site_short_name})
+# OBSERVATION CATEGORY: Air sampling observation at a stationary platform
+# COUNTRY/TERRITORY: DE
+# RESPONSIBLE INSTITUTE: TUM, Technial University Munich
+# CONTRIBUTOR:  Patrick Aigner, Jia Chen, Klaus Kürzinger
+# CONTACT POINT: Patrick Aigner <patrick.aigner@tum.de>, Jia Chen <jia.chen@tum.de>
+# FUNDING: European Union's Horizon 2020 Research and Innovation Programme, Grant Agreement No. 101037319
+# LATITUDE: {latitude}
+# LONGITUDE: {longitude}
+# ALTITUDE: {altitude} m asl
+# SAMPLING HEIGHTS: {sampling_height} m agl
+# PARAMETER: co2
+# COVERING PERIOD: {start_date} - {stop_date}
+# TIME INTERVAL: {time_interval}
+# MEASUREMENT UNIT: µmol/mol
+# MEASUREMENT METHOD: NDIR
+# INSTRUMENT: Vaisala GMP343
+# SAMPLING TYPE: continuous
+# TIME ZONE: Central European Time (UTC+1), Central European Summer Time (UTC+2)
+# MEASUREMENT SCALE: WMO-CO2-X2019
+# DATA POLICY: ICOS CITIES DATA is licensed under a Creative Commons Attribution 4.0 international licence (http://creativecommons.org/licenses/by/4.0/.The ICOS CITIES data licence is described at https://data.icos-cities.eu/licence.
+# COMMENT:
+#
+#   - Times are UTC+0
+#   - Time-averaged values are reported at the middle of the averaging interval.
+{comment}
+#   - In case of gaps between instruments, the timeseries are filled with empty string
+#   - Release notes: 
+#
+"""
+
+L1_1MIN_COMMENT = [
+    "#   - co2: dry mole air fraction (µmol/mol)",
+    "#   - h20: absolute humidity in vol%",
+    "#   - pressure: ambient pressure of outdoor enclosure in hPa",
+    "#   - sensor_temperature: measurement chamber temperature in °C",
+    "#   - ws: wind speed in m/s",
+    "#   - wd: wind direction in degrees",
+    "#   - Flag 'U' = data correct before manual quality control",
+    "#   - Flag 'H' = Potentially locally contaminated by hampel filter (auto)",
+]
+
+L2_1MIN_COMMENT = L1_1MIN_COMMENT[:6] + [
+    "#   - Flag 'O' = data correct after manual quality control",
+    "#   - Flag 'H' = Potentially locally contaminated by hampel filter (auto)",
+    "#   - Flag 'C' = Potentially locally contaminated (manual quality control)",
+]
+
+L2_1H_COMMENT = [
+    "#   - co2: dry mole air fraction (µmol/mol)",
+    "#   - h20: absolute humdity in vol%",
+    "#   - pressure: ambient pressure of outdoor enclosure in hPa",
+    "#   - sensor_temperature: measurement chamber temperature in °C",
+    "#   - ws: wind speed in m/s",
+    "#   - wd: wind direction in degrees",
+    "#   - Flag 'O' = data correct after manual quality control",
+    "#   - Flag 'K' = data incorrect after manual quality control",
+]
+
+COLUMNS_1MIN = [
+    "#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second",
+    "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws", "wd",
+    "Flag"
+]
+
+COLUMNS_1H = COLUMNS_1MIN[:-1] + ["NbPoints", "Stdev", "Flag"]
+
+
+def _csv_field(value: str) -> str:
+    # quote a field like csv.writer (QUOTE_MINIMAL) with ';' as delimiter
+    if value == "" or any(char in value for char in ';"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _site_metadata(sites_meta: pl.DataFrame, site: str) -> dict:
+    df_site = sites_meta.filter(pl.col("site") == site[:4])
+    if len(df_site) != 1:
+        raise ValueError(
+            f"Expected one entry for site {site[:4]} in sites_meta, found {len(df_site)}")
+    return df_site.row(0, named=True)
+
+
+class IcosCsvProduct(NamedTuple):
+    name: str  # file name: <site>_munich_acropolis_<name>.csv
+    data_version: str
+    time_interval: str
+    comment: list[str]
+    columns: list[str]
+
+
+L1_1MIN = IcosCsvProduct("L1_1min", "L1", "1 minute", L1_1MIN_COMMENT, COLUMNS_1MIN)
+L2_1MIN = IcosCsvProduct("L2_1min", "L2", "1 minute", L2_1MIN_COMMENT, COLUMNS_1MIN)
+L2_1H = IcosCsvProduct("L2_1h", "L2", "hourly", L2_1H_COMMENT, COLUMNS_1H)
+
+
+def icos_csv_file_name(site: str, product: IcosCsvProduct) -> str:
+    return f"{site}_munich_acropolis_{product.name}.csv"
+
+
+def render_icos_csv_header(sites_meta: pl.DataFrame,
+                           site: str,
+                           product: IcosCsvProduct,
+                           rows: int,
+                           start_date: str,
+                           stop_date: str) -> bytes:
+    """
+    Render the header of an ICOS CP csv file with rows data lines from
+    ICOS_CSV_HEADER_TEMPLATE, quoted like csv.writer (only if necessary).
+    """
+    meta = _site_metadata(sites_meta, site)
+
+    template = ICOS_CSV_HEADER_TEMPLATE.replace("{comment}", "\n".join(product.comment))
+    header_lines = template.count("\n") + 1  # + columns
+
+    header = template.format(
+        file_name=icos_csv_file_name(site, product),
+        file_lines=rows + header_lines,
+        header_lines=header_lines,
+        data_version=product.data_version,
+        site_short_name=site[:4],
+        site_long_name=meta["site_name"],
+        latitude=meta["latitude"],
+        longitude=meta["longitude"],
+        altitude=meta["elevation"],
+        sampling_height=site[-2:] if site[:4] == "BLUT" else meta["height_of_building"],
+        start_date=start_date,
+        stop_date=stop_date,
+        time_interval=product.time_interval)
+
+    lines = [_csv_field(line) for line in header.splitlines()]
+    lines.append(";".join(_csv_field(column) for column in product.columns))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def write_icos_csv_body(df: pl.DataFrame,
+                        product: IcosCsvProduct,
+                        file: IO[bytes],
+                        float_precision: Optional[int] = None) -> None:
+    """
+    Write the data lines of an ICOS CP csv file to the open binary file with
+    the Polars csv writer. Empty strings and nulls are written as empty fields,
+    float columns (if not converted to strings before) with float_precision decimals.
+    """
+    # empty strings would be quoted by Polars, nulls are written as empty fields
+    df.select(product.columns) \
+        .with_columns(pl.col(pl.Utf8).replace("", None)) \
+        .write_csv(file,
+                   include_header=False,
+                   separator=";",
+                   line_terminator="\n",
+                   float_precision=float_precision)
+
+
+def render_icos_csv_body(df: pl.DataFrame,
+                         product: IcosCsvProduct,
+                         float_precision: Optional[int] = None) -> bytes:
+    """Data lines of write_icos_csv_body in memory, e.g. to benchmark the csv writer."""
+    buffer = io.BytesIO()
+    write_icos_csv_body(df, product, buffer, float_precision)
+    return buffer.getvalue()
+
+
+def write_icos_csv(df: pl.DataFrame,
+                   sites_meta: pl.DataFrame,
+                   site: str,
+                   target_directory: str,
+                   product: IcosCsvProduct,
+                   float_precision: Optional[int] = None) -> None:
+    """
+    Write df (converted to ICOS CP format) as ICOS CP csv file: the header is
+    rendered once from the template, the body is written to the file by the
+    Polars csv writer.
+    """
+    header = render_icos_csv_header(sites_meta=sites_meta,
+                                    site=site,
+                                    product=product,
+                                    rows=len(df),
+                                    start_date=df["#Datetime"][0],
+                                    stop_date=df["#Datetime"][-1])
+
+    with open(os.path.join(target_directory, icos_csv_file_name(site, product)), 'wb') as file:
+        file.write(header)
+        write_icos_csv_body(df, product, file, float_precision)
 
 
 def df_to_L1_1min_icos_csv(df:pl.DataFrame, sites_meta: pl.DataFrame, site:str) -> None:
-    header_lines = 45
-    file_name = f"{site}_munich_acropolis_L1_1min.csv"
-    file_path = os.path.join(ICOS_CITIES_LEVEL_1, file_name)
-    file_lines = len(df) + header_lines
-    site_short_name = site[:4]
-    site_long_name = sites_meta.filter(
-        pl.col("site") == site[:4]).select("site_name").item()
-    latitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("latitude").item()
-    longitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("longitude").item()
-    altitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("elevation").item()
-    sampling_height = sites_meta.filter(
-        pl.col("site") == site[:4]).select("height_of_building").item()
-    start_date = df.select("#Datetime").row(0)[0]
-    stop_date = df.select("#Datetime").row(-1)[0]
-    
-    with open(file_path, 'w', newline='') as file:
-        writer = csv.writer(file, delimiter=';', lineterminator='\n')
-        field = [
-            "#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second",
-            "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws",
-            "wd", "Flag"
-        ]
-
-        writer.writerow([
-            "# TITLE: co2 - continuous time series from low and mid cost sensors"
-        ])
-        writer.writerow([f"# FILE NAME: {file_name}"])
-        writer.writerow([
-            "# DATA FORMAT: see the last line of this header for column description"
-        ])
-        writer.writerow([f'# TOTAL LINES: {file_lines}'])
-        writer.writerow([f'# HEADER LINES: {header_lines}'])
-        writer.writerow(['# PROJECT: ICOS CITIES'])
-        writer.writerow(['# DATA VERSION: L1'])
-        writer.writerow([f'# STATION CODE: {site_short_name}'])
-        writer.writerow([f'# STATION NAME: {site_long_name} ({site_short_name})'])
-        writer.writerow([
-            '# OBSERVATION CATEGORY: Air sampling observation at a stationary platform'
-        ])
-        writer.writerow(['# COUNTRY/TERRITORY: DE'])
-        writer.writerow(
-            ['# RESPONSIBLE INSTITUTE: TUM, Technial University Munich'])
-        writer.writerow(
-            ['# CONTRIBUTOR:  Patrick Aigner, Jia Chen, Klaus Kürzinger'])
-        writer.writerow([
-            '# CONTACT POINT: Patrick Aigner <patrick.aigner@tum.de>, Jia Chen <jia.chen@tum.de>'
-        ])
-        writer.writerow([
-            "# FUNDING: European Union's Horizon 2020 Research and Innovation Programme, Grant Agreement No. 101037319"
-        ])
-        writer.writerow([f'# LATITUDE: {latitude}'])
-        writer.writerow([f'# LONGITUDE: {longitude}'])
-        writer.writerow([f'# ALTITUDE: {altitude} m asl'])
-
-        if site[:4] == "BLUT":
-            writer.writerow([f'# SAMPLING HEIGHTS: {site[-2:]} m agl'])
-        else:
-            writer.writerow([f'# SAMPLING HEIGHTS: {sampling_height} m agl'])
-
-        writer.writerow(['# PARAMETER: co2'])
-        writer.writerow([f'# COVERING PERIOD: {start_date} - {stop_date}'])
-        writer.writerow(['# TIME INTERVAL: 1 minute'])
-        writer.writerow(['# MEASUREMENT UNIT: µmol/mol'])
-        writer.writerow(['# MEASUREMENT METHOD: NDIR'])
-        writer.writerow(['# INSTRUMENT: Vaisala GMP343'])
-        writer.writerow(['# SAMPLING TYPE: continuous'])
-        writer.writerow([
-            '# TIME ZONE: Central European Time (UTC+1), Central European Summer Time (UTC+2)'
-        ])
-        writer.writerow(['# MEASUREMENT SCALE: WMO-CO2-X2019'])
-        writer.writerow([
-            '# DATA POLICY: ICOS CITIES DATA is licensed under a Creative Commons Attribution 4.0 international licence (http://creativecommons.org/licenses/by/4.0/.The ICOS CITIES data licence is described at https://data.icos-cities.eu/licence.'
-        ])
-        writer.writerow(['# COMMENT:'])
-        writer.writerow(['#'])
-        writer.writerow(['#   - Times are UTC+0'])
-        writer.writerow([
-            '#   - Time-averaged values are reported at the middle of the averaging interval.'
-        ])
-        writer.writerow(['#   - co2: dry mole air fraction (µmol/mol)'])
-        writer.writerow(['#   - h20: absolute humidity in vol%'])
-        writer.writerow(
-            ['#   - pressure: ambient pressure of outdoor enclosure in hPa'])
-        writer.writerow(
-            ['#   - sensor_temperature: measurement chamber temperature in °C'])
-        writer.writerow(['#   - ws: wind speed in m/s'])
-        writer.writerow(['#   - wd: wind direction in degrees'])
-        writer.writerow(
-            ["#   - Flag 'U' = data correct before manual quality control"])
-        writer.writerow([
-            "#   - Flag 'H' = Potentially locally contaminated by hampel filter (auto)"
-        ])
-        writer.writerow([
-            '#   - In case of gaps between instruments, the timeseries are filled with empty string'
-        ])
-        writer.writerow(['#   - Release notes: '])
-        writer.writerow(['#'])
-        writer.writerow(field)
-
-        for row in df.iter_rows():
-            writer.writerow([''.join(item) for item in row])
+    write_icos_csv(df=df, sites_meta=sites_meta, site=site, target_directory=paths.ICOS_CITIES_LEVEL_1, product=L1_1MIN)
 
 def df_to_L2_1min_icos_csv(df:pl.DataFrame, sites_meta: pl.DataFrame, site:str) -> None:
-    header_lines = 46
-    file_name = f"{site}_munich_acropolis_L2_1min.csv"
-    file_path = os.path.join(ICOS_CITIES_LEVEL_2, file_name)
-    file_lines = len(df) + header_lines
-    site_short_name = site[:4]
-    site_long_name = sites_meta.filter(
-        pl.col("site") == site[:4]).select("site_name").item()
-    latitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("latitude").item()
-    longitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("longitude").item()
-    altitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("elevation").item()
-    sampling_height = sites_meta.filter(
-        pl.col("site") == site[:4]).select("height_of_building").item()
-    start_date = df.select("#Datetime").row(0)[0]
-    stop_date = df.select("#Datetime").row(-1)[0]
-
-    with open(file_path, 'w', newline='') as file:
-        writer = csv.writer(file, delimiter=';', lineterminator='\n')
-        field = ["#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second", "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws", "wd", "Flag"]
-    
-        writer.writerow(["# TITLE: co2 - continuous time series from low and mid cost sensors"])
-        writer.writerow([f"# FILE NAME: {file_name}"])
-        writer.writerow(["# DATA FORMAT: see the last line of this header for column description"])
-        writer.writerow([f'# TOTAL LINES: {file_lines}'])
-        writer.writerow([f'# HEADER LINES: {header_lines}'])
-        writer.writerow(['# PROJECT: ICOS CITIES'])
-        writer.writerow(['# DATA VERSION: L2'])
-        writer.writerow([f'# STATION CODE: {site_short_name}'])
-        writer.writerow([f'# STATION NAME: {site_long_name} ({site_short_name})'])
-        writer.writerow(['# OBSERVATION CATEGORY: Air sampling observation at a stationary platform'])
-        writer.writerow(['# COUNTRY/TERRITORY: DE'])
-        writer.writerow(['# RESPONSIBLE INSTITUTE: TUM, Technial University Munich'])
-        writer.writerow(['# CONTRIBUTOR:  Patrick Aigner, Jia Chen, Klaus Kürzinger'])
-        writer.writerow(['# CONTACT POINT: Patrick Aigner <patrick.aigner@tum.de>, Jia Chen <jia.chen@tum.de>'])
-        writer.writerow(["# FUNDING: European Union's Horizon 2020 Research and Innovation Programme, Grant Agreement No. 101037319"])
-        writer.writerow([f'# LATITUDE: {latitude}'])
-        writer.writerow([f'# LONGITUDE: {longitude}'])
-        writer.writerow([f'# ALTITUDE: {altitude} m asl'])
-        
-        if site[:4] == "BLUT":
-            writer.writerow([f'# SAMPLING HEIGHTS: {site[-2:]} m agl'])
-        else:
-            writer.writerow([f'# SAMPLING HEIGHTS: {sampling_height} m agl'])
-        
-        writer.writerow(['# PARAMETER: co2'])
-        writer.writerow([f'# COVERING PERIOD: {start_date} - {stop_date}'])
-        writer.writerow(['# TIME INTERVAL: 1 minute'])
-        writer.writerow(['# MEASUREMENT UNIT: µmol/mol'])
-        writer.writerow(['# MEASUREMENT METHOD: NDIR'])
-        writer.writerow(['# INSTRUMENT: Vaisala GMP343'])
-        writer.writerow(['# SAMPLING TYPE: continuous'])
-        writer.writerow(['# TIME ZONE: Central European Time (UTC+1), Central European Summer Time (UTC+2)'])
-        writer.writerow(['# MEASUREMENT SCALE: WMO-CO2-X2019'])
-        writer.writerow(['# DATA POLICY: ICOS CITIES DATA is licensed under a Creative Commons Attribution 4.0 international licence (http://creativecommons.org/licenses/by/4.0/.The ICOS CITIES data licence is described at https://data.icos-cities.eu/licence.'])
-        writer.writerow(['# COMMENT:'])
-        writer.writerow(['#'])
-        writer.writerow(['#   - Times are UTC+0'])
-        writer.writerow(['#   - Time-averaged values are reported at the middle of the averaging interval.'])
-        writer.writerow(['#   - co2: dry mole air fraction (µmol/mol)'])
-        writer.writerow(['#   - h20: absolute humidity in vol%'])
-        writer.writerow(['#   - pressure: ambient pressure of outdoor enclosure in hPa'])
-        writer.writerow(['#   - sensor_temperature: measurement chamber temperature in °C'])
-        writer.writerow(['#   - ws: wind speed in m/s'])
-        writer.writerow(['#   - wd: wind direction in degrees'])
-        writer.writerow(["#   - Flag 'O' = data correct after manual quality control"])
-        writer.writerow(["#   - Flag 'H' = Potentially locally contaminated by hampel filter (auto)"])
-        writer.writerow(["#   - Flag 'C' = Potentially locally contaminated (manual quality control)"])
-        writer.writerow(['#   - In case of gaps between instruments, the timeseries are filled with empty string'])
-        writer.writerow(['#   - Release notes: '])
-        writer.writerow(['#'])
-        writer.writerow(field)
-        
-        for row in df.iter_rows():
-            writer.writerow([''.join(item) for item in row])
-            
+    write_icos_csv(df=df, sites_meta=sites_meta, site=site, target_directory=paths.ICOS_CITIES_LEVEL_2, product=L2_1MIN)
+
 def df_to_L2_1h_icos_csv(df:pl.DataFrame, sites_meta: pl.DataFrame, site:str) -> None:
-    header_lines = 45
-    file_name = f"{site}_munich_acropolis_L2_1h.csv"
-    file_path = os.path.join(ICOS_CITIES_LEVEL_2, file_name)
-    file_lines = len(df) + header_lines
-    site_short_name = site[:4]
-    site_long_name = sites_meta.filter(
-        pl.col("site") == site[:4]).select("site_name").item()
-    latitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("latitude").item()
-    longitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("longitude").item()
-    altitude = sites_meta.filter(
-        pl.col("site") == site[:4]).select("elevation").item()
-    sampling_height = sites_meta.filter(
-        pl.col("site") == site[:4]).select("height_of_building").item()
-    start_date = df.select("#Datetime").row(0)[0]
-    stop_date = df.select("#Datetime").row(-1)[0]
-    
-    with open(file_path, 'w', newline='') as file:
-        writer = csv.writer(file, delimiter=';', lineterminator='\n')
-        field = ["#Datetime", "Year", "Month", "Day", "Hour", "Minute", "Second", "DecimalDate", "co2", "h2o", "pressure", "sensor_temperature", "ws", "wd", "NbPoints", "Stdev", "Flag"]
-    
-        writer.writerow(["# TITLE: co2 - continuous time series from low and mid cost sensors"])
-        writer.writerow([f"# FILE NAME: {file_name}"])
-        writer.writerow(["# DATA FORMAT: see the last line of this header for column description"])
-        writer.writerow([f'# TOTAL LINES: {file_lines}'])
-        writer.writerow([f'# HEADER LINES: {header_lines}'])
-        writer.writerow(['# PROJECT: ICOS CITIES'])
-        writer.writerow(['# DATA VERSION: L2'])
-        writer.writerow([f'# STATION CODE: {site_short_name}'])
-        writer.writerow([f'# STATION NAME: {site_long_name} ({site_short_name})'])
-        writer.writerow(['# OBSERVATION CATEGORY: Air sampling observation at a stationary platform'])
-        writer.writerow(['# COUNTRY/TERRITORY: DE'])
-        writer.writerow(['# RESPONSIBLE INSTITUTE: TUM, Technial University Munich'])
-        writer.writerow(['# CONTRIBUTOR:  Patrick Aigner, Jia Chen, Klaus Kürzinger'])
-        writer.writerow(['# CONTACT POINT: Patrick Aigner <patrick.aigner@tum.de>, Jia Chen <jia.chen@tum.de>'])
-        writer.writerow(["# FUNDING: European Union's Horizon 2020 Research and Innovation Programme, Grant Agreement No. 101037319"])
-        writer.writerow([f'# LATITUDE: {latitude}'])
-        writer.writerow([f'# LONGITUDE: {longitude}'])
-        writer.writerow([f'# ALTITUDE: {altitude} m asl'])
-        
-        if site[:4] == "BLUT":
-            writer.writerow([f'# SAMPLING HEIGHTS: {site[-2:]} m agl'])
-        else:
-            writer.writerow([f'# SAMPLING HEIGHTS: {sampling_height} m agl'])
-        
-        writer.writerow(['# PARAMETER: co2'])
-        writer.writerow([f'# COVERING PERIOD: {start_date} - {stop_date}'])
-        writer.writerow(['# TIME INTERVAL: hourly'])
-        writer.writerow(['# MEASUREMENT UNIT: µmol/mol'])
-        writer.writerow(['# MEASUREMENT METHOD: NDIR'])
-        writer.writerow(['# INSTRUMENT: Vaisala GMP343'])
-        writer.writerow(['# SAMPLING TYPE: continuous'])
-        writer.writerow(['# TIME ZONE: Central European Time (UTC+1), Central European Summer Time (UTC+2)'])
-        writer.writerow(['# MEASUREMENT SCALE: WMO-CO2-X2019'])
-        writer.writerow(['# DATA POLICY: ICOS CITIES DATA is licensed under a Creative Commons Attribution 4.0 international licence (http://creativecommons.org/licenses/by/4.0/.The ICOS CITIES data licence is described at https://data.icos-cities.eu/licence.'])
-        writer.writerow(['# COMMENT:'])
-        writer.writerow(['#'])
-        writer.writerow(['#   - Times are UTC+0'])
-        writer.writerow(['#   - Time-averaged values are reported at the middle of the averaging interval.'])
-        writer.writerow(['#   - co2: dry mole air fraction (µmol/mol)'])
-        writer.writerow(['#   - h20: absolute humdity in vol%'])
-        writer.writerow(['#   - pressure: ambient pressure of outdoor enclosure in hPa'])
-        writer.writerow(['#   - sensor_temperature: measurement chamber temperature in °C'])
-        writer.writerow(['#   - ws: wind speed in m/s'])
-        writer.writerow(['#   - wd: wind direction in degrees'])
-        writer.writerow(["#   - Flag 'O' = data correct after manual quality control"])
-        writer.writerow(["#   - Flag 'K' = data incorrect after manual quality control"])
-        writer.writerow(['#   - In case of gaps between instruments, the timeseries are filled with empty string'])
-        writer.writerow(['#   - Release notes: '])
-        writer.writerow(['#'])
-        writer.writerow(field)
-        
-        for row in df.iter_rows():
-            writer.writerow([''.join(item) for item in row])
+    write_icos_csv(df=df, sites_meta=sites_meta, site=site, target_directory=paths.ICOS_CITIES_LEVEL_2, product=L2_1H)
@@ -1,38 +1,61 @@
 import requests
 import os
+import re
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from types import TracebackType
+from typing import Callable, NamedTuple, Optional, Type
 
-from .os_functions import zip_file, hash_file
+from .os_functions import zip_and_hash_file
 
-def upload_file_to_icos_cp(
-    config: dict,
-    root_directory: str,
-    file_name: str,
-    site_id: str,
-    sampling_height: float,
-    data_level: int,
-) -> bool:
-    """Two step upload process to ICOS Carbon Portal. Register metadata package and upload file.
+# Endpoints of the ICOS Cities portal, can be overwritten in config["icos_cities_portal"]
+DEFAULT_LOGIN_URL = "https://cpauth.icos-cp.eu/password/login"
+DEFAULT_UPLOAD_URL = "https://citymeta.icos-cp.eu/upload"
+# (connect, read) timeout of each request in seconds
+REQUEST_TIMEOUT = (30, 600)
+# Responses that are retried (besides connection errors and timeouts)
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Upper limit of the wait between two attempts in seconds
+MAX_BACKOFF = 60.0
 
-    Args:
-        root_directory (str): root directory of the file
-        file_name (str): file name
-        site_id (str): site id (must be available in the ICOS CP)
-        sampling_height (str): variable sampling height
 
-    Returns:
-        Bool: True if successful
-    """
+class UploadFailure(NamedTuple):
+    stage: str  # "package", "login", "registration" or "upload"
+    message: str
+    status_code: Optional[int] = None  # of the last response, None for connection errors
+    attempts: int = 1
+
+
+class UploadResult(NamedTuple):
+    file_name: str
+    success: bool
+    object_url: Optional[str] = None  # returned by the metadata registration
+    hash_sum: Optional[str] = None  # sha256 of the uploaded zip file
+    size: int = 0  # bytes of the uploaded zip file
+    duration: float = 0.0  # seconds for zipping (if not packaged before), registration and upload
+    attempts: int = 0  # requests for registration and upload, including retries
+    failure: Optional[UploadFailure] = None
+
 
-    # zip the file and calculate hashsum
-    try:
-        zipped_filename = zip_file(os.path.join(root_directory, file_name))
-        hash_sum = hash_file(zipped_filename)
-    except AssertionError:
-        print(f"File {file_name} not found")
-        return False
+class UploadError(Exception):
+    """A step of the upload failed (after all retries)."""
 
-    # STEP 1: register metadata package
+    def __init__(self, failure: UploadFailure) -> None:
+        super().__init__(f"{failure.stage}: {failure.message}")
+        self.failure = failure
+
+
+def metadata_payload(config: dict,
+                     file_name: str,
+                     hash_sum: str,
+                     site_id: str,
+                     sampling_height: float,
+                     data_level: int,
+                     partial_upload: bool = False) -> dict:
+    """Metadata package of a zipped file (file_name without .zip) for the ICOS CP registration."""
     datetime_format = '%Y-%m-%dT%H:%M:%S.000Z'
     creation_date = datetime.now(timezone.utc).strftime(
         datetime_format)  # date of the data creation
@@ -44,7 +67,7 @@ def upload_file_to_icos_cp(
         data_object_specification = config["icos_cities_portal"][
             "l1_object_specification"]
 
-    payload = {
+    return {
         'submitterId': config["icos_cities_portal"]["submitter_id"],
         'hashSum': hash_sum,
         'fileName': file_name + '.zip',
@@ -65,47 +88,328 @@ def upload_file_to_icos_cp(
             'keywords': config["icos_cities_portal"]["keywords"],
             'duplicateFilenameAllowed': False,
             'autodeprecateSameFilenameObjects': True,
-            'partialUpload': False
+            'partialUpload': partial_upload
         },
         'autodeprecateSameFilenameObjects': True,
         'duplicateFilenameAllowed': False,
-        'partialUpload': False,
+        'partialUpload': partial_upload,
     }
 
-    #Perform the POST request and save cookies to a file
-    with requests.Session() as session:
-        # authenticate
-        session.post("https://cpauth.icos-cp.eu/password/login",
-                     data={
-                         "mail":
-                         config["icos_cities_portal"]["portal_user"],
-                         "password":
-                         config["icos_cities_portal"]["portal_password"]
-                     })
-
-        r = session.post(
-            url='https://citymeta.icos-cp.eu/upload', json=payload
-        )  # Automatically sets the Content-Type to application/json)
-
-        if r.status_code == 200:
-            print(f"Register metadata package for site {site_id}: Successful")
-            print(f'Response URL : {r.text}')
-            print('Start uploading file')
-
-            filepath = os.path.join(root_directory, file_name + '.zip')
-            with open(filepath, "rb") as file:
-                rd = session.put(r.text, data=file)
-            if rd.status_code == 200:
-                print(f"File upload successful")
+
+def _received_bytes(response: requests.Response) -> int:
+    # "Range: bytes=0-<last received byte>", no header if nothing was received
+    match = re.fullmatch(r"bytes=0-(\d+)", response.headers.get("Range", ""))
+    return int(match.group(1)) + 1 if match else 0
+
+
+class IcosCpUploadClient:
+    """
+    Upload files to the ICOS Cities portal with a single login.
+
+    All uploads share one authenticated session with a connection pool of
+    max_workers connections. upload_files runs the two step upload (metadata
+    registration and data PUT) of up to max_workers files concurrently.
+
+    Settings in config["icos_cities_portal"]:
+    - "login_url", "upload_url": portal endpoints (default: the production
+      portal), e.g. to test against scripts/icos_cp_mock_server.py
+    - "compression_level": deflate level of the zip files (default: 6)
+    - "upload_retries", "upload_backoff_seconds": failed requests (connection
+      errors, RETRY_STATUS_CODES) are retried up to upload_retries times
+      (default: 5), waiting upload_backoff_seconds (default: 1) doubling with
+      each attempt (with jitter)
+    - "upload_chunk_size_mb": if > 0 (default: 0), larger zip files are PUT in
+      chunks with Content-Range headers and registered as partialUpload. After
+      a failed chunk, the upload resumes from the bytes the server reports as
+      received. Requires support by the server.
+
+    Usage:
+        with IcosCpUploadClient(config, max_workers=4) as client:
+            results = client.upload_files(uploads)
+    """
+
+    def __init__(self, config: dict, max_workers: int = 4) -> None:
+        self.config = config
+        self.max_workers = max(1, max_workers)
+        settings = config["icos_cities_portal"]
+        self.login_url = settings.get("login_url", DEFAULT_LOGIN_URL)
+        self.upload_url = settings.get("upload_url", DEFAULT_UPLOAD_URL)
+        self.compresslevel = settings.get("compression_level", 6)
+        self.retries = settings.get("upload_retries", 5)
+        self.backoff = settings.get("upload_backoff_seconds", 1.0)
+        self.chunk_size = int(settings.get("upload_chunk_size_mb", 0) * 2**20)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self) -> "IcosCpUploadClient":
+        self.login()
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]],
+                 exc_value: Optional[BaseException],
+                 traceback: Optional[TracebackType]) -> None:
+        self.session.close()
+
+    def _wait(self, attempt: int) -> None:
+        # exponential backoff with jitter, so concurrent uploads don't retry in lockstep
+        delay = min(self.backoff * 2**(attempt - 1), MAX_BACKOFF)
+        time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _request(self, stage: str, send: Callable[[], requests.Response],
+                 expected: set[int]) -> tuple[requests.Response, int]:
+        """
+        Send a request with retries. Returns the response with an expected
+        status code and the number of attempts.
+
+        Raises:
+            UploadError: for an unexpected status code that is not retried or
+                if the last attempt failed
+        """
+        for attempt in range(1, self.retries + 2):
+            try:
+                response = send()
+            except requests.RequestException as e:
+                failure = UploadFailure(stage, str(e), None, attempt)
             else:
-                print(f"File upload failed with status code {rd.status_code}")
-                print(f"Response: {rd.text}")
-                return False
-        else:
-            print(
-                f"Register metadata package: Failed with status code {r.status_code}"
+                if response.status_code in expected:
+                    return response, attempt
+                failure = UploadFailure(
+                    stage,
+                    f"status code {response.status_code}: {response.text[:200]}",
+                    response.status_code, attempt)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise UploadError(failure)
+
+            if attempt <= self.retries:
+                logging.warning(
+                    f"{stage} attempt {attempt} failed ({failure.message}), retrying"
+                )
+                self._wait(attempt)
+        raise UploadError(failure)
+
+    def login(self) -> None:
+        """
+        Authenticate the session (the portal sets a cookie).
+
+        Raises:
+            UploadError: if the login failed
+        """
+        self._request(
+            "login", lambda: self.session.post(
+                self.login_url,
+                data={
+                    "mail": self.config["icos_cities_portal"]["portal_user"],
+                    "password": self.config["icos_cities_portal"]
+                    ["portal_password"]
+                },
+                timeout=REQUEST_TIMEOUT), {200})
+        logging.info(f"Logged in to {self.login_url}")
+
+    def _put_file(self, object_url: str, zipped_filename: str) -> int:
+        """Upload the zip file in a single PUT. Returns the number of attempts."""
+
+        def send() -> requests.Response:
+            with open(zipped_filename, "rb") as file:
+                return self.session.put(object_url,
+                                        data=file,
+                                        timeout=REQUEST_TIMEOUT)
+
+        return self._request("upload", send, {200, 201})[1]
+
+    def _put_chunked(self, object_url: str, zipped_filename: str,
+                     size: int) -> int:
+        """
+        Upload the zip file in chunks with Content-Range headers. The server
+        answers 308 with the received range until the file is complete. After a
+        failed chunk, the received range is queried (Content-Range: bytes */size)
+        and the upload continues from there. Returns the number of requests.
+
+        Raises:
+            UploadError: if a chunk failed more than upload_retries times in a row
+        """
+        attempts = 0
+        offset = 0
+        failures = 0
+        with open(zipped_filename, "rb") as file:
+            while True:
+                file.seek(offset)
+                chunk = file.read(self.chunk_size)
+                headers = {
+                    "Content-Range":
+                    f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+                }
+                attempts += 1
+                try:
+                    response = self.session.put(object_url,
+                                                data=chunk,
+                                                headers=headers,
+                                                timeout=REQUEST_TIMEOUT)
+                except requests.RequestException as e:
+                    failure = UploadFailure("upload", str(e), None, attempts)
+                else:
+                    if response.status_code in (200, 201):
+                        return attempts
+                    if response.status_code == 308:
+                        offset = _received_bytes(response)
+                        failures = 0
+                        continue
+                    failure = UploadFailure(
+                        "upload",
+                        f"status code {response.status_code}: {response.text[:200]}",
+                        response.status_code, attempts)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        raise UploadError(failure)
+
+                failures += 1
+                if failures > self.retries:
+                    raise UploadError(failure)
+                logging.warning(
+                    f"upload from byte {offset} failed ({failure.message}), resuming"
+                )
+                self._wait(failures)
+
+                # resume from the bytes the server received
+                attempts += 1
+                try:
+                    response = self.session.put(
+                        object_url,
+                        headers={"Content-Range": f"bytes */{size}"},
+                        timeout=REQUEST_TIMEOUT)
+                except requests.RequestException:
+                    continue
+                if response.status_code in (200, 201):
+                    return attempts
+                if response.status_code == 308:
+                    offset = _received_bytes(response)
+
+    def upload_file(self,
+                    root_directory: str,
+                    file_name: str,
+                    site_id: str,
+                    sampling_height: float,
+                    data_level: int,
+                    package: Optional[tuple[str, str]] = None) -> UploadResult:
+        """
+        Two step upload process to ICOS Carbon Portal. Zip the file, register
+        the metadata package and upload the zip file.
+
+        Args:
+            root_directory (str): root directory of the file
+            file_name (str): file name
+            site_id (str): site id (must be available in the ICOS CP)
+            sampling_height (float): variable sampling height
+            data_level (int): 1 or 2, selects the object specification
+            package (tuple[str, str]): zip file and hashsum if the file was
+                already zipped (see package_files), otherwise it is zipped here.
+                A file that cannot be zipped (e.g. missing) fails at the "package" stage
+
+        Returns:
+            UploadResult: success, object URL, timing and attempts of the
+                upload, or the failure
+        """
+        start = time.perf_counter()
+        attempts = 0
+        object_url = None
+        hash_sum = None
+        size = 0
+
+        try:
+            # zip the file and calculate hashsum
+            if package is None:
+                try:
+                    package = zip_and_hash_file(
+                        os.path.join(root_directory, file_name),
+                        self.compresslevel)
+                except OSError as e:
+                    raise UploadError(UploadFailure("package", str(e)))
+            zipped_filename, hash_sum = package
+            size = os.path.getsize(zipped_filename)
+            chunked = 0 < self.chunk_size < size
+
+            # STEP 1: register metadata package
+            payload = metadata_payload(self.config,
+                                       file_name,
+                                       hash_sum,
+                                       site_id,
+                                       sampling_height,
+                                       data_level,
+                                       partial_upload=chunked)
+            response, attempts = self._request(
+                "registration", lambda: self.session.post(
+                    url=self.upload_url, json=payload, timeout=REQUEST_TIMEOUT),
+                {200})
+            object_url = response.text.strip()
+            logging.info(
+                f"Registered metadata package for site {site_id}: {object_url}")
+
+            # STEP 2: upload the zip file
+            if chunked:
+                attempts += self._put_chunked(object_url, zipped_filename, size)
+            else:
+                attempts += self._put_file(object_url, zipped_filename)
+        except UploadError as e:
+            failure = e.failure._replace(attempts=attempts + e.failure.attempts)
+            logging.error(
+                f"Upload of {file_name} failed at {failure.stage} after {failure.attempts} attempts: {failure.message}"
             )
-            print(f"Response: {r.text}")
-            return False
+            return UploadResult(file_name=file_name,
+                                success=False,
+                                object_url=object_url,
+                                hash_sum=hash_sum,
+                                size=size,
+                                duration=time.perf_counter() - start,
+                                attempts=failure.attempts,
+                                failure=failure)
+
+        duration = time.perf_counter() - start
+        logging.info(
+            f"Uploaded {file_name} ({size / 1e6:.1f} MB) in {duration:.2f} s with {attempts} requests"
+        )
+        return UploadResult(file_name=file_name,
+                            success=True,
+                            object_url=object_url,
+                            hash_sum=hash_sum,
+                            size=size,
+                            duration=duration,
+                            attempts=attempts)
+
+    def upload_files(self, uploads: list[dict]) -> list[UploadResult]:
+        """
+        Upload several files concurrently (at most max_workers at a time).
+        uploads are the keyword arguments of upload_file, the results are
+        returned in the same order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(
+                executor.map(lambda upload: self.upload_file(**upload),
+                             uploads))
+
+
+def upload_file_to_icos_cp(
+    config: dict,
+    root_directory: str,
+    file_name: str,
+    site_id: str,
+    sampling_height: float,
+    data_level: int,
+) -> bool:
+    """Two step upload process to ICOS Carbon Portal. Register metadata package and upload file.
+
+    Logs in for this file only, use IcosCpUploadClient to upload several files.
 
-    return True
+    Args:
+        root_directory (str): root directory of the file
+        file_name (str): file name
+        site_id (str): site id (must be available in the ICOS CP)
+        sampling_height (str): variable sampling height
+
+    Returns:
+        Bool: True if successful
+    """
+    with IcosCpUploadClient(config, max_workers=1) as client:
+        return client.upload_file(root_directory, file_name, site_id,
+                                  sampling_height, data_level).success
@@ -4,18 +4,19 @@ import os
 from datetime import datetime
 from typing import Optional
 
-from .config_files import load_json_config
+from .context import get_context
+from .parquet_manifest import load_manifest, overlapping_row_range
 
-config = load_json_config("config.json")
+# Data types of the keys in the hive partitioned datasets (see write_hive_partitions)
+HIVE_SCHEMA = {"system_id": pl.Int32, "year": pl.Int32, "month": pl.Int8}
 
 
-# Import system specific processed data
-def import_acropolis_system_data(years: list[int],
-                                 target_directory: str,
-                                 id: int,
-                                 prefix: Optional[str] = None) -> pl.LazyFrame:
+def system_data_paths(years: list[int],
+                      target_directory: str,
+                      id: int,
+                      prefix: Optional[str] = None) -> list[str]:
+    """List the existing yearly parquet files of a system."""
     paths = []
-    df_years = []
 
     if prefix:
         file_name = f"{prefix}_acropolis-{id}.parquet"
@@ -27,17 +28,151 @@ def import_acropolis_system_data(years: list[int],
         if os.path.exists(path):
             paths += sorted(glob.glob(path), key=os.path.getmtime)
 
+    return paths
+
+
+def system_data_files(years: list[int],
+                      target_directory: str,
+                      id: int,
+                      prefix: Optional[str] = None,
+                      hive_partitioning: bool = False) -> list[str]:
+    """List the parquet files of a system in the yearly or hive partitioned layout."""
+    if not hive_partitioning:
+        return system_data_paths(years, target_directory, id, prefix)
+
+    paths = []
+    for year in years:
+        paths += glob.glob(
+            os.path.join(target_directory, prefix or "acropolis",
+                         f"system_id={id}", f"year={year}", "**", "*.parquet"),
+            recursive=True)
+    return paths
+
+
+def system_data_size(years: list[int],
+                     target_directory: str,
+                     id: int,
+                     prefix: Optional[str] = None,
+                     hive_partitioning: bool = False) -> int:
+    """Total size in bytes of the parquet files of a system (e.g. as cost estimate)."""
+    return sum(
+        os.path.getsize(path) for path in system_data_files(
+            years, target_directory, id, prefix, hive_partitioning))
+
+
+# Import system specific processed data
+def import_acropolis_system_data(years: list[int],
+                                 target_directory: str,
+                                 id: int,
+                                 prefix: Optional[str] = None,
+                                 hive_partitioning: bool = False,
+                                 start: Optional[datetime] = None,
+                                 end: Optional[datetime] = None) -> pl.LazyFrame:
+    """
+    Scan the yearly parquet files of a system. If start and/or end are given,
+    only the row groups overlapping [start, end] are read (see parquet_manifest).
+    The selection has row group granularity, exact filtering is left to the caller.
+    """
+    if start is not None:
+        years = [year for year in years if year >= start.year]
+    if end is not None:
+        years = [year for year in years if year <= end.year]
+
+    if hive_partitioning:
+        df = import_acropolis_partitioned_data(
+            target_directory=target_directory,
+            prefix=prefix,
+            system_ids=[id],
+            years=years)
+        if start is not None and end is not None:
+            df = df.pipe(filter_partition_range, start, end)
+        # The key columns are only used to select the directories. Polars 1.22
+        # does not apply row filters to them when a single file is scanned, so
+        # system_id is added as a literal like for the yearly files.
+        return df.drop(["system_id", "year", "month"]) \
+            .with_columns(system_id=pl.lit(id, dtype=HIVE_SCHEMA["system_id"]))
+
+    paths = system_data_paths(years=years,
+                              target_directory=target_directory,
+                              id=id,
+                              prefix=prefix)
+    df_years = []
+
     for path in paths:
-        if os.path.isfile(path):
+        if not os.path.isfile(path):
+            continue
+        if start is None and end is None:
             df_years.append(pl.scan_parquet(path))
+            continue
+
+        row_range = overlapping_row_range(load_manifest(path), start, end)
+        if row_range is not None:
+            offset, length = row_range
+            df_years.append(pl.scan_parquet(path).slice(offset, length))
+
+    if len(df_years) == 0 and len(paths) > 0:
+        # no overlapping row groups, keep the schema without reading any rows
+        df_years.append(pl.scan_parquet(paths[0]).slice(0, 0))
 
     return pl.concat(df_years,
                      how="diagonal").with_columns(system_id=pl.lit(id))
 
 
-def import_acropolis_site_data(target_directory: str, deployment_times: dict,
-                               site_name: str):
+def import_acropolis_partitioned_data(
+        target_directory: str,
+        prefix: Optional[str] = None,
+        system_ids: Optional[list[int]] = None,
+        years: Optional[list[int]] = None,
+        months: Optional[list[int]] = None) -> pl.LazyFrame:
+    """
+    Scan a hive partitioned dataset written by write_hive_partitions with a single
+    scan_parquet call. Filters on system_id, year and month are applied to the
+    partition keys, so that non-matching directories are never opened.
+    """
+    dataset_path = os.path.join(target_directory, prefix or "acropolis")
+
+    df = pl.scan_parquet(os.path.join(dataset_path, "**", "*.parquet"),
+                         hive_partitioning=True,
+                         hive_schema=HIVE_SCHEMA)
+
+    if system_ids is not None:
+        df = df.filter(pl.col("system_id").is_in(system_ids))
+    if years is not None:
+        df = df.filter(pl.col("year").is_in(years))
+    if months is not None:
+        df = df.filter(pl.col("month").is_in(months))
+
+    return df
+
+
+def filter_partition_range(df: pl.LazyFrame, start_time: datetime,
+                           end_time: datetime) -> pl.LazyFrame:
+    """Restrict a hive partitioned scan to the months touching [start_time, end_time]."""
+    if start_time.year == end_time.year:
+        return df.filter((pl.col("year") == start_time.year)
+                         & (pl.col("month") >= start_time.month)
+                         & (pl.col("month") <= end_time.month))
+
+    return df.filter(((pl.col("year") == start_time.year)
+                      & (pl.col("month") >= start_time.month))
+                     | ((pl.col("year") > start_time.year)
+                        & (pl.col("year") < end_time.year))
+                     | ((pl.col("year") == end_time.year)
+                        & (pl.col("month") <= end_time.month)))
+
+
+def import_acropolis_site_data(target_directory: str,
+                               deployment_times: dict,
+                               site_name: str,
+                               hive_partitioning: bool = False,
+                               frames: Optional[dict[int, pl.DataFrame]] = None):
+    """
+    Concatenate the despiked data of all sensors deployed at a site, each
+    restricted to its deployment period. frames: despiked data of systems that
+    is already in memory (see utils/fused.py), used instead of their files.
+    """
     extracted_dates = []
+    years = get_context().config["icos_cities_portal"]["input_years"]
 
     for sensor in deployment_times[site_name]["sensors"]:
 
@@ -47,11 +182,21 @@ def import_acropolis_site_data(target_directory: str, deployment_times: dict,
                                        "%Y-%m-%dT%H:%M:%S%z")
         end_time = datetime.strptime(sensor["end_time"], "%Y-%m-%dT%H:%M:%S%z")
 
-        df_temp = import_acropolis_system_data(
-            years=config["icos_cities_portal"]["input_years"],
-            target_directory=os.path.join(target_directory),
-            id=id,
-            prefix="flagged_L1_1_min") \
+        if frames is not None and id in frames:
+            df_sensor = frames[id].lazy() \
+                .filter(pl.col("datetime").dt.year().is_in(years)) \
+                .with_columns(system_id=pl.lit(id))
+        else:
+            df_sensor = import_acropolis_system_data(
+                years=years,
+                target_directory=os.path.join(target_directory),
+                id=id,
+                prefix="flagged_L1_1_min",
+                hive_partitioning=hive_partitioning,
+                start=start_time,
+                end=end_time)
+
+        df_temp = df_sensor \
             .with_columns(pl.col("datetime").cast(pl.Datetime("us")).dt.replace_time_zone("UTC")) \
             .filter(pl.col("datetime") \
                 .is_between(start_time, end_time)) \
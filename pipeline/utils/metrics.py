@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
+
+from .paths import LOG_DIRECTORY
+
+# Metrics of a run are appended to <LOG_DIRECTORY>/<YYYY-MM-DD>.metrics.jsonl,
+# next to the dated log file
+METRICS_SUFFIX = ".metrics.jsonl"
+
+# Identifies the run of a script. Spawned worker processes inherit the
+# environment and therefore write their metrics with the id of the parent.
+RUN_ID = os.environ.setdefault(
+    "ACROPOLIS_METRICS_RUN",
+    f"{datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}-{os.getpid()}")
+
+
+def metrics_path() -> str:
+    return os.path.join(LOG_DIRECTORY, RUN_ID[:10] + METRICS_SUFFIX)
+
+
+# Linux: the peak RSS (VmHWM) can be reset by writing "5" to clear_refs
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+# Peak RSS in kB of the steps in progress (all threads). Before the peak of
+# the process is reset, it is folded into the peaks of all open steps, so
+# nested and concurrent steps each keep the maximum over their own duration.
+_open_peaks: dict[int, int] = {}
+_peaks_lock = threading.Lock()
+
+
+def read_peak_rss_kb() -> Optional[int]:
+    """Peak RSS of the process since the last reset in kB (None if unknown)."""
+    try:
+        with open(PROC_STATUS, "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    try:
+        with open(PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _fold_peak() -> None:
+    peak = read_peak_rss_kb()
+    if peak is not None:
+        for key in _open_peaks:
+            _open_peaks[key] = max(_open_peaks[key], peak)
+
+
+def start_peak_rss(key: int) -> None:
+    """Start tracking the peak RSS of one step (see end_peak_rss)."""
+    with _peaks_lock:
+        _fold_peak()
+        if reset_peak_rss():
+            _open_peaks[key] = 0
+
+
+def end_peak_rss(key: int) -> Optional[float]:
+    """
+    Peak RSS in MB of the process during the step started with
+    start_peak_rss(key). None if the peak cannot be reset (other than Linux),
+    as the lifetime peak of the process would not belong to the step.
+    """
+    with _peaks_lock:
+        _fold_peak()
+        peak = _open_peaks.pop(key, None)
+    return None if peak is None else round(peak / 1024, 1)
+
+
+def write_metric(record: dict) -> None:
+    """Append one record as a JSON line to the metrics file of the run."""
+    os.makedirs(LOG_DIRECTORY, exist_ok=True)
+    # a single short write per line, lines of concurrent workers don't interleave
+    with open(metrics_path(), "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def measure(step: str,
+            rows_in: Optional[int] = None,
+            **labels: object) -> Iterator[dict]:
+    """
+    Record wall time, CPU time, rows and peak RSS of a pipeline step.
+
+        with measure("wet_to_dry_mole_fraction", rows_in=len(df), system_id=id) as m:
+            df = wet_to_dry_mole_fraction(df)
+            m["rows_out"] = len(df)
+
+    labels (e.g. system_id or site) are stored with the record. The CPU time
+    includes all threads of the process (e.g. Polars threads and the
+    background writer of the fused run). The peak RSS is the high-water mark of
+    the process during the step (Linux only, None elsewhere), so it also
+    includes memory held by concurrent steps. Steps that
+    raise are recorded with "ok": false. Can also decorate a function
+    (@measure("upload")), without rows.
+    """
+    record: dict = {
+        "run": RUN_ID,
+        "script": os.path.basename(sys.argv[0]),
+        "step": step,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        **labels,
+        "rows_in": rows_in,
+        "rows_out": None
+    }
+    key = id(record)
+    start_peak_rss(key)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    ok = False
+    try:
+        yield record
+        ok = True
+    finally:
+        record.update({
+            "wall_s": round(time.perf_counter() - wall_start, 4),
+            "cpu_s": round(time.process_time() - cpu_start, 4),
+            "peak_rss_mb": end_peak_rss(key),
+            "ok": ok
+        })
+        write_metric(record)
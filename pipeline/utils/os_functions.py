@@ -1,6 +1,9 @@
 import os
 import hashlib
+import logging
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 
 def ensure_data_dir(dir_path: str) -> None:
@@ -10,30 +13,92 @@ def ensure_data_dir(dir_path: str) -> None:
 
 # calculate hashsum of a file
 def hash_file(file_path: str) -> str:
-    """Generates hashsum of a file
+    """Generates hashsum of a file (read in chunks)
     Args:
-        fname (str): _description_
+        file_path (str): path to the file
     Returns:
         str: sha256 hashsum of the file
+    Raises:
+        FileNotFoundError: if file_path is not a file
     """
-    assert os.path.isfile(file_path)
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
     with open(file_path, "rb") as f:
-        bytes = f.read()  # read entire file as bytes
-        return hashlib.sha256(bytes).hexdigest()
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
 
-def zip_file(file_path: str) -> str:
-    """Generates zipped version of a file
+class _HashingWriter:
+    """
+    Write-only file wrapper that hashes everything written to it. It has no
+    tell/seek, so zipfile writes it as a stream (sizes and CRC in data
+    descriptors) and never reads or rewrites data it already wrote.
+    """
+
+    def __init__(self, file: object) -> None:
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        return self.file.write(data)  # type: ignore
+
+    def flush(self) -> None:
+        self.file.flush()  # type: ignore
+
+
+def zip_and_hash_file(file_path: str, compresslevel: int = 6) -> tuple[str, str]:
+    """Generates zipped version of a file and its hashsum in a single pass
+    The file is streamed in chunks through the deflate compressor, the
+    compressed data is hashed while it is written.
     Args:
         file_path (str): path to the file to be zipped
+        compresslevel (int): deflate compression level (0-9)
     Returns:
-        str: path to the zipped file
+        tuple[str, str]: path to the zipped file and sha256 hashsum of the zipped file
+    Raises:
+        FileNotFoundError: if file_path is not a file
     """
-    assert os.path.isfile(file_path)
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
     zip_file_name = file_path + '.zip'
-    with zipfile.ZipFile(zip_file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Get the base name of the file (no directory structure)
-        file_name_in_zip = os.path.basename(file_path)
-        # Add the file to the zip, with no folder structure
-        zipf.write(file_path, arcname=file_name_in_zip)
-    return zip_file_name
+    with open(zip_file_name, 'wb') as f:
+        writer = _HashingWriter(f)
+        with zipfile.ZipFile(writer,  # type: ignore
+                             'w',
+                             zipfile.ZIP_DEFLATED,
+                             compresslevel=compresslevel) as zipf:
+            # Add the file to the zip, with no folder structure
+            zipf.write(file_path, arcname=os.path.basename(file_path))
+    return zip_file_name, writer.sha256.hexdigest()
+
+
+def _try_zip_and_hash_file(file_path: str,
+                           compresslevel: int) -> Optional[tuple[str, str]]:
+    # a file that cannot be zipped must not abort the other files
+    try:
+        return zip_and_hash_file(file_path, compresslevel)
+    except OSError as e:
+        logging.error(f"Zipping {file_path} failed: {e}")
+        return None
+
+
+def package_files(file_paths: list[str],
+                  compresslevel: int = 6,
+                  workers: Optional[int] = None) -> list[Optional[tuple[str, str]]]:
+    """Zip and hash several files in parallel worker processes (see zip_and_hash_file)
+    Args:
+        file_paths (list[str]): paths to the files to be zipped
+        compresslevel (int): deflate compression level (0-9)
+        workers (int): number of processes, default: number of CPUs
+    Returns:
+        list[Optional[tuple[str, str]]]: path to the zipped file and hashsum, in the order
+            of file_paths. None for files that could not be zipped (e.g. removed since).
+    """
+    workers = min(workers or os.cpu_count() or 1, len(file_paths))
+    if workers <= 1:
+        return [_try_zip_and_hash_file(path, compresslevel) for path in file_paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(_try_zip_and_hash_file, file_paths,
+                         [compresslevel] * len(file_paths)))
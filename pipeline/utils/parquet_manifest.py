@@ -0,0 +1,129 @@
+import os
+import json
+import pyarrow.parquet as pq  # type: ignore
+from datetime import datetime, timezone
+from typing import Optional
+
+# Manifests are stored next to the parquet file: <file>.parquet.manifest.json
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _to_iso(value: Optional[datetime]) -> Optional[str]:
+    value = _to_naive_utc(value)
+    return value.isoformat() if value is not None else None
+
+
+def build_manifest(file_path: str, time_column: str = "datetime") -> dict:
+    """
+    Read the parquet footer of a file and collect row counts and min/max
+    timestamps of the whole file and of each row group.
+    Row groups without statistics are stored with null min/max.
+    """
+    metadata = pq.ParquetFile(file_path).metadata
+    column_names = [
+        metadata.schema.column(i).path
+        for i in range(metadata.num_columns)
+    ]
+    column_index = column_names.index(
+        time_column) if time_column in column_names else None
+
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        dt_min, dt_max = None, None
+        if column_index is not None:
+            statistics = row_group.column(column_index).statistics
+            if statistics is not None and statistics.has_min_max:
+                dt_min, dt_max = statistics.min, statistics.max
+        row_groups.append({
+            "num_rows": row_group.num_rows,
+            "datetime_min": _to_iso(dt_min),
+            "datetime_max": _to_iso(dt_max)
+        })
+
+    row_group_min = [rg["datetime_min"] for rg in row_groups]
+    row_group_max = [rg["datetime_max"] for rg in row_groups]
+    has_statistics = len(row_groups) > 0 and None not in row_group_min + row_group_max
+
+    stat = os.stat(file_path)
+    return {
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "num_rows": metadata.num_rows,
+        "datetime_min": min(row_group_min) if has_statistics else None,
+        "datetime_max": max(row_group_max) if has_statistics else None,
+        "row_groups": row_groups
+    }
+
+
+def write_manifest(file_path: str, time_column: str = "datetime") -> dict:
+    """Build the manifest of a parquet file and store it next to the file."""
+    manifest = build_manifest(file_path, time_column)
+    with open(file_path + MANIFEST_SUFFIX, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(file_path: str, time_column: str = "datetime") -> dict:
+    """
+    Load the stored manifest of a parquet file. Falls back to reading the
+    parquet footer if no manifest exists or the file changed since it was written
+    (e.g. ThingsBoard downloads, which are not written by the pipeline).
+    """
+    manifest_path = file_path + MANIFEST_SUFFIX
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        stat = os.stat(file_path)
+        if manifest["file_size"] == stat.st_size and manifest[
+                "file_mtime_ns"] == stat.st_mtime_ns:
+            return manifest
+
+    return build_manifest(file_path, time_column)
+
+
+def _overlaps(entry: dict, start: Optional[datetime],
+              end: Optional[datetime]) -> bool:
+    if entry["datetime_min"] is None or entry["datetime_max"] is None:
+        return True
+    if start is not None and datetime.fromisoformat(
+            entry["datetime_max"]) < start:
+        return False
+    if end is not None and datetime.fromisoformat(entry["datetime_min"]) > end:
+        return False
+    return True
+
+
+def overlapping_row_range(manifest: dict, start: Optional[datetime],
+                          end: Optional[datetime]) -> Optional[tuple[int, int]]:
+    """
+    Return (offset, length) of the row range spanning all row groups that
+    overlap [start, end], or None if no row group overlaps.
+    Timezone aware bounds are compared in UTC.
+    """
+    start, end = _to_naive_utc(start), _to_naive_utc(end)
+
+    if not _overlaps(manifest, start, end):
+        return None
+
+    offset = 0
+    first_row, last_row = None, None
+    for row_group in manifest["row_groups"]:
+        if _overlaps(row_group, start, end):
+            if first_row is None:
+                first_row = offset
+            last_row = offset + row_group["num_rows"]
+        offset += row_group["num_rows"]
+
+    if first_row is None or last_row is None:
+        return None
+
+    return first_row, last_row - first_row
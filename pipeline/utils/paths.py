@@ -1,36 +1,28 @@
 import os
-from utils.config_files import load_json_config
-
-config = load_json_config("config.json")
+from utils.context import get_context
+
+# The data paths are resolved from the pipeline context on access, i.e. importing
+# this module does not read config.json and utils.context.configure can change them.
+# Use them as paths.X, "from utils.paths import X" keeps the value at import time:
+#   PICARRO_DATA_DIRECTORY, THINGSBOARD_DATA_DIRECTORY (config.json)
+#   DATA_DIRECTORY, AVERAGED_GASES, PROCESSED_PICARRO_DATA_DIRECTORY,
+#   PIPELINE_DATA_DIRECTORY, POSTPROCESSED_DATA_DIRECTORY, DESPIKED_DATA_DIRECTORY,
+#   ICOS_CITIES_LEVEL_1, ICOS_CITIES_LEVEL_2
+CONTEXT_PATHS = {
+    "PICARRO_DATA_DIRECTORY", "THINGSBOARD_DATA_DIRECTORY", "DATA_DIRECTORY",
+    "AVERAGED_GASES", "PROCESSED_PICARRO_DATA_DIRECTORY",
+    "PIPELINE_DATA_DIRECTORY", "POSTPROCESSED_DATA_DIRECTORY",
+    "DESPIKED_DATA_DIRECTORY", "ICOS_CITIES_LEVEL_1", "ICOS_CITIES_LEVEL_2"
+}
 
 PROJECT_DIR = os.path.dirname(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Input Data Directories
-PICARRO_DATA_DIRECTORY = config["measurement_data_paths"]["picarro"]
-
-THINGSBOARD_DATA_DIRECTORY = config["measurement_data_paths"]["thingsboard"]
-
-# Project Data Directories
-DATA_DIRECTORY = os.path.join(PROJECT_DIR, "data")
-
-AVERAGED_GASES = os.path.join(DATA_DIRECTORY, "input", "averaged_gases.csv")
-
-PROCESSED_PICARRO_DATA_DIRECTORY = os.path.join(DATA_DIRECTORY, "input",
-                                                "picarro")
-
-PIPELINE_DATA_DIRECTORY = os.path.join(DATA_DIRECTORY, "output", "pipeline")
-
 LOG_DIRECTORY = os.path.join(PROJECT_DIR, "pipeline", "logs")
 CONFIG_DIRECTORY = os.path.join(PROJECT_DIR, "pipeline", "config")
 
-POSTPROCESSED_DATA_DIRECTORY = os.path.join(PIPELINE_DATA_DIRECTORY,
-                                            "postprocessed")
-
-DESPIKED_DATA_DIRECTORY = os.path.join(PIPELINE_DATA_DIRECTORY, "despiked")
-
-ICOS_CITIES_LEVEL_1 = os.path.join(PIPELINE_DATA_DIRECTORY,
-                                   "icos_cities_portal", "level_1")
 
-ICOS_CITIES_LEVEL_2 = os.path.join(PIPELINE_DATA_DIRECTORY,
-                                   "icos_cities_portal", "level_2")
+def __getattr__(name: str) -> str:
+    if name not in CONTEXT_PATHS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(get_context(), name.lower())
@@ -0,0 +1,368 @@
+import polars as pl
+import gc
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from .import_data import import_acropolis_system_data, system_data_paths
+from .filter_system_data import extract_system_data, extract_enrichment_data, extract_measurement_data
+from .dilution_correction import wet_to_dry_mole_fraction
+from .calibration_processing import calculate_calibration_parameters, apply_calibration_parameters
+from .dataframe_operations import join_slice, aggregate_1min, aggregate_1h
+from .write_parquet import write_split_years, parquet_options, month_start
+from .metrics import measure
+from .watermarks import load_watermark, save_watermark
+from .stage_fingerprints import fingerprint_values, postprocessing_inputs, postprocessing_settings
+
+# Tolerance of the calibration join in apply_calibration_parameters
+CALIBRATION_JOIN_TOLERANCE = timedelta(minutes=10)
+# Largest tolerance of the join_slice asof joins (edge calibration data)
+MAX_JOIN_TOLERANCE = timedelta(days=1)
+
+
+def incremental_cutoff(
+        window_start: datetime,
+        df_calibration_parameters: pl.DataFrame) -> Optional[datetime]:
+    """
+    First timestamp from which a result computed on data starting at window_start
+    is identical to a full history run:
+    - the calibration interpolation and forward fill depend on the previous calibration,
+      so rows are only exact after the first calibration in the window (+ join tolerance)
+    - the asof joins look back up to MAX_JOIN_TOLERANCE
+    Returns None if the window contains no calibration.
+    """
+    # 1 point parameters exist for every calibration, slope and intercept only for valid ones
+    first_calibration = df_calibration_parameters.filter(
+        pl.col("slope").is_not_null())["datetime"].min()
+    if first_calibration is None:
+        return None
+
+    return max(
+        first_calibration + CALIBRATION_JOIN_TOLERANCE,  # type: ignore
+        window_start + MAX_JOIN_TOLERANCE)
+
+
+def merge_with_existing(df: pl.DataFrame, years: list[int],
+                        target_directory: str, id: int, prefix: str,
+                        cutoff: datetime,
+                        hive_partitioning: bool) -> pl.DataFrame:
+    """
+    Replace all rows from cutoff onwards in the existing output by the rows in df.
+    Returns the complete data of all years >= cutoff (all months from the month
+    of cutoff on with hive_partitioning), which are rewritten afterwards with
+    write_split_years(..., since=cutoff).
+    """
+    years = [year for year in years if year >= cutoff.year]
+
+    if not hive_partitioning and len(
+            system_data_paths(years, target_directory, id, prefix)) == 0:
+        return df.filter(pl.col("datetime") >= cutoff)
+
+    start = month_start(cutoff) if hive_partitioning else datetime(
+        cutoff.year, 1, 1)
+    df_existing = import_acropolis_system_data(
+        years=years,
+        target_directory=target_directory,
+        id=id,
+        prefix=prefix,
+        hive_partitioning=hive_partitioning,
+        start=start,
+        end=cutoff) \
+        .filter(pl.col("datetime").is_between(start, cutoff, closed="left")) \
+        .collect()
+
+    return pl.concat([df_existing, df.filter(pl.col("datetime") >= cutoff)],
+                     how="diagonal_relaxed").sort("datetime")
+
+
+def calibrate_measurement_data(df: pl.DataFrame, df_wind: pl.DataFrame,
+                               df_aux: pl.DataFrame, df_edge_cal: pl.DataFrame,
+                               df_calibration_parameters: pl.DataFrame,
+                               id: int, run_one_point: bool) -> pl.DataFrame:
+    """
+    Dilution and calibration correction of the 1min measurement data of a
+    system, joined with the wind, auxiliary and edge calibration data.
+    """
+    with measure("wet_to_dry_mole_fraction", rows_in=len(df),
+                 system_id=id) as m:
+        df = df.pipe(wet_to_dry_mole_fraction)
+        m["rows_out"] = len(df)
+
+    with measure("apply_calibration", rows_in=len(df), system_id=id) as m:
+        df = df.pipe(apply_calibration_parameters, df_calibration_parameters,
+                     run_one_point)
+        m["rows_out"] = len(df)
+
+    with measure("asof_joins", rows_in=len(df), system_id=id) as m:
+        df = df.pipe(join_slice, df_wind, "2m") \
+            .pipe(join_slice, df_aux, "2m") \
+            .pipe(join_slice, df_edge_cal, "1d") \
+            .drop("^.*_right$") \
+            .sort("datetime")
+        m["rows_out"] = len(df)
+
+    return df
+
+
+def postprocess_system(id: int,
+                       config: dict,
+                       input_directory: str,
+                       output_directory: str,
+                       incremental: bool = False,
+                       hive_partitioning: bool = False) -> None:
+    """
+    Process the raw ThingsBoard data of one system and write the 1min, 1h and
+    calibration (Cal_1min) outputs.
+
+    After each run, a watermark (last processed timestamp and fingerprint of
+    the input files and settings, see stage_fingerprints) is stored per system.
+    In incremental mode, systems with unchanged input are skipped. Systems with
+    changed settings are processed completely. Otherwise only the raw data from
+    the watermark minus a lookback margin
+    (config["postprocessing"]["incremental_lookback_days"]) is processed and
+    merged into the existing outputs.
+    """
+    logging.info(f"Processing system with id: {id}")
+    years = config["postprocessing"]["input_years"]
+    run_one_point = config["postprocessing"]["add_1P_correction"]
+
+    fingerprint = postprocessing_inputs(config, id, input_directory)
+    settings = fingerprint_values(*postprocessing_settings(config))
+
+    window_start = None
+    if incremental:
+        watermark = load_watermark(output_directory, id, prefix="1min")
+        if watermark is not None and watermark["fingerprint"] == fingerprint:
+            logging.info(f"System {id}: input unchanged, skipping")
+            return
+        if watermark is not None and watermark.get("settings") != settings:
+            logging.info(
+                f"System {id}: settings changed, falling back to full run")
+        elif watermark is not None:
+            lookback = timedelta(
+                days=config["postprocessing"].get("incremental_lookback_days",
+                                                  3))
+            # start at midnight to keep daily calibrations and 1m/1h bins complete
+            window_start = datetime.combine(
+                (watermark["datetime"] - lookback).date(),
+                datetime.min.time())
+            logging.info(
+                f"System {id}: incremental run from {window_start} (watermark {watermark['datetime']})"
+            )
+
+    # Import system data
+    df_raw = import_acropolis_system_data(years=years,
+                                          target_directory=input_directory,
+                                          id=id,
+                                          start=window_start)
+    if window_start is not None:
+        df_raw = df_raw.filter(pl.col("datetime") >= pl.lit(window_start).cast(
+            df_raw.collect_schema()["datetime"]))
+
+    # Extract data and aggregate measurement data to 1 minute intervals (single pass over raw data)
+    with measure("import_extract", system_id=id) as m:
+        df, df_wind, df_aux, df_edge_cal, df_calibration = extract_system_data(
+            df_raw)
+        m["rows_out"] = len(df)
+
+    # Calculate slope, intercept and one-point offsets
+    with measure("calibration_parameters",
+                 rows_in=len(df_calibration),
+                 system_id=id) as m:
+        df_calibration_parameters = calculate_calibration_parameters(
+            df_calibration)
+        m["rows_out"] = len(df_calibration_parameters)
+
+    cutoff = None
+    if window_start is not None:
+        cutoff = incremental_cutoff(window_start, df_calibration_parameters)
+        if cutoff is None or len(df) == 0:
+            logging.info(
+                f"System {id}: no calibration since {window_start}, falling back to full run"
+            )
+            return postprocess_system(id=id,
+                                      config=config,
+                                      input_directory=input_directory,
+                                      output_directory=output_directory,
+                                      incremental=False,
+                                      hive_partitioning=hive_partitioning)
+
+    # Save cal data
+    if window_start is not None:
+        df_calibration = merge_with_existing(
+            df_calibration,
+            years=years,
+            target_directory=output_directory,
+            id=id,
+            prefix="Cal_1min",
+            cutoff=window_start,
+            hive_partitioning=hive_partitioning)
+
+    write_split_years(df=df_calibration,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="Cal_1min",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config),
+                      since=window_start)
+
+    del df_calibration
+    gc.collect()  # Explicitly run garbage collection
+
+    # Process measurement data
+    df = calibrate_measurement_data(df, df_wind, df_aux, df_edge_cal,
+                                    df_calibration_parameters, id,
+                                    run_one_point)
+
+    last_datetime = df["datetime"].max()
+
+    if cutoff is not None:
+        df = merge_with_existing(df,
+                                 years=years,
+                                 target_directory=output_directory,
+                                 id=id,
+                                 prefix="1min",
+                                 cutoff=cutoff,
+                                 hive_partitioning=hive_partitioning)
+
+    # Save data
+    logging.info(f"Writing 1m data to parquet. Length: {len(df)}")
+    write_split_years(df=df,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="1min",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config),
+                      since=cutoff)
+
+    # Aggregate to 1 hour intervals
+    with measure("aggregate_1h", rows_in=len(df), system_id=id) as m:
+        df_1h = aggregate_1h(df)
+        m["rows_out"] = len(df_1h)
+
+    # Save data
+    logging.info(f"Writing 1h data to parquet. Length: {len(df_1h)}")
+    write_split_years(df=df_1h,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="1h",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config),
+                      since=cutoff)
+
+    save_watermark(output_directory,
+                   id,
+                   prefix="1min",
+                   last_datetime=last_datetime,  # type: ignore
+                   fingerprint=fingerprint,
+                   settings=settings)
+
+    # Clear memory
+    del df, df_1h
+    gc.collect()  # Explicitly run garbage collection
+
+
+def postprocess_system_lazy(id: int,
+                            config: dict,
+                            input_directory: str,
+                            output_directory: str,
+                            hive_partitioning: bool = False) -> None:
+    """
+    Variant of postprocess_system with identical outputs that runs the
+    measurement data processing as one lazy query.
+
+    Only the small calibration, wind, auxilliary and edge calibration data are
+    collected first. The 1min aggregation, wet to dry conversion, calibration
+    and asof joins are then collected in a single query with the default
+    (in-memory) engine, which avoids the intermediate frames of the step by
+    step path. This is not out-of-core: the raw measurement columns and the
+    1min result are held in memory.
+    """
+    logging.info(f"Processing system with id (lazy): {id}")
+    years = config["postprocessing"]["input_years"]
+    run_one_point = config["postprocessing"]["add_1P_correction"]
+
+    fingerprint = postprocessing_inputs(config, id, input_directory)
+    settings = fingerprint_values(*postprocessing_settings(config))
+
+    # Import system data
+    df_raw = import_acropolis_system_data(years=years,
+                                          target_directory=input_directory,
+                                          id=id)
+
+    # Extract the (small) data needed to process the measurement data
+    with measure("import_extract_enrichment", system_id=id):
+        df_wind, df_aux, df_edge_cal, df_calibration = extract_enrichment_data(
+            df_raw)
+
+    # Calculate slope, intercept and one-point offsets
+    with measure("calibration_parameters",
+                 rows_in=len(df_calibration),
+                 system_id=id) as m:
+        df_calibration_parameters = calculate_calibration_parameters(
+            df_calibration)
+        m["rows_out"] = len(df_calibration_parameters)
+
+    # Save cal data
+    write_split_years(df=df_calibration,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="Cal_1min",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config))
+
+    del df_calibration
+    gc.collect()  # Explicitly run garbage collection
+
+    # Process measurement data in one lazy query
+    lf = extract_measurement_data(df_raw) \
+        .pipe(aggregate_1min) \
+        .pipe(wet_to_dry_mole_fraction) \
+        .pipe(apply_calibration_parameters, df_calibration_parameters, run_one_point) \
+        .pipe(join_slice, df_wind, "2m") \
+        .pipe(join_slice, df_aux, "2m") \
+        .pipe(join_slice, df_edge_cal, "1d") \
+        .drop("^.*_right$") \
+        .sort("datetime")
+
+    # no predicate pushdown into the raw parquet reader, see extract_system_data
+    with measure("collect_1min", system_id=id) as m:
+        df = lf.collect(predicate_pushdown=False)
+        m["rows_out"] = len(df)
+
+    last_datetime = df["datetime"].max()
+
+    # Save data
+    logging.info(f"Writing 1m data to parquet. Length: {len(df)}")
+    write_split_years(df=df,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="1min",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config))
+
+    # Aggregate to 1 hour intervals
+    with measure("aggregate_1h", rows_in=len(df), system_id=id) as m:
+        df_1h = aggregate_1h(df)
+        m["rows_out"] = len(df_1h)
+
+    # Save data
+    logging.info(f"Writing 1h data to parquet. Length: {len(df_1h)}")
+    write_split_years(df=df_1h,
+                      id=id,
+                      target_directory=output_directory,
+                      prefix="1h",
+                      hive_partitioning=hive_partitioning,
+                      options=parquet_options(config))
+
+    if last_datetime is not None:
+        save_watermark(output_directory,
+                       id,
+                       prefix="1min",
+                       last_datetime=last_datetime,  # type: ignore
+                       fingerprint=fingerprint,
+                       settings=settings)
+
+    # Clear memory
+    del df, df_1h
+    gc.collect()  # Explicitly run garbage collection
@@ -0,0 +1,74 @@
+import polars as pl
+import gc
+import logging
+from typing import Optional
+
+from .import_data import import_acropolis_site_data, system_data_size
+from .dataframe_operations import convert_to_1min_icos_cp_format
+from .icos_cp_csv_conversion import df_to_L1_1min_icos_csv, L1_1MIN
+from .csv_cache import write_icos_csv_cached
+from .metrics import measure
+from . import paths
+
+
+def site_data_size(site: str,
+                   deployment_times: dict,
+                   years: list[int],
+                   input_directory: str,
+                   hive_partitioning: bool = False) -> int:
+    """Total size in bytes of the despiked data of all sensors deployed at a site."""
+    return sum(
+        system_data_size(years=years,
+                         target_directory=input_directory,
+                         id=sensor["id"],
+                         prefix="flagged_L1_1_min",
+                         hive_partitioning=hive_partitioning)
+        for sensor in deployment_times[site]["sensors"])
+
+
+def export_site_L1_1min_csv(site: str,
+                            sites_meta: pl.DataFrame,
+                            deployment_times: dict,
+                            input_directory: str,
+                            hive_partitioning: bool = False,
+                            use_cache: bool = False,
+                            frames: Optional[dict[int, pl.DataFrame]] = None) -> None:
+    """
+    Concatenate the despiked data of all sensors deployed at a site and write the
+    L1 1min CSV file with ICOS CP header.
+
+    With use_cache, the rendered CSV body is cached per month and only months
+    with changed data are converted and rendered again (see write_icos_csv_cached).
+    frames: despiked data already in memory, see import_acropolis_site_data.
+    """
+    logging.info(f"Processing site: {site}")
+    with measure("import_site_data", site=site) as m:
+        df = import_acropolis_site_data(target_directory=input_directory,
+                                        deployment_times=deployment_times,
+                                        site_name=site,
+                                        hive_partitioning=hive_partitioning,
+                                        frames=frames)
+        m["rows_out"] = len(df)
+
+    if use_cache:
+        with measure("write_csv_cached", rows_in=len(df), site=site):
+            write_icos_csv_cached(df=df,
+                                  sites_meta=sites_meta,
+                                  site=site,
+                                  target_directory=paths.ICOS_CITIES_LEVEL_1,
+                                  product=L1_1MIN,
+                                  convert=convert_to_1min_icos_cp_format)
+    else:
+        # Convert DF to ICOS CP format
+        with measure("convert_icos_cp_format", rows_in=len(df),
+                     site=site) as m:
+            df = df.pipe(convert_to_1min_icos_cp_format)
+            m["rows_out"] = len(df)
+
+        # Write to CSV with ICOS CP Header
+        with measure("write_csv", rows_in=len(df), site=site):
+            df_to_L1_1min_icos_csv(df=df, sites_meta=sites_meta, site=site)
+
+    # Clear memory
+    del df
+    gc.collect()  # Explicitly run garbage collection
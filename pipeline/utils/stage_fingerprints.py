@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import polars as pl
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from .import_data import system_data_files
+from .os_functions import hash_file
+from .watermarks import fingerprint_files
+from .context import get_context
+
+# The fingerprints of all stages are stored in one file in the pipeline output directory
+STAGE_FINGERPRINTS_FILE_NAME = "stage_fingerprints.json"
+
+
+def fingerprint_values(*values: Any) -> str:
+    """Fingerprint JSON serialisable values (e.g. config sections), independent of the key order."""
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_stage_fingerprints(directory: str) -> dict:
+    """
+    Load the fingerprints of the last successful run of each unit (system or site) of a stage.
+
+    Returns:
+        dict "<stage>/<unit>" -> {"inputs", "outputs", "updated_at"}, empty if the
+        pipeline never ran with the orchestrator.
+    """
+    path = os.path.join(directory, STAGE_FINGERPRINTS_FILE_NAME)
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_stage_fingerprints(directory: str, fingerprints: dict) -> None:
+    path = os.path.join(directory, STAGE_FINGERPRINTS_FILE_NAME)
+
+    # write to a temporary file first to never leave a broken file behind
+    with open(path + ".tmp", "w") as f:
+        json.dump(fingerprints, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(fingerprints: dict, key: str, inputs: str,
+                  outputs: list[str], directory: str) -> bool:
+    """
+    A unit is up to date if its inputs are unchanged since its last run and its
+    output files (paths relative to directory) were not modified or removed since.
+    """
+    entry = fingerprints.get(key)
+    return entry is not None and entry["inputs"] == inputs and entry[
+        "outputs"] == fingerprint_files(outputs, directory)
+
+
+def record_stage(fingerprints: dict, key: str, inputs: str,
+                 outputs: list[str], directory: str) -> None:
+    fingerprints[key] = {
+        "inputs": inputs,
+        "outputs": fingerprint_files(outputs, directory),
+        "updated_at": datetime.now(timezone.utc).isoformat(timespec="seconds")
+    }
+
+
+def postprocessing_settings(config: dict) -> list:
+    """
+    Settings the postprocessing output depends on besides the raw data: the
+    "postprocessing" and "storage" config and the calibration gases (averaged_gases.csv).
+    """
+    section = {
+        key: value
+        for key, value in config["postprocessing"].items()
+        if key != "system_ids"
+    }
+    return [
+        section,
+        config.get("storage", {}),
+        hash_file(get_context().averaged_gases)
+    ]
+
+
+def postprocessing_inputs(config: dict, id: int, input_directory: str) -> str:
+    """Inputs of the postprocessing of a system: the raw ThingsBoard files and its settings."""
+    files = system_data_files(years=config["postprocessing"]["input_years"],
+                              target_directory=input_directory,
+                              id=id)
+    return fingerprint_values(fingerprint_files(files, input_directory),
+                              *postprocessing_settings(config))
+
+
+def despiking_settings(config: dict) -> list:
+    """
+    Settings the despiking output depends on besides the postprocessed data: the
+    "despiking" (without the parameter sweep) and "storage" config.
+    """
+    section = {
+        key: value
+        for key, value in config["despiking"].items()
+        if key not in ("system_ids", "sweep")
+    }
+    return [section, config.get("storage", {})]
+
+
+def despiking_inputs(config: dict,
+                     id: int,
+                     input_directory: str,
+                     hive_partitioning: bool = False) -> str:
+    """Inputs of the despiking of a system: its postprocessed 1min files and its settings."""
+    files = system_data_files(years=config["despiking"]["input_years"],
+                              target_directory=input_directory,
+                              id=id,
+                              prefix="1min",
+                              hive_partitioning=hive_partitioning)
+    return fingerprint_values(fingerprint_files(files, input_directory),
+                              *despiking_settings(config))
+
+
+def site_export_inputs(config: dict,
+                       site: str,
+                       sites_meta: pl.DataFrame,
+                       deployment_times: dict,
+                       input_directory: str,
+                       prefix: str,
+                       hive_partitioning: bool = False,
+                       current_date: Optional[str] = None) -> str:
+    """
+    Inputs of the CSV export of a site: the despiked files of all sensors
+    deployed at the site, their deployment times, the site metadata (sites.csv)
+    and the input years.
+
+    Deployments ending at current_date (i.e. still running) are fingerprinted as
+    open ended, otherwise the fingerprint would change on every run.
+    """
+    sensors = [{
+        **sensor, "end_time":
+        None if sensor["end_time"] == current_date else sensor["end_time"]
+    } for sensor in deployment_times[site]["sensors"]]
+
+    files = []
+    for sensor in sensors:
+        files += system_data_files(
+            years=config["icos_cities_portal"]["input_years"],
+            target_directory=input_directory,
+            id=sensor["id"],
+            prefix=prefix,
+            hive_partitioning=hive_partitioning)
+
+    return fingerprint_values(
+        fingerprint_files(files, input_directory), sensors,
+        sites_meta.filter(pl.col("site") == site[:4]).to_dicts(),
+        config["icos_cities_portal"]["input_years"])
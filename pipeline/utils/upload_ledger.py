@@ -0,0 +1,81 @@
+import os
+import json
+from datetime import datetime, timezone
+
+from .icos_cp_http_upload import UploadResult
+from .os_functions import hash_file
+
+# The ledger is stored next to the uploaded files
+LEDGER_FILE_NAME = "upload_ledger.json"
+
+
+def load_ledger(directory: str) -> dict:
+    """
+    Load the ledger of the last successful upload per file.
+
+    Returns:
+        dict file name -> {"sha256", "size", "mtime_ns", "hash_sum", "object_url", "uploaded_at"},
+        empty if nothing was uploaded yet.
+    """
+    path = os.path.join(directory, LEDGER_FILE_NAME)
+    if not os.path.isfile(path):
+        return {}
+
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_ledger(directory: str, ledger: dict) -> None:
+    path = os.path.join(directory, LEDGER_FILE_NAME)
+
+    # write to a temporary file first to never leave a broken ledger behind
+    with open(path + ".tmp", "w") as f:
+        json.dump(ledger, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def pending_uploads(paths: list[str], ledger: dict) -> dict[str, dict]:
+    """
+    Files whose content differs from their last successful upload.
+
+    Files with the size and modification time of the last upload are skipped
+    without reading them, all others are compared by sha256 (e.g. files rewritten
+    with identical content). The modification time of unchanged files is
+    updated in the ledger.
+
+    Returns:
+        dict path -> {"sha256", "size", "mtime_ns"} of the files to upload
+    """
+    pending = {}
+    for path in paths:
+        entry = ledger.get(os.path.basename(path))
+        stat = os.stat(path)
+        if entry is not None and entry["size"] == stat.st_size and entry[
+                "mtime_ns"] == stat.st_mtime_ns:
+            continue
+
+        sha256 = hash_file(path)
+        if entry is not None and entry["sha256"] == sha256:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            continue
+        pending[path] = {
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns
+        }
+
+    return pending
+
+
+def record_upload(ledger: dict, path: str, file_state: dict,
+                  result: UploadResult) -> None:
+    """
+    Store a successful upload of path in the ledger. file_state is the entry
+    of pending_uploads, i.e. the state of the file before it was zipped.
+    """
+    ledger[os.path.basename(path)] = {
+        **file_state,
+        "hash_sum": result.hash_sum,
+        "object_url": result.object_url,
+        "uploaded_at": datetime.now(timezone.utc).isoformat()
+    }
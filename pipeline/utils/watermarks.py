@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from .os_functions import ensure_data_dir
+
+# Watermarks are stored in <output directory>/watermarks/<prefix>_acropolis-<id>.json
+WATERMARK_DIRECTORY_NAME = "watermarks"
+
+
+def fingerprint_files(paths: list[str], root: str) -> str:
+    """
+    Fingerprint a list of files by path (relative to root), size and modification time.
+    Avoids reading the (large) files, any rewrite or append changes the fingerprint.
+    The relative path distinguishes hive partitions, whose files are all named
+    data.parquet.
+    """
+    sha256 = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        sha256.update(
+            f"{os.path.relpath(path, root)}:{stat.st_size}:{stat.st_mtime_ns};".
+            encode())
+    return sha256.hexdigest()
+
+
+def _watermark_path(target_directory: str, id: int, prefix: str) -> str:
+    return os.path.join(target_directory, WATERMARK_DIRECTORY_NAME,
+                        f"{prefix}_acropolis-{id}.json")
+
+
+def load_watermark(target_directory: str, id: int,
+                   prefix: str) -> Optional[dict]:
+    """
+    Load the watermark of a system.
+
+    Returns:
+        dict with "datetime" (last processed timestamp), "fingerprint" (of the
+        input files and settings) and "settings" (fingerprint of the settings
+        alone, see stage_fingerprints), or None if the system was never processed.
+    """
+    path = _watermark_path(target_directory, id, prefix)
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "r") as f:
+        watermark = json.load(f)
+    watermark["datetime"] = datetime.fromisoformat(watermark["datetime"])
+    return watermark
+
+
+def save_watermark(target_directory: str, id: int, prefix: str,
+                   last_datetime: datetime, fingerprint: str,
+                   settings: Optional[str] = None) -> None:
+    ensure_data_dir(os.path.join(target_directory, WATERMARK_DIRECTORY_NAME))
+    path = _watermark_path(target_directory, id, prefix)
+
+    # write to a temporary file first to never leave a broken watermark behind
+    with open(path + ".tmp", "w") as f:
+        json.dump(
+            {
+                "datetime": last_datetime.isoformat(),
+                "fingerprint": fingerprint,
+                "settings": settings
+            },
+            f,
+            indent=2)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,112 @@
+import os
+import gc
+import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable
+
+
+def _init_worker(log_queue: Any) -> None:
+    # forward all log records of the worker to the parent process
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+# Task arguments identifying a system, batch of systems or site. Tasks also carry
+# the config (including portal credentials) and data, which are kept out of the log.
+TASK_LABEL_KEYS = ["id", "ids", "site"]
+
+
+def task_label(task: dict) -> str:
+    return ", ".join(f"{key}={task[key]}" for key in TASK_LABEL_KEYS
+                     if key in task)
+
+
+def balanced_batches(items: list, costs: list[int],
+                     batches: int) -> tuple[list[list], list[int]]:
+    """
+    Split items into at most batches groups with similar total costs
+    (largest first into the cheapest group). Returns the groups and their costs.
+    """
+    assert len(items) == len(costs)
+    groups: list[list] = [[] for _ in range(max(1, min(batches, len(items))))]
+    totals = [0] * len(groups)
+    for i in sorted(range(len(items)), key=lambda i: costs[i], reverse=True):
+        cheapest = totals.index(min(totals))
+        groups[cheapest].append(items[i])
+        totals[cheapest] += costs[i]
+    return groups, totals
+
+
+def run_tasks(function: Callable[..., None],
+              tasks: list[dict],
+              costs: list[int],
+              workers: int = 1) -> None:
+    """
+    Run function(**task) for each task.
+
+    With workers > 1, the tasks run in a pool of worker processes:
+    - tasks are scheduled largest first according to costs (e.g. input file sizes)
+    - each worker is limited to cpu_count / workers Polars threads (POLARS_MAX_THREADS)
+    - log records of the workers are passed to the handlers of the parent process,
+      i.e. end up in the same dated log file
+
+    Raises:
+        RuntimeError: if any task failed (after all other tasks finished)
+    """
+    assert len(tasks) == len(costs)
+
+    if workers <= 1:
+        for task in tasks:
+            function(**task)
+            gc.collect()  # Explicitly run garbage collection
+        return
+
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    polars_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # spawned workers inherit the environment and initialise Polars with it
+    previous_threads = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(polars_threads)
+
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    log_queue = manager.Queue()
+    listener = logging.handlers.QueueListener(log_queue,
+                                              *logging.getLogger().handlers,
+                                              respect_handler_level=True)
+    listener.start()
+
+    logging.info(
+        f"Running {len(tasks)} tasks on {workers} workers with {polars_threads} Polars threads each"
+    )
+
+    failed = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(log_queue, )) as executor:
+            futures = {
+                executor.submit(function, **tasks[i]): i
+                for i in order
+            }
+            for future in as_completed(futures):
+                task = tasks[futures[future]]
+                try:
+                    future.result()
+                except Exception:
+                    logging.exception(f"Task failed: {task_label(task)}")
+                    failed.append(task)
+    finally:
+        listener.stop()
+        manager.shutdown()
+        if previous_threads is None:
+            del os.environ["POLARS_MAX_THREADS"]
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous_threads
+
+    if len(failed) > 0:
+        raise RuntimeError(f"{len(failed)} of {len(tasks)} tasks failed")
@@ -1,24 +1,220 @@
 import polars as pl
 import os
-from typing import Optional
+import glob
+import shutil
+import pyarrow.parquet as pq  # type: ignore
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, Optional
 
-from utils.filter_system_data import extract_years
 from utils.os_functions import ensure_data_dir
+from utils.parquet_manifest import write_manifest
+from utils.metrics import measure
+
+# Files are sorted by and declare their sort order on this column
+SORT_COLUMN = "datetime"
+
+
+def parquet_options(config: dict) -> dict:
+    """
+    Parquet writer settings from the "storage" section of the config:
+    "compression" (default: "zstd"), "compression_level" (default: codec
+    default) and "row_group_size" (default: 100000 rows).
+    """
+    storage = config.get("storage", {})
+    return {
+        "compression": storage.get("compression", "zstd"),
+        "compression_level": storage.get("compression_level"),
+        "row_group_size": storage.get("row_group_size", 100_000)
+    }
+
+
+@contextmanager
+def atomic_file(file_path: str) -> Iterator[str]:
+    """
+    Yield a temporary path next to file_path and move it to file_path when the
+    block succeeds. Readers never see a half-written file; the temporary file
+    is removed if the block fails.
+    """
+    tmp_path = file_path + ".tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextmanager
+def atomic_directory(path: str, tmp_path: str) -> Iterator[str]:
+    """
+    Yield the empty directory tmp_path and swap it with path when the block
+    succeeds. The existing directory is moved aside and removed after the
+    swap, so readers see either the old or the new directory. tmp_path must be
+    on the same file system and outside of any scanned dataset.
+    """
+    old_path = tmp_path + ".old"
+    for leftover in (tmp_path, old_path):
+        shutil.rmtree(leftover, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        yield tmp_path
+        if os.path.isdir(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_sorted_parquet(df: pl.DataFrame,
+                         file_path: str,
+                         options: Optional[dict] = None) -> None:
+    """
+    Atomically write df sorted by datetime, with column statistics and the
+    sort order recorded in the row group metadata (sorting_columns), and
+    update the manifest of the file.
+    """
+    options = options or {}
+    # dictionary encoding of the (high cardinality) float columns is slow and
+    # rarely pays off, only encode text columns as the Polars writer does
+    pyarrow_options: dict = {
+        "use_dictionary": [
+            name for name, dtype in df.schema.items()
+            if dtype in (pl.String, pl.Categorical)
+        ]
+    }
+    if SORT_COLUMN in df.columns:
+        df = df.sort(SORT_COLUMN, maintain_order=True)
+        pyarrow_options["sorting_columns"] = [
+            pq.SortingColumn(df.columns.index(SORT_COLUMN), nulls_first=True)
+        ]
+
+    with atomic_file(file_path) as tmp_path:
+        df.write_parquet(tmp_path,
+                         compression=options.get("compression", "zstd"),
+                         compression_level=options.get("compression_level"),
+                         statistics=True,
+                         row_group_size=options.get("row_group_size",
+                                                    100_000),
+                         use_pyarrow=True,
+                         pyarrow_options=pyarrow_options)
+    write_manifest(file_path)
 
 
 def write_split_years(df: pl.DataFrame,
                       target_directory: str,
                       id: int,
-                      prefix: Optional[str] = None) -> None:
-    for year in extract_years(df):
-        data_path = os.path.join(target_directory, str(year))
+                      prefix: Optional[str] = None,
+                      hive_partitioning: bool = False,
+                      options: Optional[dict] = None,
+                      since: Optional[datetime] = None) -> None:
+    """
+    Write system data to one parquet file per year:
+    <target_directory>/<year>/<prefix>_acropolis-<id>.parquet
+
+    The data is split with a single partition_by pass, each file is written
+    with write_sorted_parquet. options: see parquet_options. since: start of an
+    incremental merge, see write_hive_partitions (whole years are rewritten in
+    the yearly layout).
+    """
+    with measure("write_parquet",
+                 rows_in=len(df),
+                 system_id=id,
+                 output=prefix or "acropolis"):
+        if hive_partitioning:
+            write_hive_partitions(df=df,
+                                  target_directory=target_directory,
+                                  id=id,
+                                  prefix=prefix,
+                                  options=options,
+                                  since=since)
+            return
+
+        partitions = df.with_columns(pl.col("datetime").dt.year().alias("__year")) \
+            .partition_by("__year", as_dict=True, include_key=False)
+
+        for (year, ), df_year in partitions.items():
+            data_path = os.path.join(target_directory, str(year))
+            ensure_data_dir(data_path)
+
+            if prefix is not None:
+                file_path = os.path.join(data_path,
+                                         f"{prefix}_acropolis-{id}.parquet")
+            else:
+                file_path = os.path.join(data_path, f"acropolis-{id}.parquet")
+
+            write_sorted_parquet(df_year, file_path, options)
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def write_hive_partitions(df: pl.DataFrame,
+                          target_directory: str,
+                          id: int,
+                          prefix: Optional[str] = None,
+                          options: Optional[dict] = None,
+                          since: Optional[datetime] = None) -> None:
+    """
+    Write system data to a hive partitioned dataset:
+    <target_directory>/<prefix>/system_id=<id>/year=<year>/month=<month>/data.parquet
+
+    The partition keys are encoded in the directory names and therefore dropped
+    from the files.
+
+    By default, df holds the complete data of its years. Each year is written
+    to a staging directory (.<prefix>_system_id=<id>_year=<year>.tmp in
+    target_directory) that replaces the existing year directory, so months
+    without data in df are removed.
+
+    With since (incremental merge), df holds all data from the month of since
+    on. Only these months are rewritten, months from the month of since on
+    without data in df are removed, earlier months are not touched.
+    """
+    dataset = prefix or "acropolis"
+    system_path = os.path.join(target_directory, dataset, f"system_id={id}")
+
+    partitions = df.with_columns(
+        pl.col("datetime").dt.year().alias("year"),
+        pl.col("datetime").dt.month().alias("month")) \
+        .partition_by(["year", "month"], as_dict=True)
+
+    def write_month(year_path: str, month: int, df_part: pl.DataFrame) -> None:
+        data_path = os.path.join(year_path, f"month={month}")
         ensure_data_dir(data_path)
 
-        if prefix is not None:
-            df.filter(pl.col("datetime").dt.year() == year).write_parquet(
-                os.path.join(data_path, f"{prefix}_acropolis-{id}.parquet"),
-                row_group_size=100_000)
-        else:
-            df.filter(pl.col("datetime").dt.year() == year).write_parquet(
-                os.path.join(data_path, f"acropolis-{id}.parquet"),
-                row_group_size=100_000)
+        file_path = os.path.join(data_path, "data.parquet")
+        write_sorted_parquet(
+            df_part.drop(["system_id", "year", "month"], strict=False),
+            file_path, options)
+
+    if since is None:
+        for year in df["datetime"].dt.year().unique().sort():
+            year_path = os.path.join(system_path, f"year={year}")
+            ensure_data_dir(system_path)
+            with atomic_directory(
+                    year_path,
+                    os.path.join(target_directory,
+                                 f".{dataset}_system_id={id}_year={year}.tmp")
+            ) as tmp_path:
+                for (part_year, month), df_part in partitions.items():
+                    if part_year == year:
+                        write_month(tmp_path, month, df_part)  # type: ignore
+        return
+
+    written = set()
+    for (year, month), df_part in partitions.items():
+        write_month(os.path.join(system_path, f"year={year}"), month,  # type: ignore
+                    df_part)
+        written.add((year, month))
+
+    # months of the merged range that no longer contain data
+    start = month_start(since)
+    for year_path in glob.glob(os.path.join(system_path, "year=*")):
+        year = int(os.path.basename(year_path).removeprefix("year="))
+        for month_path in glob.glob(os.path.join(year_path, "month=*")):
+            month = int(os.path.basename(month_path).removeprefix("month="))
+            if datetime(year, month, 1) >= start and (year, month) not in written:
+                shutil.rmtree(month_path)
@@ -0,0 +1,327 @@
+"""
+Synthetic ThingsBoard data for tests and benchmarks without the
+ThingsBoard-Downloader data:
+
+    python scripts/generate_thingsboard_data.py --output /tmp/thingsboard --ids 4 6 11 --days 30
+
+writes <output>/<year>/acropolis-<id>.parquet with the raw columns used by
+the pipeline:
+- measurement data (gmp343_*, sht45_*, bme280_*) every --interval seconds:
+  diurnal and synoptic CO2 variations, local spikes (--spikes per day) and
+  data gaps (--gap-rate)
+- wind (wxt532_*), enclosure (enclosure_*), Raspberry Pi (raspi_*) and UPS
+  (ups_*) data every --aux-every samples
+- a daily calibration (cal_*) with two bottles of averaged_gases.csv (low
+  bottle 90-119 samples, high bottle 55-67 samples, with settling transient)
+  followed by the edge calibration parameters. The calibration ends with the
+  high bottle, next to the ambient measurements the pipeline joins it to.
+
+Each system gets a random sensor gain and offset, so the calibration
+recovers them. The data is generated month by month, memory does not grow
+with the number of days.
+"""
+import os
+import argparse
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq  # type: ignore
+from datetime import date, datetime, timedelta
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AVERAGED_GASES = os.path.join(PROJECT_DIR, "data", "input",
+                              "averaged_gases.csv")
+
+DAY = 86_400  # seconds
+CHUNK_DAYS = 31
+
+# Calibration sequence: start (seconds after midnight), samples per bottle, flush samples
+CALIBRATION_START = 2 * 3600
+FIRST_BOTTLE_SAMPLES = (90, 120)
+SECOND_BOTTLE_SAMPLES = (55, 68)
+FLUSH_SAMPLES = 5
+
+
+class SystemModel:
+    """Random but fixed properties of one system (sensor bias, bottles, climate phases)."""
+
+    def __init__(self, id: int, seed: int, df_gas: pl.DataFrame) -> None:
+        rng = np.random.default_rng([seed, id])
+        self.id = id
+        self.seed = seed
+        self.gain = rng.uniform(0.97, 1.03)
+        self.offset = rng.normal(0, 8)
+        self.humidity_offset = rng.normal(0, 1)
+
+        high = df_gas.filter(pl.col("cal_bottle_CO2") > 600)
+        low = df_gas.filter(pl.col("cal_bottle_CO2") < 450)
+        self.high_bottle = high.row(int(rng.integers(len(high))))
+        self.low_bottle = low.row(int(rng.integers(len(low))))
+
+        # synoptic variations: periods of 2-10 days
+        self.periods = rng.uniform(2, 10, 3) * DAY
+        self.phases = rng.uniform(0, 2 * np.pi, 3)
+        self.co2_amplitudes = rng.uniform(3, 12, 3)
+
+    def synoptic(self, t: np.ndarray, amplitudes: np.ndarray) -> np.ndarray:
+        return sum(a * np.sin(2 * np.pi * t / p + phase)
+                   for a, p, phase in zip(amplitudes, self.periods,
+                                          self.phases))  # type: ignore
+
+
+def _saturation_vapor_pressure(temperature: np.ndarray) -> np.ndarray:
+    # Magnus formula, hPa
+    return 6.112 * np.exp(17.62 * temperature / (243.12 + temperature))
+
+
+def generate_chunk(model: SystemModel,
+                   start: datetime,
+                   days: int,
+                   interval: float = 10.0,
+                   aux_every: int = 6,
+                   spikes_per_day: float = 5.0,
+                   gap_rate: float = 0.1) -> pl.DataFrame:
+    """Raw ThingsBoard data of one system for days starting at start (midnight)."""
+    chunk_seed = int((start - datetime(2000, 1, 1)).days)
+    rng = np.random.default_rng([model.seed, model.id, chunk_seed])
+    samples_per_day = int(DAY / interval)
+    n = days * samples_per_day
+
+    # seconds since 2000-01-01, with timestamp jitter
+    t0 = (start - datetime(2000, 1, 1)).total_seconds()
+    t = t0 + np.arange(n) * interval + rng.uniform(0, interval / 4, n)
+    hour = (t % DAY) / 3600
+    day_of_year = (t / DAY) % 365.25
+
+    # ambient conditions
+    temperature = 10 - 10 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25) \
+        + 6 * np.sin(2 * np.pi * (hour - 9) / 24) \
+        + model.synoptic(t, np.full(3, 2.0)) + rng.normal(0, 0.2, n)
+    humidity = np.clip(
+        65 - 20 * np.sin(2 * np.pi * (hour - 9) / 24) +
+        model.synoptic(t, np.full(3, 5.0)) + rng.normal(0, 1, n), 15, 100)
+    pressure = 955 + model.synoptic(t, np.array([4.0, 2.0, 1.0])) + rng.normal(
+        0, 0.1, n)
+    enclosure_temperature = np.clip(temperature + 12, 10, 45)
+    sensor_temperature = enclosure_temperature + 3 + rng.normal(0, 0.1, n)
+
+    # CO2: diurnal cycle (maximum in the early morning), synoptic variations, local spikes
+    co2 = 425 + 15 * np.cos(2 * np.pi * (hour - 5) / 24) \
+        + model.synoptic(t, model.co2_amplitudes) + rng.normal(0, 1.5, n)
+    for _ in range(rng.poisson(spikes_per_day * days)):
+        i = int(rng.integers(n))
+        length = int(rng.integers(60, 600) / interval)
+        co2[i:i + length] += rng.uniform(20, 200)
+
+    # the sensor measures the (dry) ambient CO2 diluted by water vapor in the sensor head
+    sensor_humidity = np.clip(humidity + model.humidity_offset, 1, 100)
+    h2o = sensor_humidity / 100 * _saturation_vapor_pressure(
+        sensor_temperature) / pressure
+    measured = model.gain * co2 * (1 - h2o) + model.offset
+    edge_slope, edge_intercept = 1 / model.gain, -model.offset / model.gain
+
+    # ambient measurements, missing during the calibration
+    data: dict[str, np.ndarray] = {
+        "gmp343_raw": measured + rng.normal(0, 0.5, n),
+        "gmp343_compensated": measured,
+        "gmp343_filtered": measured,
+        "gmp343_edge_corrected": measured * edge_slope + edge_intercept,
+        "gmp343_edge_dry": (measured * edge_slope + edge_intercept) / (1 - h2o),
+        "gmp343_temperature": sensor_temperature,
+        "sht45_temperature": sensor_temperature - 0.5,
+        "sht45_humidity": sensor_humidity,
+        "bme280_temperature": sensor_temperature - 0.3,
+        "bme280_humidity": sensor_humidity - 2,
+        "bme280_pressure": pressure
+    }
+    measurement_columns = list(data)
+
+    # auxilliary data every aux_every samples
+    aux = np.zeros(n, dtype=bool)
+    aux[::aux_every] = True
+    direction = rng.uniform(1, 360, n)
+    speed = rng.gamma(2, 1.2, n)
+    aux_data = {
+        "wxt532_direction_min": np.clip(direction - 30, 1, 360),
+        "wxt532_direction_avg": direction,
+        "wxt532_direction_max": np.clip(direction + 30, 1, 360),
+        "wxt532_speed_min": speed * 0.5,
+        "wxt532_speed_avg": speed,
+        "wxt532_speed_max": speed * 1.8,
+        "wxt532_last_update_time": t,
+        "enclosure_bme280_temperature": enclosure_temperature,
+        "enclosure_bme280_humidity": np.clip(humidity - 30, 5, 100),
+        "enclosure_bme280_pressure": pressure + 0.5,
+        "raspi_cpu_frequency": np.full(n, 1500.0),
+        "raspi_cpu_usage": rng.uniform(0.02, 0.4, n),
+        "raspi_memory_usage": rng.uniform(0.2, 0.4, n),
+        "raspi_disk_usage": np.full(n, 0.3),
+        "raspi_cpu_temperature": enclosure_temperature + 15,
+        "ups_powered_by_grid": np.ones(n),
+        "ups_battery_is_fully_charged": np.ones(n),
+        "ups_battery_error_detected": np.zeros(n),
+        "ups_battery_above_voltage_threshold": np.ones(n)
+    }
+    for name, values in aux_data.items():
+        data[name] = np.where(aux, values, np.nan)
+
+    # daily calibration: low bottle, flush, high bottle, edge calibration parameters
+    cal = {
+        name: np.full(n, np.nan)
+        for name in [
+            "cal_bottle_id", "cal_gmp343_raw", "cal_gmp343_compensated",
+            "cal_gmp343_filtered", "cal_gmp343_temperature",
+            "cal_bme280_temperature", "cal_bme280_humidity",
+            "cal_bme280_pressure", "cal_sht45_temperature",
+            "cal_sht45_humidity", "cal_gmp343_slope", "cal_gmp343_intercept",
+            "cal_sht_45_offset"
+        ]
+    }
+    in_calibration = np.zeros(n, dtype=bool)
+    calibration_offset = int(CALIBRATION_START / interval)
+    for day in range(days):
+        first = day * samples_per_day + calibration_offset
+        n_first = int(rng.integers(*FIRST_BOTTLE_SAMPLES))
+        n_second = int(rng.integers(*SECOND_BOTTLE_SAMPLES))
+        last = first + n_first + FLUSH_SAMPLES + n_second
+        if last + 1 >= n:
+            break
+        in_calibration[first:last] = True
+
+        level = co2[first - 1]
+        for (bottle_id, bottle_co2), start_i, length in [
+            (model.low_bottle, first, n_first),
+            (model.high_bottle, first + n_first + FLUSH_SAMPLES, n_second)
+        ]:
+            part = slice(start_i, start_i + length)
+            # exponential settling from the previous gas to the bottle
+            settling = (level - bottle_co2) * np.exp(-np.arange(length) / 3)
+            cal["cal_bottle_id"][part] = bottle_id
+            cal["cal_gmp343_filtered"][part] = model.gain * (
+                bottle_co2 + settling) + model.offset + rng.normal(
+                    0, 0.5, length)
+            cal["cal_gmp343_raw"][part] = cal["cal_gmp343_filtered"][part]
+            cal["cal_gmp343_compensated"][part] = cal["cal_gmp343_filtered"][
+                part]
+            cal["cal_gmp343_temperature"][part] = sensor_temperature[part]
+            cal["cal_bme280_temperature"][part] = sensor_temperature[part]
+            cal["cal_sht45_temperature"][part] = sensor_temperature[part]
+            cal["cal_bme280_humidity"][part] = rng.uniform(0, 3, length)
+            cal["cal_sht45_humidity"][part] = rng.uniform(0, 3, length)
+            cal["cal_bme280_pressure"][part] = pressure[part]
+            level = bottle_co2
+
+        cal["cal_gmp343_slope"][last] = edge_slope
+        cal["cal_gmp343_intercept"][last] = edge_intercept
+        cal["cal_sht_45_offset"][last] = -model.humidity_offset
+
+    for name in measurement_columns:
+        data[name][in_calibration] = np.nan
+
+    df = pl.DataFrame({
+        "datetime": (np.datetime64("2000-01-01", "us") +
+                     (t * 1e6).astype("timedelta64[us]")),
+        "system_name": f"tum-esm-midcost-raspi-{model.id}",
+        **data,
+        **cal
+    }).fill_nan(None)
+
+    # data gaps (e.g. network outages) of 10-120 minutes
+    keep = np.ones(n, dtype=bool)
+    for day in range(days):
+        if rng.random() < gap_rate:
+            first = day * samples_per_day + int(rng.integers(samples_per_day))
+            keep[first:first + int(rng.integers(600, 7200) / interval)] = False
+    return df.filter(pl.Series(keep))
+
+
+def generate_thingsboard_data(output_directory: str,
+                              system_ids: list[int],
+                              days: int,
+                              start: date = date(2024, 12, 1),
+                              seed: int = 0,
+                              **kwargs: object) -> int:
+    """
+    Write days of synthetic raw data per system to
+    <output_directory>/<year>/acropolis-<id>.parquet. kwargs are passed to
+    generate_chunk. Returns the number of rows written.
+    """
+    df_gas = pl.read_csv(AVERAGED_GASES)
+    rows = 0
+    for id in system_ids:
+        model = SystemModel(id, seed, df_gas)
+        writers: dict = {}
+        try:
+            for chunk_start in range(0, days, CHUNK_DAYS):
+                chunk_days = min(CHUNK_DAYS, days - chunk_start)
+                df = generate_chunk(
+                    model,
+                    datetime.combine(start + timedelta(days=chunk_start),
+                                     datetime.min.time()), chunk_days,
+                    **kwargs)  # type: ignore
+                rows += len(df)
+                partitions = df.with_columns(pl.col("datetime").dt.year().alias("__year")) \
+                    .partition_by("__year", as_dict=True, include_key=False)
+                for (year, ), df_year in partitions.items():
+                    table = df_year.to_arrow()
+                    if year not in writers:
+                        directory = os.path.join(output_directory, str(year))
+                        os.makedirs(directory, exist_ok=True)
+                        writers[year] = pq.ParquetWriter(
+                            os.path.join(directory, f"acropolis-{id}.parquet"),
+                            table.schema,
+                            compression="zstd")
+                    writers[year].write_table(table)
+        finally:
+            for writer in writers.values():
+                writer.close()
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Write synthetic raw ThingsBoard data of ACROPOLIS systems."
+    )
+    parser.add_argument("--output", required=True, help="Output directory")
+    parser.add_argument("--ids",
+                        type=int,
+                        nargs="+",
+                        default=[1],
+                        help="System ids")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start",
+                        type=date.fromisoformat,
+                        default=date(2024, 12, 1),
+                        help="First day (YYYY-MM-DD)")
+    parser.add_argument("--interval",
+                        type=float,
+                        default=10.0,
+                        help="Seconds between measurements")
+    parser.add_argument("--aux-every",
+                        type=int,
+                        default=6,
+                        help="Auxilliary data every N measurements")
+    parser.add_argument("--spikes",
+                        type=float,
+                        default=5.0,
+                        help="Local CO2 spikes per day")
+    parser.add_argument("--gap-rate",
+                        type=float,
+                        default=0.1,
+                        help="Share of days with a data gap")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = generate_thingsboard_data(args.output,
+                                     args.ids,
+                                     args.days,
+                                     start=args.start,
+                                     seed=args.seed,
+                                     interval=args.interval,
+                                     aux_every=args.aux_every,
+                                     spikes_per_day=args.spikes,
+                                     gap_rate=args.gap_rate)
+    print(f"Wrote {rows} rows of {len(args.ids)} systems to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Local stand-in for the ICOS Cities portal upload endpoints, e.g. to test
+stage 04 without uploading to the portal:
+
+    python scripts/icos_cp_mock_server.py --port 8765
+
+and set in pipeline/config/config.json:
+
+    "icos_cities_portal": {
+        "login_url": "http://localhost:8765/password/login",
+        "upload_url": "http://localhost:8765/upload",
+        ...
+    }
+
+Endpoints:
+- POST /password/login: sets the authentication cookie
+- POST /upload: metadata registration (requires the cookie), returns the object URL
+- PUT /objects/<hashSum>: data upload, the sha256 of the data must match hashSum.
+  Either the whole file, or chunks with "Content-Range: bytes <first>-<last>/<size>"
+  answered with 308 and "Range: bytes=0-<last received>" until the file is
+  complete. "Content-Range: bytes */<size>" queries the received range.
+
+Faults can be injected to measure the throughput and recovery of the upload:
+--fail-rate (answer 503), --drop-rate (close the connection after half of the
+data of a PUT) and --bandwidth (limit the receive rate). The statistics are
+printed after each completed upload.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COOKIE = "cpauthToken=mock"
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class MockPortalHandler(BaseHTTPRequestHandler):
+    delay = 0.0  # seconds to wait before answering each request
+    fail_rate = 0.0  # share of requests answered with 503
+    drop_rate = 0.0  # share of PUTs with data dropped after half of the data
+    bandwidth = 0.0  # bytes per second, 0: unlimited
+
+    # received data per object, statistics
+    objects: dict[str, bytearray] = {}
+    stats = {
+        "requests": 0,
+        "injected_errors": 0,
+        "dropped_connections": 0,
+        "bytes_received": 0,
+        "completed_uploads": 0
+    }
+    lock = threading.Lock()
+    start_time = time.time()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self.lock:
+            self.stats[key] += value
+
+    def _reply(self,
+               status: int,
+               body: str = "",
+               headers: dict[str, str] = {}) -> None:
+        time.sleep(self.delay)
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self, limit: int = -1) -> bytes:
+        # read (at most limit bytes of) the body, throttled to the bandwidth
+        length = int(self.headers.get("Content-Length", 0))
+        if limit >= 0:
+            length = min(length, limit)
+        data = bytearray()
+        while len(data) < length:
+            block = self.rfile.read(min(READ_BLOCK_SIZE, length - len(data)))
+            if not block:
+                break
+            data += block
+            if self.bandwidth > 0:
+                time.sleep(len(block) / self.bandwidth)
+        self._count("bytes_received", len(data))
+        return bytes(data)
+
+    def _inject_error(self) -> bool:
+        self._count("requests")
+        if random.random() < self.fail_rate:
+            self._read_body()
+            self._count("injected_errors")
+            self._reply(503, "injected error")
+            return True
+        return False
+
+    def do_POST(self) -> None:
+        if self._inject_error():
+            return
+        body = self._read_body()
+        if self.path == "/password/login":
+            self._reply(200, "logged in",
+                        {"Set-Cookie": f"{COOKIE}; Path=/"})
+        elif self.path == "/upload":
+            if COOKIE not in self.headers.get("Cookie", ""):
+                self._reply(401, "not authenticated")
+                return
+            payload = json.loads(body)
+            if "hashSum" not in payload or "fileName" not in payload:
+                self._reply(400, "hashSum and fileName required")
+                return
+            host = self.headers.get("Host")
+            self._reply(200, f"http://{host}/objects/{payload['hashSum']}")
+        else:
+            self._reply(404, "not found")
+
+    def _range_headers(self, received: bytearray) -> dict[str, str]:
+        return {"Range": f"bytes=0-{len(received) - 1}"} if received else {}
+
+    def _complete(self, hash_sum: str, received: bytearray) -> None:
+        if hashlib.sha256(received).hexdigest() != hash_sum:
+            received.clear()
+            self._reply(400, "hash sum mismatch")
+            return
+        self._count("completed_uploads")
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            print(
+                f"{elapsed:.1f} s: {self.stats}, {self.stats['bytes_received'] / 1e6 / elapsed:.2f} MB/s",
+                flush=True)
+        self._reply(200, f"{len(received)} bytes received")
+
+    def do_PUT(self) -> None:
+        if self._inject_error():
+            return
+        if not self.path.startswith("/objects/"):
+            self._reply(404, "not found")
+            return
+        if COOKIE not in self.headers.get("Cookie", ""):
+            self._reply(401, "not authenticated")
+            return
+        hash_sum = self.path.split("/")[-1]
+        with self.lock:
+            received = self.objects.setdefault(hash_sum, bytearray())
+
+        content_range = self.headers.get("Content-Range")
+        if content_range is not None:
+            match = re.fullmatch(r"bytes (\*|(\d+)-(\d+))/(\d+)", content_range)
+            if match is None:
+                self._reply(400, "invalid Content-Range")
+                return
+            size = int(match.group(4))
+            if match.group(1) == "*" or int(match.group(2)) > len(received):
+                # status query or gap: report the received range
+                self._read_body()
+                if len(received) == size:
+                    self._complete(hash_sum, received)
+                else:
+                    self._reply(308, headers=self._range_headers(received))
+                return
+            first = int(match.group(2))
+        else:
+            size = int(self.headers.get("Content-Length", 0))
+            first = 0
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > 0 and random.random() < self.drop_rate:
+            # keep what arrived before the connection dropped
+            data = self._read_body(limit=length // 2)
+            received[first:] = data
+            self._count("dropped_connections")
+            self.close_connection = True
+            return
+
+        received[first:] = self._read_body()
+        if len(received) >= size:
+            self._complete(hash_sum, received)
+        else:
+            self._reply(308, headers=self._range_headers(received))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the ICOS Cities portal upload endpoints.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay",
+                        type=float,
+                        default=0.0,
+                        help="Seconds to wait before answering each request")
+    parser.add_argument("--fail-rate",
+                        type=float,
+                        default=0.0,
+                        help="Share of requests answered with 503")
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="Share of PUTs whose connection drops after half of the data")
+    parser.add_argument("--bandwidth",
+                        type=float,
+                        default=0.0,
+                        help="Receive rate limit per connection in MB/s")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    MockPortalHandler.delay = args.delay
+    MockPortalHandler.fail_rate = args.fail_rate
+    MockPortalHandler.drop_rate = args.drop_rate
+    MockPortalHandler.bandwidth = args.bandwidth * 1e6
+    server = ThreadingHTTPServer(("localhost", args.port), MockPortalHandler)
+    print(f"Mock ICOS CP portal listening on http://localhost:{args.port}",
+          flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(MockPortalHandler.stats)
+
+
+if __name__ == "__main__":
+    main()
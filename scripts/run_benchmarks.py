@@ -0,0 +1,255 @@
+"""
+Benchmark stages 01-03 and their hot functions on synthetic ThingsBoard
+data (see generate_thingsboard_data.py):
+
+    python scripts/run_benchmarks.py --systems 3 --days 60 --repeat 3
+
+The stages run with the settings of pipeline/config/config.json, but read and
+write in a temporary directory (--workdir), the pipeline outputs are not
+touched. The generated days must lie within the configured input_years.
+
+Each benchmark runs --repeat times. The best and median times are appended
+to data/output/benchmarks/benchmarks.jsonl (--results) together with the
+commit, Polars version and scale, and compared with the last run of the same
+scale.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import polars as pl
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+from generate_thingsboard_data import generate_thingsboard_data
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, "pipeline"))
+
+from utils.context import get_context  # noqa: E402
+from utils.import_data import import_acropolis_system_data, import_acropolis_site_data  # noqa: E402
+from utils.filter_system_data import extract_system_data  # noqa: E402
+from utils.dilution_correction import wet_to_dry_mole_fraction  # noqa: E402
+from utils.calibration_processing import calculate_calibration_parameters, apply_calibration_parameters  # noqa: E402
+from utils.hampel_filter import hampel_flags  # noqa: E402
+from utils.dataframe_operations import convert_to_1min_icos_cp_format  # noqa: E402
+from utils.icos_cp_csv_conversion import render_icos_csv_body, write_icos_csv, L1_1MIN  # noqa: E402
+from utils.postprocessing import postprocess_system  # noqa: E402
+from utils.despiking import despike_systems, DESPIKED_PREFIX  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(PROJECT_DIR, "data", "output", "benchmarks",
+                               "benchmarks.jsonl")
+DEPLOYMENT_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def timeit(function: Callable[[], Any], repeat: int) -> tuple[list[float], Any]:
+    """Wall times of repeat calls of function and the result of the last call."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              cwd=PROJECT_DIR,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workdir: str, system_ids: list[int], days: int,
+                   start: date, repeat: int) -> tuple[dict, int]:
+    """Generate the data and run all benchmarks. Returns the results and the number of raw rows."""
+    # the input years are changed below, keep the shared config unchanged
+    config = copy.deepcopy(get_context().config)
+    sites_meta = get_context().sites_meta
+
+    input_directory = os.path.join(workdir, "thingsboard")
+    postprocessed_directory = os.path.join(workdir, "postprocessed")
+    despiked_directory = os.path.join(workdir, "despiked")
+    level_1_directory = os.path.join(workdir, "level_1")
+    for directory in [postprocessed_directory, despiked_directory, level_1_directory]:
+        os.makedirs(directory, exist_ok=True)
+
+    end = start + timedelta(days=days)
+    years = list(range(start.year, end.year + 1))
+    config["postprocessing"]["input_years"] = years
+    config["despiking"]["input_years"] = years
+
+    # one site per system, deployed over the whole period
+    sites = sites_meta["site"].head(len(system_ids)).to_list()
+    deployment_times = {
+        site: {
+            "sensors": [{
+                "id": id,
+                "start_time": datetime.combine(start, datetime.min.time(), timezone.utc).strftime(DEPLOYMENT_FORMAT),
+                "end_time": datetime.combine(end, datetime.min.time(), timezone.utc).strftime(DEPLOYMENT_FORMAT)
+            }]
+        }
+        for site, id in zip(sites, system_ids)
+    }
+
+    results: dict[str, dict] = {}
+
+    def record(name: str, times: list[float], rows: Optional[int] = None) -> None:
+        results[name] = {
+            "min_s": round(min(times), 4),
+            "median_s": round(statistics.median(times), 4),
+            "rows": rows
+        }
+        print(f"{name:<32} {min(times):8.3f} s (median {statistics.median(times):.3f} s)", flush=True)
+
+    times, raw_rows = timeit(
+        lambda: generate_thingsboard_data(input_directory, system_ids, days, start=start), 1)
+    record("generate_data", times, raw_rows)
+
+    # Stages
+    def postprocess_systems() -> None:
+        for id in system_ids:
+            postprocess_system(id=id,
+                               config=config,
+                               input_directory=input_directory,
+                               output_directory=postprocessed_directory)
+
+    times, _ = timeit(postprocess_systems, repeat)
+    record("stage_01_postprocessing", times, raw_rows)
+
+    times, _ = timeit(
+        lambda: despike_systems(ids=system_ids,
+                                config=config,
+                                input_directory=postprocessed_directory,
+                                output_directory=despiked_directory), repeat)
+    record("stage_02_despiking", times)
+
+    def export_sites() -> None:
+        for site in sites:
+            df = import_acropolis_site_data(target_directory=despiked_directory,
+                                            deployment_times=deployment_times,
+                                            site_name=site)
+            write_icos_csv(df=convert_to_1min_icos_cp_format(df),
+                           sites_meta=sites_meta,
+                           site=site,
+                           target_directory=level_1_directory,
+                           product=L1_1MIN)
+
+    times, _ = timeit(export_sites, repeat)
+    record("stage_03_csv_export", times)
+
+    # Hot functions on the data of the first system
+    id = system_ids[0]
+    df_raw = import_acropolis_system_data(years=years, target_directory=input_directory, id=id)
+    times, (df, _, _, _, df_calibration) = timeit(lambda: extract_system_data(df_raw), repeat)
+    record("extract_system_data", times, len(df))
+
+    times, df_dry = timeit(lambda: wet_to_dry_mole_fraction(df), repeat)
+    record("wet_to_dry_mole_fraction", times, len(df))
+
+    times, df_parameters = timeit(lambda: calculate_calibration_parameters(df_calibration), repeat)
+    record("calculate_calibration_parameters", times, len(df_calibration))
+
+    one_point = config["postprocessing"]["add_1P_correction"]
+    times, _ = timeit(lambda: apply_calibration_parameters(df_dry, df_parameters, one_point), repeat)
+    record("apply_calibration_parameters", times, len(df_dry))
+
+    df_1min = import_acropolis_system_data(years=years,
+                                           target_directory=postprocessed_directory,
+                                           id=id,
+                                           prefix="1min").collect()
+    times, _ = timeit(
+        lambda: hampel_flags(df_1min.lazy(),
+                             column="gmp343_corrected",
+                             window=config["despiking"]["window_size"],
+                             n_sigma=config["despiking"]["n_sigma"]).collect(), repeat)
+    record("hampel_flags", times, len(df_1min))
+
+    df_icos = import_acropolis_system_data(years=years,
+                                           target_directory=despiked_directory,
+                                           id=id,
+                                           prefix=DESPIKED_PREFIX).collect() \
+        .pipe(convert_to_1min_icos_cp_format)
+    times, _ = timeit(lambda: render_icos_csv_body(df_icos, L1_1MIN), repeat)
+    record("render_icos_csv_body", times, len(df_icos))
+
+    return results, raw_rows
+
+
+def compare(entry: dict, results_path: str) -> None:
+    """Print the ratio of the best times to the last stored run of the same scale."""
+    previous = None
+    if os.path.isfile(results_path):
+        with open(results_path, "r") as f:
+            for line in f:
+                candidate = json.loads(line)
+                if candidate["scale"] == entry["scale"]:
+                    previous = candidate
+    if previous is None:
+        print("No previous run of the same scale")
+        return
+
+    print(f"Compared with {previous['timestamp']} (commit {previous['commit']}):")
+    for name, result in entry["results"].items():
+        if name in previous["results"]:
+            ratio = result["min_s"] / max(previous["results"][name]["min_s"], 1e-9)
+            print(f"{name:<32} {previous['results'][name]['min_s']:8.3f} s -> {result['min_s']:8.3f} s ({ratio:.2f}x)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic ThingsBoard data.")
+    parser.add_argument("--systems", type=int, default=2, help="Number of systems")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--start",
+                        type=date.fromisoformat,
+                        default=date(2024, 12, 1),
+                        help="First day (YYYY-MM-DD)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workdir",
+                        default=None,
+                        help="Directory for the data (default: temporary, removed afterwards)")
+    parser.add_argument("--results", default=DEFAULT_RESULTS)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="acropolis-benchmark-")
+    system_ids = list(range(1, args.systems + 1))
+    try:
+        results, raw_rows = run_benchmarks(workdir, system_ids, args.days,
+                                           args.start, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    entry = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "polars": pl.__version__,
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "scale": {"systems": args.systems, "days": args.days, "start": args.start.isoformat()},
+        "raw_rows": raw_rows,
+        "repeat": args.repeat,
+        "results": results
+    }
+    compare(entry, args.results)
+
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
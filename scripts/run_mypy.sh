@@ -13,7 +13,7 @@ cd "$SCRIPT_DIR/.." || exit 1
 echo "Removing old mypy cache..."
 rm -rf .mypy_cache
 
-export MYPYPATH="$PWD/pipeline"
+export MYPYPATH="$PWD/pipeline:$PWD/scripts"
 echo "MYPYPATH set to: $MYPYPATH"
 
 echo "Checking files in pipeline/ using mypy..."
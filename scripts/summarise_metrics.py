@@ -0,0 +1,114 @@
+"""
+Rank the hot spots of the pipeline from the step metrics written by
+utils/metrics.py (pipeline/logs/<YYYY-MM-DD>.metrics.jsonl):
+
+    python scripts/summarise_metrics.py --runs 5
+    python scripts/summarise_metrics.py --script 01_acropolis_postprocessing.py --per-label
+
+Steps are ranked by their total wall time over the selected runs. Columns:
+- share: share of the summed wall time of all steps
+- mean_s / max_s: wall time per call
+- last_run_s: wall time in the latest run, compare with mean_run_s to spot regressions
+- cpu_ratio: CPU time / wall time (> 1: multithreaded, < 1: waiting for I/O)
+- rows_per_s: input rows per second of wall time
+- peak_rss_mb: highest peak RSS of the process during the step (Linux only)
+
+The CPU time is measured for the whole process, not per thread. It includes
+the Polars threads of the step, but also everything else running at the same
+time, e.g. the background writer thread of the fused run (run_pipeline.py
+--fused) that writes the outputs of the previous system. The same holds for
+the peak RSS. For the steps of a fused run, cpu_ratio and peak_rss_mb are
+therefore upper bounds.
+"""
+import os
+import glob
+import json
+import argparse
+import polars as pl
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATTERN = os.path.join(PROJECT_DIR, "pipeline", "logs",
+                               "*.metrics.jsonl")
+
+# Labels identifying the system or site of a step
+LABELS = ["system_id", "site", "output"]
+
+
+def load_metrics(paths: list[str]) -> pl.DataFrame:
+    records = []
+    for path in paths:
+        with open(path, "r") as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    if len(records) == 0:
+        return pl.DataFrame()
+
+    df = pl.from_dicts(records, infer_schema_length=None)
+    # steps of batches (e.g. system_ids) or without label
+    for label in LABELS:
+        if label not in df.columns:
+            df = df.with_columns(pl.lit(None, dtype=pl.String).alias(label))
+    return df.with_columns(pl.col(LABELS).cast(pl.String))
+
+
+def summarise(df: pl.DataFrame, per_label: bool = False) -> pl.DataFrame:
+    keys = ["script", "step"] + (LABELS if per_label else [])
+    # latest run of each script
+    last_run = pl.col("run") == pl.col("run").max().over("script")
+
+    return df.with_columns(last_run.alias("last_run")) \
+        .group_by(keys) \
+        .agg(pl.len().alias("calls"),
+             pl.col("wall_s").sum().alias("total_s"),
+             pl.col("wall_s").mean().alias("mean_s"),
+             pl.col("wall_s").max().alias("max_s"),
+             (pl.col("wall_s").sum() / pl.col("run").n_unique()).alias("mean_run_s"),
+             pl.col("wall_s").filter("last_run").sum().alias("last_run_s"),
+             (pl.col("cpu_s").sum() / pl.col("wall_s").sum()).alias("cpu_ratio"),
+             (pl.col("rows_in").sum() / pl.col("wall_s").filter(
+                 pl.col("rows_in").is_not_null()).sum()).fill_nan(None).alias("rows_per_s"),
+             pl.col("peak_rss_mb").max(),
+             (~pl.col("ok")).sum().alias("failed")) \
+        .with_columns((pl.col("total_s") / pl.col("total_s").sum()).alias("share")) \
+        .sort("total_s", descending=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rank pipeline steps by wall time across runs.")
+    parser.add_argument("files",
+                        nargs="*",
+                        help=f"Metrics files (default: {DEFAULT_PATTERN})")
+    parser.add_argument("--runs",
+                        type=int,
+                        default=None,
+                        help="Only the latest N runs")
+    parser.add_argument("--script", default=None, help="Only steps of a script")
+    parser.add_argument("--per-label",
+                        action="store_true",
+                        help="Rank per system/site instead of per step")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    df = load_metrics(args.files or sorted(glob.glob(DEFAULT_PATTERN)))
+    if len(df) == 0:
+        print("No metrics found")
+        return
+
+    if args.script is not None:
+        df = df.filter(pl.col("script") == args.script)
+    if args.runs is not None:
+        runs = df["run"].unique().sort().tail(args.runs)
+        df = df.filter(pl.col("run").is_in(runs))
+
+    print(f"{df['run'].n_unique()} runs, {len(df)} steps")
+    with pl.Config(tbl_rows=args.top,
+                   tbl_cols=-1,
+                   tbl_width_chars=200,
+                   float_precision=2,
+                   tbl_hide_dataframe_shape=True,
+                   tbl_hide_column_data_types=True):
+        print(summarise(df, args.per_label).head(args.top))
+
+
+if __name__ == "__main__":
+    main()